@@ -0,0 +1,81 @@
+import asyncio
+import os
+from telebot.async_telebot import AsyncTeleBot
+from dotenv import load_dotenv
+from database import AsyncDatabase
+from prefetch import RatePrefetcher
+from metrics import METRICS_PORT, install_metrics, start_metrics_server
+from tracing import TRACE_SLOW_MS, install_tracing
+from workers import install_async_ordering
+from current_api import async_http_client, rate_history
+from handlers import AsyncHandlers
+
+# Загрузка переменных окружения
+load_dotenv()
+
+# Инициализация бота
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+if not BOT_TOKEN:
+    raise ValueError("BOT_TOKEN не найден в переменных окружения!")
+
+bot = AsyncTeleBot(BOT_TOKEN)
+db = AsyncDatabase()
+# Полученные курсы записываются в базу: запасной курс без сети и история
+rate_history.attach(db.db, db)
+# Фоновый прогрев курсов для пар активных путешествий
+rate_prefetcher = RatePrefetcher(db.db)
+# Те же обработчики, что у bot.py (handlers.py), в цикле событий
+handlers = AsyncHandlers(bot, db)
+handlers.register(bot)
+
+
+async def main():
+    print("=" * 50)
+    print("Запуск бота Travel Wallet (asyncio)...")
+    
+    # Проверяем информацию о боте
+    try:
+        bot_info = await bot.get_me()
+        print(f"Бот подключен: @{bot_info.username} ({bot_info.first_name})")
+    except Exception as e:
+        print(f"❌ Ошибка при получении информации о боте: {e}")
+        print("Проверьте правильность токена в файле .env")
+        return
+    
+    print("Ожидание сообщений...")
+    print("=" * 50)
+    
+    try:
+        # Удаляем старые вебхуки если есть
+        await bot.delete_webhook()
+        print("Вебхуки удалены")
+        
+        # Метрики обработчиков, базы и API курсов на /metrics
+        if METRICS_PORT:
+            install_metrics(bot)
+            start_metrics_server()
+        
+        # Трассы апдейтов дольше TRACE_SLOW_MS пишутся в лог в JSON
+        if TRACE_SLOW_MS:
+            install_tracing(bot)
+        
+        # Фоновый прогрев курсов (заодно обновляет матрицу кросс-курсов)
+        rate_prefetcher.start()
+        
+        # Запускаем polling: апдейты одного пользователя обрабатываются
+        # по порядку, разных пользователей - параллельно
+        install_async_ordering(bot)
+        print("Запуск polling...")
+        await bot.polling(non_stop=True, interval=0, timeout=20)
+    finally:
+        rate_prefetcher.stop()
+        await async_http_client.close()
+        await bot.close_session()
+        db.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\nБот остановлен пользователем")
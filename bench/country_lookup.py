@@ -0,0 +1,139 @@
+"""
+Бенчмарк и таблица корректности поиска валюты по стране.
+
+Сравнивает прежний get_currency_by_country (два прохода по всей таблице с
+.lower() на каждом ключе и поиском подстроки) с индексом CountryIndex.
+Сначала печатается таблица: ввод, ожидаемая валюта, ответ старой и новой
+реализации; затем время одного поиска для каждой группы вводов.
+
+Запуск:
+    python bench/country_lookup.py --repeat 2000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from current_api import COUNTRY_TO_CURRENCY, CountryIndex, get_currency_by_country
+
+# (ввод, ожидаемая валюта)
+CASES = [
+    # Точные названия и коды
+    ("Россия", "RUB"),
+    ("USA", "USD"),
+    ("IN", "INR"),
+    ("it", "EUR"),
+    ("ОАЭ", "AED"),
+    # Регистр, ё, лишние пробелы и пунктуация
+    ("  германия ", "EUR"),
+    ("ЮЖНАЯ КОРЕЯ", "KRW"),
+    ("Южно Африканская республика", "ZAR"),
+    ("united  kingdom", "GBP"),
+    # Начало названия или слова
+    ("Герман", "EUR"),
+    ("Штаты", "USD"),
+    ("Эмираты", "AED"),
+    # Название внутри более длинного ввода
+    ("Россия, Москва", "RUB"),
+    ("Республика Корея", "KRW"),
+    ("Thailand (Bangkok)", "THB"),
+    # Опечатки
+    ("Германя", "EUR"),
+    ("Фанция", "EUR"),
+    ("Швецария", "CHF"),
+    ("Tailand", "THB"),
+    ("Japn", "JPY"),
+    # Не страны из таблицы - ответа быть не должно
+    ("Индонезия", None),
+    ("Финиш", None),
+    ("in", "INR"),
+    ("Ин", None),
+    ("Марс", None),
+    ("", None),
+]
+
+# Группы вводов для замера времени
+TIMING_GROUPS = {
+    "точное совпадение": ["Россия", "USA", "Japan", "Новая Зеландия"],
+    "регистр и пробелы": ["  германия ", "ЮЖНАЯ КОРЕЯ", "united  kingdom"],
+    "начало названия": ["Герман", "Штаты", "Эмираты"],
+    "опечатки": ["Германя", "Швецария", "Tailand"],
+    "не найдено": ["Индонезия", "Марс", "Atlantis"],
+}
+
+
+def legacy_get_currency_by_country(country: str) -> Optional[str]:
+    """Прежняя реализация: точное совпадение, затем два прохода по таблице"""
+    country_normalized = country.strip()
+    
+    if country_normalized in COUNTRY_TO_CURRENCY:
+        return COUNTRY_TO_CURRENCY[country_normalized]
+    
+    for key, currency in COUNTRY_TO_CURRENCY.items():
+        if key.lower() == country_normalized.lower():
+            return currency
+    
+    country_lower = country_normalized.lower()
+    for key, currency in COUNTRY_TO_CURRENCY.items():
+        key_lower = key.lower()
+        if country_lower in key_lower or key_lower in country_lower:
+            return currency
+    
+    return None
+
+
+def print_correctness_table() -> int:
+    """Печатает таблицу корректности и возвращает число ошибок нового поиска"""
+    print(f"{'Ввод':<30} {'Ожидается':<10} {'Было':<10} {'Стало':<10}")
+    print("-" * 64)
+    errors = 0
+    for query, expected in CASES:
+        old = legacy_get_currency_by_country(query)
+        new = get_currency_by_country(query)
+        mark = "" if new == expected else "  <-- ошибка"
+        errors += new != expected
+        print(f"{query!r:<30} {str(expected):<10} {str(old):<10} {str(new):<10}{mark}")
+    
+    old_correct = sum(legacy_get_currency_by_country(q) == e for q, e in CASES)
+    print(f"\nВерно: было {old_correct}/{len(CASES)}, стало {len(CASES) - errors}/{len(CASES)}")
+    return errors
+
+
+def measure(func, queries: list, repeat: int) -> float:
+    """Медиана времени одного поиска, микросекунды"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for query in queries:
+            func(query)
+        timings.append((time.perf_counter() - start) / len(queries) * 1_000_000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=1000)
+    args = parser.parse_args()
+    
+    errors = print_correctness_table()
+    
+    start = time.perf_counter()
+    CountryIndex(COUNTRY_TO_CURRENCY)
+    print(f"\nПостроение индекса ({len(COUNTRY_TO_CURRENCY)} названий): "
+          f"{(time.perf_counter() - start) * 1000:.2f} мс\n")
+    
+    print(f"{'Группа':<22} {'Было, мкс':>10} {'Стало, мкс':>11}")
+    for group, queries in TIMING_GROUPS.items():
+        old = measure(legacy_get_currency_by_country, queries, args.repeat)
+        new = measure(get_currency_by_country, queries, args.repeat)
+        print(f"{group:<22} {old:>10.2f} {new:>11.2f}")
+    
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Время импорта CSV и задержка записи другого пользователя во время импорта.
+
+Импорт идет порциями (транзакция на IMPORT_CHUNK_SIZE строк), поэтому
+параллельный add_expense ждет не весь файл, а не дольше одной порции.
+
+Запуск:
+    python bench/csv_import.py --rows 50000 --chunk 1000
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from importer import import_csv
+
+# Курсы относительно USD для фиктивного get_rate
+RATES = {"USD": 1.0, "EUR": 0.9, "RUB": 90.0}
+
+
+def fake_rate(from_currency: str, to_currency: str) -> float:
+    return RATES[to_currency] / RATES[from_currency]
+
+
+def make_csv(rows: int) -> bytes:
+    """CSV с датами, валютами и описаниями"""
+    lines = ["date,amount,currency,description"]
+    currencies = ("USD", "EUR", "RUB")
+    for i in range(rows):
+        lines.append(f"2024-05-{i % 28 + 1:02d},{i % 97 + 1}.50,{currencies[i % 3]},обед {i}")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--chunk", type=int, default=1000)
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        with contextlib.redirect_stdout(io.StringIO()):
+            db = Database(os.path.join(tmp, "import.db"))
+        db.create_trip(1, "BenchFrom", "BenchTo", "RUB", "USD", 1 / 90, 10**12)
+        db.create_trip(2, "OtherFrom", "OtherTo", "RUB", "USD", 1 / 90, 10**6)
+        trip = db.get_active_trip(1)
+        other_trip_id = db.get_active_trip(2)["id"]
+        data = make_csv(args.rows)
+        
+        # Другой пользователь вводит расходы, пока идет импорт
+        latencies = []
+        done = threading.Event()
+        
+        def other_user():
+            while not done.is_set():
+                start = time.perf_counter()
+                db.add_expense(other_trip_id, 1.0, 90.0)
+                latencies.append((time.perf_counter() - start) * 1000)
+                time.sleep(0.002)
+        
+        thread = threading.Thread(target=other_user)
+        thread.start()
+        start = time.perf_counter()
+        result = import_csv(db, trip, data, get_rate=fake_rate, chunk_size=args.chunk)
+        elapsed = time.perf_counter() - start
+        done.set()
+        thread.join()
+        db.close()
+    
+    print(f"Строк: {args.rows}, порция: {args.chunk}, файл: {len(data) / 1024 / 1024:.1f} МБ")
+    print(f"Импортировано: {result.imported}, ошибок: {result.error_count}")
+    print(f"Время импорта: {elapsed:.2f} с ({result.imported / elapsed:,.0f} строк/с)")
+    if latencies:
+        latencies.sort()
+        print(f"add_expense другого пользователя во время импорта ({len(latencies)} вызовов): "
+              f"p50={statistics.median(latencies):.1f} мс  "
+              f"p95={latencies[int(len(latencies) * 0.95)]:.1f} мс  max={latencies[-1]:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Микробенчмарк задержки вызовов Database.
+
+Сравнивает старую схему "новое соединение на каждый вызов" с долгоживущим
+соединением потока (WAL, synchronous=NORMAL, кэш подготовленных выражений).
+
+Запуск (база - DB_PATH или --db-path, без них - временная, удаляется после замера):
+    DB_PATH=/app/data/bench.db python bench/db_latency.py --calls 2000
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+
+
+def measure(func, calls: int) -> list[float]:
+    """Возвращает задержки вызовов в микросекундах"""
+    timings = []
+    for i in range(calls):
+        start = time.perf_counter()
+        func(i)
+        timings.append((time.perf_counter() - start) * 1_000_000)
+    return timings
+
+
+def report(name: str, timings: list[float]):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{name:<40} mean={statistics.mean(timings):9.1f} мкс  "
+          f"p50={statistics.median(timings):9.1f} мкс  p95={p95:9.1f} мкс")
+
+
+def run(db_path: str, calls: int):
+    """Замеры на базе db_path; тестовые данные удаляются после замера"""
+    db = Database(db_path)
+    user_id = 10**9
+    db.create_trip(user_id, "BenchFrom", "BenchTo", "RUB", "EUR", 0.01, 1_000_000)
+    trip_id = db.get_active_trip(user_id)["id"]
+    db.set_user_state(user_id, "bench_state", "data")
+
+    def fresh_get_user_state(_):
+        # Так работал каждый метод Database до пула соединений
+        conn = sqlite3.connect(db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute("SELECT state, data FROM user_states WHERE user_id = ?", (user_id,))
+        cursor.fetchone()
+        conn.close()
+
+    def fresh_add_expense(_):
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO expenses (trip_id, amount_from, amount_to, description)
+            VALUES (?, ?, ?, ?)
+        """, (trip_id, 0.01, 1.0, None))
+        cursor.execute("""
+            UPDATE trips
+            SET balance_from = balance_from - ?,
+                balance_to = balance_to - ?
+            WHERE id = ?
+        """, (0.01, 1.0, trip_id))
+        conn.commit()
+        conn.close()
+
+    print(f"База: {db_path}, вызовов: {calls}\n")
+    report("get_user_state: новое соединение", measure(fresh_get_user_state, calls))
+    report("get_user_state: соединение потока",
+           measure(lambda _: db.get_user_state(user_id), calls))
+    report("get_active_trip: соединение потока",
+           measure(lambda _: db.get_active_trip(user_id), calls))
+    report("add_expense: новое соединение", measure(fresh_add_expense, calls))
+    report("add_expense: соединение потока",
+           measure(lambda _: db.add_expense(trip_id, 1.0, 0.01), calls))
+
+    # Пакет из 10 расходов одного сообщения: 10 фиксаций против одной
+    batch = [(1.0, 0.01, None)] * 10
+    report("10 x add_expense (на пакет)",
+           measure(lambda _: [db.add_expense(trip_id, 1.0, 0.01) for _ in batch], calls // 10))
+    report("add_expenses_bulk, 10 шт. (на пакет)",
+           measure(lambda _: db.add_expenses_bulk(trip_id, batch), calls // 10))
+
+    # Убираем за собой тестовые данные (внешние ключи в SQLite выключены)
+    with db.get_connection() as conn:
+        conn.execute("DELETE FROM expenses WHERE trip_id = ?", (trip_id,))
+    db.delete_trip(user_id, trip_id)
+    db.set_user_state(user_id, None)
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db-path", default=os.getenv("DB_PATH"))
+    parser.add_argument("--calls", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.db_path:
+        run(args.db_path, args.calls)
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        run(os.path.join(tmp, "bench_latency.db"), args.calls)
+
+if __name__ == "__main__":
+    main()
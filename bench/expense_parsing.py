@@ -0,0 +1,61 @@
+"""
+Проверка разбора расходов из сообщения (views.parse_expense_batch).
+
+Для каждого примера сравнивает разобранные расходы (сумма, описание) и
+фрагменты, которые не будут учтены, с ожидаемыми: суммы с пробелами между
+разрядами, несколько расходов в одном сообщении, числа, которые нельзя
+разделить, строки без суммы и сообщения больше MAX_BATCH_EXPENSES.
+Завершается с кодом 1, если хотя бы один пример разобран не так.
+
+Запуск:
+    python bench/expense_parsing.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from views import MAX_BATCH_EXPENSES, parse_expense_batch
+
+# (сообщение, ожидаемые расходы, ожидаемые неразобранные фрагменты)
+CASES = [
+    ("12.5", [(12.5, None)], []),
+    ("12,5", [(12.5, None)], []),
+    ("кофе 3,5", [(3.5, "кофе")], []),
+    ("340 такси", [(340.0, "такси")], []),
+    ("такси 1 200", [(1200.0, "такси")], []),
+    ("1 500 руб", [(1500.0, "руб")], []),
+    ("2 500,50 отель", [(2500.5, "отель")], []),
+    ("1 000", [(1000.0, None)], []),
+    ("1 000 000", [(1000000.0, None)], []),
+    ("1 200 ужин", [(1200.0, "ужин")], []),
+    ("12.5, 30, 7", [(12.5, None), (30.0, None), (7.0, None)], []),
+    ("12.5; 30; 7", [(12.5, None), (30.0, None), (7.0, None)], []),
+    ("12.5,30,7", [(12.5, None)], ["30,7"]),
+    ("12 5", [(12.0, None)], ["5"]),
+    ("такси 15\nкофе 3,5", [(15.0, "такси"), (3.5, "кофе")], []),
+    ("такси 15\nкофе", [(15.0, "такси")], ["кофе"]),
+    ("привет", [], ["привет"]),
+    ("0", [], ["0"]),
+    ("; ".join(["1"] * (MAX_BATCH_EXPENSES + 2)), [(1.0, None)] * MAX_BATCH_EXPENSES, ["1", "1"]),
+]
+
+
+def main():
+    failed = 0
+    for text, expected, expected_skipped in CASES:
+        expenses, skipped = parse_expense_batch(text)
+        ok = expenses == expected and skipped == expected_skipped
+        failed += not ok
+        shown = text if len(text) <= 30 else f"{text[:27]}..."
+        print(f"{'OK  ' if ok else 'FAIL'} {shown!r}: {expenses[:3]}{'...' if len(expenses) > 3 else ''}, "
+              f"не разобрано {skipped}")
+        if not ok:
+            print(f"     ожидалось {expected[:3]}, не разобрано {expected_skipped}")
+    
+    print(f"\nПроверено примеров: {len(CASES)}, с ошибками: {failed}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
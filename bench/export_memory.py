@@ -0,0 +1,97 @@
+"""
+Пиковая память выгрузки расходов в зависимости от числа строк.
+
+Для каждого размера путешествия выгрузка запускается в отдельном процессе,
+и печатается его пиковый RSS: потоковая выгрузка (export_expenses) против
+прежнего подхода "fetchall + сборка файла в памяти".
+
+Запуск:
+    python bench/export_memory.py --rows 1000 10000 100000
+"""
+import argparse
+import contextlib
+import csv
+import io
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from export import export_expenses
+
+USER_ID = 10**9
+
+
+def fill_database(db_path: str, rows: int):
+    """База с одним путешествием из rows расходов"""
+    # Без сообщений о миграциях в таблице результатов
+    with contextlib.redirect_stdout(io.StringIO()):
+        db = Database(db_path)
+    db.create_trip(USER_ID, "BenchFrom", "BenchTo", "RUB", "EUR", 0.01, 10**12)
+    trip_id = db.get_active_trip(USER_ID)["id"]
+    batch = [(1.5, 150.0, "обед в кафе")] * 1000
+    for _ in range(rows // 1000):
+        db.add_expenses_bulk(trip_id, batch)
+    db.add_expenses_bulk(trip_id, batch[:rows % 1000])
+    db.close()
+
+
+def export_buffered(db: Database, trip: dict) -> bytes:
+    """Прежний подход: все строки списком, файл целиком в памяти"""
+    cursor = db.get_connection().cursor()
+    cursor.execute("SELECT * FROM expenses WHERE trip_id = ? ORDER BY timestamp, id", (trip["id"],))
+    expenses = [dict(row) for row in cursor.fetchall()]
+    out = io.StringIO()
+    writer = csv.writer(out)
+    for expense in expenses:
+        writer.writerow([expense["id"], expense["timestamp"], expense["amount_to"],
+                         expense["amount_from"], expense["description"]])
+    return out.getvalue().encode("utf-8")
+
+
+def child(mode: str, db_path: str):
+    """Одна выгрузка; печатает пиковый RSS процесса в КБ"""
+    db = Database(db_path)
+    trip = db.get_active_trip(USER_ID)
+    if mode == "stream":
+        export_file, _, _ = export_expenses(db, trip, "csv")
+        export_file.close()
+    else:
+        export_buffered(db, trip)
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def measure(mode: str, db_path: str) -> int:
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", mode, db_path],
+        capture_output=True, text=True, check=True
+    )
+    return int(result.stdout.split()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "DB_PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.child:
+        child(*args.child)
+        return
+    
+    print(f"{'Строк':>8} {'Поток, МБ':>10} {'В памяти, МБ':>13}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            db_path = os.path.join(tmp, f"export_{rows}.db")
+            fill_database(db_path, rows)
+            stream = measure("stream", db_path) / 1024
+            buffered = measure("buffered", db_path) / 1024
+            print(f"{rows:>8} {stream:>10.1f} {buffered:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
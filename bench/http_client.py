@@ -0,0 +1,190 @@
+"""
+Проверка HTTP-клиентов API курсов на локальной заглушке (fake_rates.py).
+
+Для HttpClient и AsyncHttpClient проверяет:
+- последовательные запросы идут по одному keep-alive соединению;
+- одновременные запросы asyncio не открывают больше pool_size соединений;
+- ответ 503 повторяется retries раз, ответ 404 не повторяется;
+- медленный ответ прерывается по таймауту чтения на каждой попытке, а не
+  ждет ответа заглушки.
+
+Завершается с кодом 1, если хотя бы одна проверка не прошла.
+
+Запуск:
+    python bench/http_client.py --read-timeout 0.2 --retries 2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import aiohttp
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from current_api import AsyncHttpClient, HttpClient
+from fake_rates import FakeRatesServer
+
+PARAMS = {"from": "EUR", "to": "RUB", "amount": 1}
+
+
+class Checks:
+    """Результаты проверок в формате bench/query_plans.py"""
+    
+    def __init__(self):
+        self.failed = 0
+        self.total = 0
+    
+    def check(self, name: str, ok: bool, detail: str):
+        self.total += 1
+        self.failed += not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {name}: {detail}")
+
+
+def heal(server: FakeRatesServer):
+    server.fake.latency = server.fake.http_error_rate = 0.0
+
+
+def timeout_bounds(args) -> tuple:
+    """Допустимое время запроса, который каждый раз упирается в таймаут чтения"""
+    attempts = args.retries + 1
+    # Пауза перед повтором - не больше 1.5 * backoff * 2 ** attempt
+    backoff = sum(1.5 * args.backoff * 2 ** attempt for attempt in range(args.retries))
+    return attempts * args.read_timeout, attempts * args.read_timeout + backoff + 0.3
+
+
+def check_sync(server: FakeRatesServer, args, checks: Checks):
+    client = HttpClient(connect_timeout=0.5, read_timeout=args.read_timeout, retries=args.retries,
+                        backoff=args.backoff, pool_size=args.pool_size)
+    url = f"{server.url}/convert"
+    heal(server)
+    server.take_counts()
+    
+    for _ in range(args.calls):
+        client.get(url, PARAMS)
+    connections, http_requests = server.take_counts()
+    checks.check("HttpClient: соединение переиспользуется", connections == 1 and http_requests == args.calls,
+                 f"{http_requests} запросов по {connections} соединениям")
+    
+    server.fake.http_error_rate = 1.0
+    try:
+        client.get(url, PARAMS)
+        raised = False
+    except requests.exceptions.HTTPError:
+        raised = True
+    _, http_requests = server.take_counts()
+    checks.check("HttpClient: 503 повторяется", raised and http_requests == args.retries + 1,
+                 f"{http_requests} попыток (ожидалось {args.retries + 1}), ошибка: {raised}")
+    heal(server)
+    
+    try:
+        client.get(f"{server.url}/missing")
+        raised = False
+    except requests.exceptions.HTTPError:
+        raised = True
+    _, http_requests = server.take_counts()
+    checks.check("HttpClient: 404 не повторяется", raised and http_requests == 1,
+                 f"{http_requests} попыток, ошибка: {raised}")
+    
+    server.fake.latency = args.read_timeout * 3
+    start = time.perf_counter()
+    try:
+        client.get(url, PARAMS)
+        raised = False
+    except requests.exceptions.Timeout:
+        raised = True
+    elapsed = time.perf_counter() - start
+    _, http_requests = server.take_counts()
+    low, high = timeout_bounds(args)
+    checks.check("HttpClient: таймаут чтения на каждой попытке",
+                 raised and http_requests == args.retries + 1 and low <= elapsed <= high,
+                 f"{http_requests} попыток за {elapsed * 1000:.0f} мс (допустимо {low * 1000:.0f}-{high * 1000:.0f})")
+    heal(server)
+
+
+async def check_async(server: FakeRatesServer, args, checks: Checks):
+    url = f"{server.url}/convert"
+    heal(server)
+    server.take_counts()
+    
+    client = AsyncHttpClient(connect_timeout=0.5, read_timeout=args.read_timeout, retries=args.retries,
+                             backoff=args.backoff, pool_size=args.pool_size)
+    for _ in range(args.calls):
+        await client.get_json(url, PARAMS)
+    connections, http_requests = server.take_counts()
+    checks.check("AsyncHttpClient: соединение переиспользуется",
+                 connections == 1 and http_requests == args.calls,
+                 f"{http_requests} запросов по {connections} соединениям")
+    await client.close()
+    
+    # Одновременные запросы: соединений не больше размера пула
+    client = AsyncHttpClient(connect_timeout=0.5, read_timeout=args.read_timeout, retries=args.retries,
+                             backoff=args.backoff, pool_size=args.pool_size)
+    server.fake.latency = 0.02
+    await asyncio.gather(*(client.get_json(url, PARAMS) for _ in range(args.calls)))
+    connections, http_requests = server.take_counts()
+    checks.check("AsyncHttpClient: одновременные запросы в пределах пула",
+                 0 < connections <= args.pool_size and http_requests == args.calls,
+                 f"{http_requests} запросов по {connections} соединениям (пул {args.pool_size})")
+    heal(server)
+    
+    server.fake.http_error_rate = 1.0
+    try:
+        await client.get_json(url, PARAMS)
+        raised = False
+    except aiohttp.ClientResponseError:
+        raised = True
+    _, http_requests = server.take_counts()
+    checks.check("AsyncHttpClient: 503 повторяется", raised and http_requests == args.retries + 1,
+                 f"{http_requests} попыток (ожидалось {args.retries + 1}), ошибка: {raised}")
+    heal(server)
+    
+    try:
+        await client.get_json(f"{server.url}/missing")
+        raised = False
+    except aiohttp.ClientResponseError:
+        raised = True
+    _, http_requests = server.take_counts()
+    checks.check("AsyncHttpClient: 404 не повторяется", raised and http_requests == 1,
+                 f"{http_requests} попыток, ошибка: {raised}")
+    
+    server.fake.latency = args.read_timeout * 3
+    start = time.perf_counter()
+    try:
+        await client.get_json(url, PARAMS)
+        raised = False
+    except asyncio.TimeoutError:
+        raised = True
+    elapsed = time.perf_counter() - start
+    _, http_requests = server.take_counts()
+    low, high = timeout_bounds(args)
+    checks.check("AsyncHttpClient: таймаут чтения на каждой попытке",
+                 raised and http_requests == args.retries + 1 and low <= elapsed <= high,
+                 f"{http_requests} попыток за {elapsed * 1000:.0f} мс (допустимо {low * 1000:.0f}-{high * 1000:.0f})")
+    heal(server)
+    await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=20)
+    parser.add_argument("--read-timeout", type=float, default=0.2, help="таймаут чтения клиента, секунды")
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--backoff", type=float, default=0.02, help="базовая пауза между повторами, секунды")
+    parser.add_argument("--pool-size", type=int, default=4)
+    args = parser.parse_args()
+    
+    server = FakeRatesServer().start()
+    checks = Checks()
+    check_sync(server, args, checks)
+    asyncio.run(check_async(server, args, checks))
+    server.stop()
+    
+    print(f"\nПроверок: {checks.total}, с ошибками: {checks.failed}")
+    sys.exit(1 if checks.failed else 0)
+
+
+if __name__ == "__main__":
+    main()
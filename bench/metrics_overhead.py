@@ -0,0 +1,100 @@
+"""
+Накладные расходы оберток metrics.py на один вызов.
+
+Сравнивает вызов пустой функции и метода Database (get_dashboard на
+временной базе) без обертки и с ней (лучшее из пяти измерений), затем
+ту же пустую функцию из нескольких потоков одновременно и время
+формирования ответа /metrics.
+
+Запуск:
+    python bench/metrics_overhead.py --calls 200000 --threads 8
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from metrics import MetricsRegistry
+
+
+def noop(value):
+    return value
+
+
+def per_call_ns(func, calls: int, repeat: int = 5) -> float:
+    """Лучшее из repeat измерений среднего времени вызова"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in range(calls):
+            func(i)
+        best = min(best, time.perf_counter() - start)
+    return best / calls * 1e9
+
+
+def threaded_per_call_ns(func, calls: int, threads: int) -> float:
+    """Среднее время вызова, когда threads потоков вызывают func одновременно"""
+    barrier = threading.Barrier(threads + 1)
+    
+    def worker():
+        barrier.wait()
+        for i in range(calls):
+            func(i)
+    
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for worker_thread in workers:
+        worker_thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.join()
+    return (time.perf_counter() - start) / (calls * threads) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+    
+    registry = MetricsRegistry()
+    wrapped_noop = registry.wrap(noop, "bench")
+    plain = per_call_ns(noop, args.calls)
+    wrapped = per_call_ns(wrapped_noop, args.calls)
+    print(f"{'Вызов':<36} {'без обертки, нс':>16} {'с оберткой, нс':>15} {'разница, нс':>12}")
+    print(f"{'пустая функция':<36} {plain:>16.0f} {wrapped:>15.0f} {wrapped - plain:>12.0f}")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        with contextlib.redirect_stdout(io.StringIO()):
+            db = Database(os.path.join(tmp, "metrics.db"))
+        db.create_trip(1, "BenchFrom", "BenchTo", "RUB", "USD", 1 / 90, 100000)
+        db_calls = max(args.calls // 20, 1)
+        wrapped_dashboard = registry.wrap(db.get_dashboard, "db", "get_dashboard")
+        plain_db = per_call_ns(db.get_dashboard, db_calls)
+        wrapped_db = per_call_ns(wrapped_dashboard, db_calls)
+        db.close()
+    print(f"{'Database.get_dashboard':<36} {plain_db:>16.0f} {wrapped_db:>15.0f} {wrapped_db - plain_db:>12.0f}")
+    
+    calls = max(args.calls // args.threads, 1)
+    plain_threads = threaded_per_call_ns(noop, calls, args.threads)
+    wrapped_threads = threaded_per_call_ns(wrapped_noop, calls, args.threads)
+    print(f"{f'пустая функция, {args.threads} потоков':<36} {plain_threads:>16.0f} {wrapped_threads:>15.0f} "
+          f"{wrapped_threads - plain_threads:>12.0f}")
+    
+    # Ответ /metrics для набора имен порядка числа обработчиков и методов бота
+    for i in range(60):
+        registry.wrap(noop, "bench", f"call_{i}")(i)
+    start = time.perf_counter()
+    body = registry.render()
+    print(f"\n/metrics: {len(body.splitlines())} строк за {(time.perf_counter() - start) * 1000:.2f} мс")
+
+
+if __name__ == "__main__":
+    main()
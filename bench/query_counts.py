@@ -0,0 +1,112 @@
+"""
+Проверка числа запросов SQLite на апдейт.
+
+Прогоняет через обработчики handlers.py в bot.py (временная база, транспорт Bot API и
+API курсов без сети - как в bench/update_replay.py) типичный путь
+пользователя: создание путешествия, расходы, история, переключение
+путешествий. Для каждого апдейта сравнивает с ожидаемыми число
+выражений SQLite (включая BEGIN/COMMIT) и число чтений состояния
+пользователя. Путь сначала проходит другой пользователь, чтобы курсы уже
+были в кэше; у каждого пользователя заранее есть еще одно путешествие,
+на которое он переключается.
+Завершается с кодом 1, если число запросов изменилось.
+
+Запуск:
+    python bench/query_counts.py
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from update_replay import FakeTelegram, QueryCounter, Replay, free_port, load_bot, seed_trip
+
+# (вид апдейта, данные, название, ожидаемое число выражений SQLite, чтений состояния);
+# вид button - нажатие первой кнопки последней клавиатуры с этим префиксом.
+# Текст читает состояние один раз (get_dashboard в handle_text); второе чтение -
+# меню после изменения путешествия
+USER_PATH = [
+    ("message", "/start", "start", 7, 1),
+    ("message", "/newtrip", "newtrip", 3, 0),
+    ("message", "Россия", "from_country", 4, 1),
+    ("message", "США", "to_country", 4, 1),
+    ("message", "100000", "initial_amount", 13, 2),
+    ("message", "12.5", "expense", 4, 1),
+    ("callback", "expense_yes", "expense_yes", 9, 2),
+    ("message", "340 такси", "expense (описание)", 4, 1),
+    ("callback", "expense_no", "expense_no", 4, 1),
+    ("callback", "history", "history", 2, 0),
+    ("message", "/switch", "switch", 2, 0),
+    ("button", "switch_trip|", "switch_trip", 6, 0),
+    ("callback", "back_to_menu", "back_to_menu", 4, 1),
+    ("message", "/balance", "balance", 1, 1),
+]
+
+
+class StatementLog(QueryCounter):
+    """QueryCounter, который запоминает сами выражения"""
+    
+    def __init__(self):
+        super().__init__()
+        self.statements = []
+    
+    def __call__(self, statement: str):
+        super().__call__(statement)
+        self.statements.append(statement)
+
+
+def state_reads(statements: list) -> int:
+    """Чтения состояния пользователя (get_dashboard и get_user_state)"""
+    return sum(1 for statement in statements
+               if statement.lstrip().upper().startswith("SELECT") and "user_states" in statement)
+
+
+def walk(replay: Replay, user: int, log: StatementLog, record: bool) -> list:
+    """
+    Проходит USER_PATH; для record=True - (название, ожидалось выражений,
+    выражений, ожидалось чтений состояния, чтений состояния)
+    """
+    seed_trip(replay, user, 0)
+    results = []
+    for kind, data, name, expected, expected_reads in USER_PATH:
+        if kind == "button":
+            buttons = replay.buttons(user, data)
+            kind, data = "callback", buttons[0] if buttons else data
+        log.statements = []
+        before = log.count
+        getattr(replay, kind)(user, data)
+        if record:
+            results.append((name, expected, log.count - before, expected_reads, state_reads(log.statements)))
+    return results
+
+
+def main():
+    telegram = FakeTelegram()
+    log = StatementLog()
+    with tempfile.TemporaryDirectory() as tmp:
+        rate_api_url = f"http://127.0.0.1:{free_port()}"
+        bot = load_bot(os.path.join(tmp, "queries.db"), rate_api_url, telegram, log)
+        from fake_rates import FakeRatesServer
+        server = FakeRatesServer(port=int(rate_api_url.rsplit(":", 1)[1])).start()
+        replay = Replay(bot, telegram, log)
+        
+        walk(replay, 1, log, record=False)
+        results = walk(replay, 2, log, record=True)
+        
+        server.stop()
+        bot.db.close()
+    
+    failed = 0
+    print(f"{'Апдейт':<22} {'выражений (ожидалось)':>22} {'чтений состояния (ожидалось)':>29}")
+    for name, expected, count, expected_reads, reads in results:
+        ok = count == expected and reads == expected_reads
+        failed += not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {name:<17} {count:>14} ({expected:>3}) {reads:>21} ({expected_reads:>3})")
+    
+    print(f"\nПроверено апдейтов: {len(results)}, с ошибками: {failed}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Проверка планов частых запросов (EXPLAIN QUERY PLAN).
+
+Создает временную базу через Database (со всеми миграциями), заполняет ее
+данными и проверяет, что каждый частый запрос идет по ожидаемому индексу,
+не сканирует таблицу целиком и не сортирует результат во временном B-дереве.
+Завершается с кодом 1, если хотя бы один план изменился, поэтому подходит
+для запуска в CI после изменения схемы или запросов.
+
+Запуск:
+    python bench/query_plans.py
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+
+# (название, запрос, параметры, индекс, который должен использоваться)
+HOT_QUERIES = [
+    ("get_active_trip",
+     "SELECT * FROM trips WHERE user_id = ? AND is_active = 1",
+     (1,), "idx_trips_user_active"),
+    ("get_user_trips",
+     "SELECT * FROM trips WHERE user_id = ? ORDER BY created_at DESC",
+     (1,), "idx_trips_user_created"),
+    ("get_expenses",
+     "SELECT * FROM expenses WHERE trip_id = ? ORDER BY timestamp DESC LIMIT ?",
+     (1, 20), "idx_expenses_trip_time_id"),
+    ("get_expenses_page (первая страница)",
+     "SELECT * FROM expenses WHERE trip_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?",
+     (1, 11), "idx_expenses_trip_time_id"),
+    ("get_expenses_page (старше курсора)",
+     "SELECT * FROM expenses WHERE trip_id = ? "
+     "AND (timestamp, id) < (SELECT timestamp, id FROM expenses WHERE id = ?) "
+     "ORDER BY timestamp DESC, id DESC LIMIT ?",
+     (1, 30, 11), "idx_expenses_trip_time_id"),
+    ("get_expenses_page (новее курсора)",
+     "SELECT * FROM expenses WHERE trip_id = ? "
+     "AND (timestamp, id) > (SELECT timestamp, id FROM expenses WHERE id = ?) "
+     "ORDER BY timestamp, id LIMIT ?",
+     (1, 30, 11), "idx_expenses_trip_time_id"),
+    ("get_trips_page (первая страница)",
+     "SELECT id, from_country, to_country, is_active FROM trips WHERE user_id = ? "
+     "ORDER BY created_at DESC, id DESC LIMIT ?",
+     (1, 11), "idx_trips_user_created"),
+    ("get_trips_page (старше курсора)",
+     "SELECT id, from_country, to_country, is_active FROM trips WHERE user_id = ? "
+     "AND (created_at, id) < (SELECT created_at, id FROM trips WHERE id = ?) "
+     "ORDER BY created_at DESC, id DESC LIMIT ?",
+     (1, 3, 11), "idx_trips_user_created"),
+    ("get_rate_at (курс пары на момент)",
+     "SELECT rate, fetched_at FROM rates WHERE base = ? AND quote = ? AND fetched_at <= ? "
+     "ORDER BY fetched_at DESC LIMIT 1",
+     ("USD", "EUR", "2024-06-01 00:00:00"), "idx_rates_pair_time"),
+    ("switch_trip (сброс активного)",
+     "UPDATE trips SET is_active = 0 WHERE user_id = ?",
+     (1,), "idx_trips_user_created"),
+]
+
+
+def seed(db: Database, users: int = 50, trips_per_user: int = 4, expenses_per_trip: int = 50):
+    """Заполняет базу, чтобы планировщик видел не пустые таблицы"""
+    conn = db.get_connection()
+    with conn:
+        for user_id in range(1, users + 1):
+            for n in range(trips_per_user):
+                cursor = conn.execute("""
+                    INSERT INTO trips (user_id, from_country, to_country, from_currency,
+                                       to_currency, rate, is_active)
+                    VALUES (?, ?, ?, 'RUB', 'EUR', 0.01, ?)
+                """, (user_id, "Россия", f"Страна {n}", int(n == 0)))
+                conn.executemany("""
+                    INSERT INTO expenses (trip_id, amount_from, amount_to)
+                    VALUES (?, ?, ?)
+                """, [(cursor.lastrowid, 100.0, 1.0)] * expenses_per_trip)
+        # Снимки курсов за месяц: каждый час по валюте
+        conn.executemany("""
+            INSERT INTO rates (base, quote, rate, fetched_at)
+            VALUES ('USD', ?, 1.0, datetime('2024-05-01', ?))
+        """, [(quote, f"+{hour} hours") for quote in ("EUR", "RUB", "CNY") for hour in range(24 * 30)])
+    conn.execute("ANALYZE")
+
+
+def check_plan(conn, name: str, query: str, params: tuple, index: str) -> bool:
+    plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+    problems = []
+    if not any(index in step for step in plan):
+        problems.append(f"не используется {index}")
+    problems.extend(step for step in plan if step.startswith("SCAN") or "TEMP B-TREE" in step)
+    
+    print(f"{'OK  ' if not problems else 'FAIL'} {name}")
+    for step in plan:
+        print(f"       {step}")
+    for problem in problems:
+        print(f"       ! {problem}")
+    return not problems
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "plans.db"))
+        seed(db)
+        conn = db.get_connection()
+        print(f"Версия схемы: {db.get_schema_version()}\n")
+        results = [check_plan(conn, *query) for query in HOT_QUERIES]
+        db.close()
+    
+    failed = results.count(False)
+    print(f"\nПроверено запросов: {len(results)}, с ошибками: {failed}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
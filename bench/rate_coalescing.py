@@ -0,0 +1,112 @@
+"""
+Объединение одновременных запросов курса одной пары.
+
+Поднимает локальную заглушку API курсов (fake_rates.py) с задержкой и
+запускает N одновременных поисков курса EUR -> RUB (часть вызовов просит
+обратную пару RUB -> EUR): сначала прямыми запросами к API, затем через
+RateCache (потоки) и через async_get_rate (asyncio). Печатает число
+запросов, дошедших до сервера, и время.
+
+Завершается с кодом 1, если через RateCache (потоки или asyncio) до
+сервера дошло не ровно один запрос: обратная пара должна браться из того
+же ответа, а одновременные вызовы - ждать одного запроса.
+
+Запуск:
+    python bench/rate_coalescing.py --callers 50 --delay 0.2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from current_api import AsyncHttpClient, HttpClient, RateCache, _check_convert_response, _parse_rate
+from fake_rates import FakeRates, FakeRatesServer
+
+def pair_for(caller: int) -> tuple[str, str]:
+    """Каждый пятый вызов просит обратную пару"""
+    return ("RUB", "EUR") if caller % 5 == 4 else ("EUR", "RUB")
+
+
+def run_threads(callers: int, lookup) -> float:
+    """Запускает callers потоков одновременно; возвращает время до завершения всех"""
+    barrier = threading.Barrier(callers)
+    results = [None] * callers
+    
+    def worker(caller: int):
+        barrier.wait()
+        from_currency, to_currency = pair_for(caller)
+        # Каждый вызов пересчитывает свою сумму по общему курсу
+        results[caller] = (caller + 1) * lookup(from_currency, to_currency)
+    
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(callers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(result for result in results)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--callers", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.2, help="задержка ответа заглушки, секунды")
+    args = parser.parse_args()
+    
+    stub = FakeRatesServer(FakeRates(latency=args.delay)).start()
+    url = f"{stub.url}/convert"
+    client = HttpClient(pool_size=args.callers)
+    
+    def fetch(from_currency: str, to_currency: str):
+        params = {"from": from_currency, "to": to_currency, "amount": 1}
+        return _parse_rate(_check_convert_response(client.get(url, params=params).json()))
+    
+    print(f"Вызовов: {args.callers}, задержка API: {args.delay * 1000:.0f} мс\n")
+    print(f"     {'Вариант':<28} {'Запросов к API':>15} {'Время, мс':>10}")
+    failed = 0
+    
+    def report(name: str, requests: int, elapsed: float, expected: int = None):
+        nonlocal failed
+        ok = expected is None or requests == expected
+        failed += not ok
+        status = "    " if expected is None else "OK  " if ok else "FAIL"
+        print(f"{status} {name:<28} {requests:>15} {elapsed * 1000:>10.0f}")
+    
+    elapsed = run_threads(args.callers, fetch)
+    report("без кэша (потоки)", stub.fake.take_requests(), elapsed)
+    
+    cache = RateCache(fetch)
+    elapsed = run_threads(args.callers, cache.get_rate)
+    report("RateCache (потоки)", stub.fake.take_requests(), elapsed, expected=1)
+    
+    async def async_run() -> float:
+        async_client = AsyncHttpClient(pool_size=args.callers)
+        
+        async def async_fetch(from_currency: str, to_currency: str):
+            params = {"from": from_currency, "to": to_currency, "amount": 1}
+            return _parse_rate(_check_convert_response(await async_client.get_json(url, params=params)))
+        
+        async_cache = RateCache(fetch, async_fetch)
+        start = time.perf_counter()
+        rates = await asyncio.gather(*(async_cache.async_get_rate(*pair_for(i)) for i in range(args.callers)))
+        elapsed = time.perf_counter() - start
+        assert all(rates)
+        await async_client.close()
+        return elapsed
+    
+    elapsed = asyncio.run(async_run())
+    report("RateCache (asyncio)", stub.fake.take_requests(), elapsed, expected=1)
+    stub.stop()
+    
+    if failed:
+        print(f"\nRateCache отправил к API больше одного запроса в {failed} вариантах")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Задержка получения курса во время сбоя API: с автоматом отключения и без.
+
+Поднимает локальную заглушку API курсов (fake_rates.py), которая по
+команде отвечает медленно (дольше таймаута чтения), ошибкой
+success: false или кодом 503.
+Для каждого вида сбоя делает серию последовательных запросов курса через
+RateCache с ttl=0 (каждый запрос идет к провайдерам) и печатает, сколько
+запросов дошло до заглушки и перцентили задержки. Затем заглушка
+восстанавливается, и после RATE_BREAKER_RESET пробный запрос закрывает
+автомат. Отдельно проверяется локальная таблица курсов для пары, курса
+которой еще нет в кэше, и то, что отказы API по неизвестным кодам валют
+(как из CSV пользователя) не открывают автомат.
+
+Завершается с кодом 1, если с автоматом до заглушки дошло больше
+failures * (retries + 1) запросов, не каждый запрос получил курс, p50
+задержки не близка к нулю, автомат не открылся во время сбоя или не
+закрылся после пробного запроса, локальная таблица не ответила, либо
+автомат открылся от отказов по неизвестным валютам.
+
+Запуск:
+    python bench/rate_failover.py --calls 40 --read-timeout 0.3
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from current_api import CircuitBreaker, ConvertProvider, HttpClient, ProviderChain, RateCache, TableProvider
+from fake_rates import FakeRates, FakeRatesServer
+
+# Виды сбоя: название -> настройки заглушки
+FAULTS = {
+    "slow": lambda fake, read_timeout: setattr(fake, "latency", read_timeout * 3),
+    "error": lambda fake, read_timeout: setattr(fake, "error_rate", 1.0),
+    "503": lambda fake, read_timeout: setattr(fake, "http_error_rate", 1.0),
+}
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+def heal(fake: FakeRates):
+    """Снимает все сбои заглушки"""
+    fake.latency = fake.error_rate = fake.http_error_rate = 0.0
+
+
+def make_cache(server: FakeRatesServer, client: HttpClient, failures: int,
+               reset: float) -> tuple[RateCache, CircuitBreaker]:
+    """RateCache без кэширования (ttl=0): каждый запрос идет к провайдерам"""
+    breaker = CircuitBreaker(failures, reset)
+    chain = ProviderChain([
+        ConvertProvider(url=f"{server.url}/convert", client=client, breaker=breaker),
+        TableProvider({"USD": 1.0, "GBP": 0.79}),
+    ])
+    return RateCache(chain.fetch, ttl=0, fallback=chain.fallback), breaker
+
+
+def run_series(cache: RateCache, calls: int) -> tuple[list, int]:
+    """Последовательные запросы курса; задержки и число полученных курсов"""
+    latencies = []
+    answered = 0
+    for _ in range(calls):
+        start = time.perf_counter()
+        rate = cache.get_rate("EUR", "RUB")
+        latencies.append(time.perf_counter() - start)
+        answered += rate is not None
+    return latencies, answered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=40)
+    parser.add_argument("--read-timeout", type=float, default=0.3, help="таймаут чтения клиента, секунды")
+    parser.add_argument("--failures", type=int, default=3, help="ошибок подряд до открытия автомата")
+    parser.add_argument("--reset", type=float, default=1.0, help="время до пробного запроса, секунды")
+    parser.add_argument("--max-p50", type=float, default=5.0,
+                        help="допустимая p50 задержки с открытым автоматом, мс")
+    args = parser.parse_args()
+    
+    server = FakeRatesServer().start()
+    fake = server.fake
+    client = HttpClient(connect_timeout=0.5, read_timeout=args.read_timeout, retries=1, backoff=0.05)
+    
+    print(f"Запросов в серии: {args.calls}, таймаут чтения: {args.read_timeout * 1000:.0f} мс, "
+          f"повторов: {client.retries}\n")
+    print(f"     {'Сбой':<7} {'Автомат':<8} {'К API':>6} {'Ответов':>8} {'p50, мс':>9} {'p95, мс':>9} {'max, мс':>9}")
+    
+    # Сообщения об ошибках провайдера не нужны в отчете
+    with contextlib.redirect_stdout(io.StringIO()) as log:
+        rows = []
+        for mode, inject in FAULTS.items():
+            # Без автомата: порог ошибок недостижим
+            for label, failures in (("нет", 10 ** 9), ("да", args.failures)):
+                cache, _ = make_cache(server, client, failures, args.reset)
+                heal(fake)
+                cache.get_rate("EUR", "RUB")
+                fake.take_requests()
+                inject(fake, args.read_timeout)
+                latencies, answered = run_series(cache, args.calls)
+                rows.append((mode, label, fake.take_requests(), answered, latencies))
+        
+        # Восстановление: после reset пробный запрос закрывает автомат
+        cache, breaker = make_cache(server, client, args.failures, args.reset)
+        FAULTS["503"](fake, args.read_timeout)
+        run_series(cache, args.failures + 2)
+        state_during = breaker.state
+        heal(fake)
+        time.sleep(args.reset)
+        cache.get_rate("EUR", "RUB")
+        state_after = breaker.state
+        
+        # Курса пары нет ни в кэше, ни в истории: отвечает локальная таблица
+        FAULTS["503"](fake, args.read_timeout)
+        fallback_rate = cache.get_rate("USD", "GBP")
+        
+        # Неизвестные коды валют: API отвечает отказом, но провайдер доступен
+        heal(fake)
+        cache, rejected_breaker = make_cache(server, client, args.failures, args.reset)
+        unknown_rates = [cache.get_rate(code, "EUR") for code in ("XYZ", "QQQ", "ABC", "ZZZ")]
+        rejected_state = rejected_breaker.state
+    
+    # С автоматом к API доходят только запросы до его открытия (каждый с повторами)
+    max_hits = args.failures * (client.retries + 1)
+    failed = 0
+    for mode, label, hits, answered, latencies in rows:
+        p50 = percentile(latencies, 0.5)
+        status = "    "
+        if label == "да":
+            ok = hits <= max_hits and answered == args.calls and p50 <= args.max_p50
+            failed += not ok
+            status = "OK  " if ok else "FAIL"
+        print(f"{status} {mode:<7} {label:<8} {hits:>6} {answered:>8} {p50:>9.1f} "
+              f"{percentile(latencies, 0.95):>9.1f} {max(latencies) * 1000:>9.1f}")
+    
+    checks = [
+        (state_during == CircuitBreaker.OPEN and state_after == CircuitBreaker.CLOSED,
+         f"автомат во время сбоя: {state_during}, после восстановления и пробного запроса: {state_after}"),
+        (fallback_rate is not None and abs(fallback_rate - 0.79) < 1e-9,
+         f"курс USD -> GBP из локальной таблицы во время сбоя: {fallback_rate}"),
+        (rejected_state == CircuitBreaker.CLOSED and unknown_rates == [None] * 4,
+         f"автомат после отказов API по неизвестным валютам: {rejected_state}, курсы: {unknown_rates}"),
+    ]
+    print()
+    for ok, detail in checks:
+        failed += not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {detail}")
+    print(f"Строк журнала об ошибках провайдера: {len(log.getvalue().splitlines())}")
+    server.stop()
+    
+    print(f"\nДопустимо с автоматом: не больше {max_hits} запросов к API, p50 не больше {args.max_p50} мс; "
+          f"проверок с ошибками: {failed}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Накладные расходы трассировки (tracing.py) на один вызов.
+
+Сравнивает вызов пустой функции и метода Database (get_dashboard на
+временной базе) без обертки, с оберткой вне трассы (вызов не из
+обработчика апдейта) и внутри трассы (лучшее из пяти измерений). Затем
+прогоняет обработчик с дочерними спанами и печатает его запись в журнале
+медленных трасс и время ее формирования.
+
+Запуск:
+    python bench/tracing_overhead.py --calls 200000
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from tracing import Tracer, traced
+
+
+def noop(value):
+    return value
+
+
+def per_call_ns(func, calls: int, repeat: int = 5) -> float:
+    """Лучшее из repeat измерений среднего времени вызова"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in range(calls):
+            func(i)
+        best = min(best, time.perf_counter() - start)
+    return best / calls * 1e9
+
+
+def in_trace(tracer: Tracer, func, calls: int) -> float:
+    """per_call_ns внутри корневого спана; спаны сбрасываются после каждого измерения"""
+    result = []
+    
+    def handler(update):
+        result.append(per_call_ns(func, calls, repeat=1))
+    
+    traced_handler = tracer.trace_handler(handler)
+    for _ in range(5):
+        traced_handler(None)
+    return min(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200000)
+    args = parser.parse_args()
+    
+    # Порог недостижим: измеряются только спаны, без записи в журнал
+    tracer = Tracer(slow_ms=float("inf"), profile_dir="")
+    traced_noop = traced(noop, "bench")
+    print(f"{'Вызов':<24} {'без обертки, нс':>16} {'вне трассы, нс':>15} {'в трассе, нс':>13}")
+    plain = per_call_ns(noop, args.calls)
+    outside = per_call_ns(traced_noop, args.calls)
+    inside = in_trace(tracer, traced_noop, args.calls)
+    print(f"{'пустая функция':<24} {plain:>16.0f} {outside:>15.0f} {inside:>13.0f}")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        with contextlib.redirect_stdout(io.StringIO()):
+            db = Database(os.path.join(tmp, "tracing.db"))
+        db.create_trip(1, "BenchFrom", "BenchTo", "RUB", "USD", 1 / 90, 100000)
+        db_calls = max(args.calls // 20, 1)
+        traced_dashboard = traced(db.get_dashboard, "db", "get_dashboard")
+        plain_db = per_call_ns(db.get_dashboard, db_calls)
+        outside_db = per_call_ns(traced_dashboard, db_calls)
+        inside_db = in_trace(tracer, traced_dashboard, db_calls)
+        print(f"{'Database.get_dashboard':<24} {plain_db:>16.0f} {outside_db:>15.0f} {inside_db:>13.0f}")
+        
+        # Апдейт из нескольких запросов к базе и "ответа" Telegram, записанный в журнал
+        records = []
+        slow_tracer = Tracer(slow_ms=0, profile_dir="", log=records.append)
+        send_message = traced(lambda text: time.sleep(0.002), "telegram", "sendMessage")
+        
+        def handle_text(update):
+            for _ in range(3):
+                traced_dashboard(1)
+            send_message("ok")
+        
+        slow_tracer.trace_handler(handle_text)(None)
+        db.close()
+    
+    traced_empty = slow_tracer.trace_handler(noop)
+    start = time.perf_counter()
+    for _ in range(1000):
+        traced_empty(None)
+    record_us = (time.perf_counter() - start) / 1000 * 1e6
+    print(f"\nЗапись медленного апдейта ({record_us:.1f} мкс на корневой спан с записью):\n{records[0]}")
+
+
+if __name__ == "__main__":
+    main()
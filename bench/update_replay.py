@@ -0,0 +1,385 @@
+"""
+Сквозная пропускная способность бота: воспроизведение потоков апдейтов без сети.
+
+Импортирует bot.py (обработчики handlers.py) с временной базой (DB_PATH), подменяет
+транспорт TeleBot (apihelper.CUSTOM_REQUEST_SENDER) на ответы без сети и
+направляет API курсов на локальную заглушку fake_rates.py. Затем
+воспроизводит синтетические сценарии: создание путешествий, серии
+расходов, листание истории и переключение путешествий. Кнопки нажимаются
+по клавиатурам из ответов бота, как это делает пользователь.
+
+Для каждого сценария печатается число апдейтов в секунду, а для каждого
+вида апдейта - p50/p95/p99 времени обработки, число выражений SQLite и
+запросов к Bot API на апдейт. --json сохраняет отчет для сравнения между
+версиями, --compare печатает разницу с сохраненным отчетом.
+
+Запуск:
+    python bench/update_replay.py --users 20 --json replay.json
+    python bench/update_replay.py --users 20 --compare replay.json
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import socket
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import requests
+from telebot import apihelper, types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+
+# Пары стран для создания путешествий (разные пары - разные курсы)
+COUNTRY_PAIRS = (
+    ("Россия", "США"), ("Россия", "Германия"), ("Россия", "Япония"), ("Россия", "Турция"),
+    ("Россия", "Таиланд"), ("Россия", "Китай"), ("Россия", "Великобритания"), ("Россия", "ОАЭ"),
+)
+# Сообщения с расходами: одно число, число с описанием и несколько расходов сразу
+EXPENSE_MESSAGES = ("12.5", "340 такси", "45\n18.2 музей\n7 вода")
+
+
+def free_port() -> int:
+    """Свободный локальный порт для заглушки API курсов"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class FakeTelegram:
+    """
+    Транспорт TeleBot без сети.
+    
+    Отвечает на любой метод Bot API успешно (sendMessage и editMessageText -
+    сообщением), считает запросы и запоминает последнюю inline-клавиатуру
+    каждого чата, чтобы сценарий мог нажать ее кнопку.
+    """
+    
+    def __init__(self):
+        self.calls = 0
+        # chat_id -> (message_id, callback_data кнопок)
+        self.keyboards: Dict[int, tuple] = {}
+        self._message_ids = itertools.count(1)
+    
+    def __call__(self, method, url, params=None, files=None, **kwargs):
+        self.calls += 1
+        method_name = url.rsplit("/", 1)[-1]
+        params = params or {}
+        result = True
+        if method_name in ("sendMessage", "editMessageText"):
+            chat_id = int(params["chat_id"])
+            message_id = int(params.get("message_id") or next(self._message_ids))
+            markup = json.loads(params.get("reply_markup") or "{}")
+            buttons = [button["callback_data"] for row in markup.get("inline_keyboard", [])
+                       for button in row if "callback_data" in button]
+            self.keyboards[chat_id] = (message_id, buttons)
+            result = {"message_id": message_id, "date": 0, "chat": {"id": chat_id, "type": "private"},
+                      "text": params.get("text", "")}
+        
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps({"ok": True, "result": result}).encode()
+        return response
+
+
+class QueryCounter:
+    """Число выражений SQLite, выполненных соединениями Database (включая BEGIN/COMMIT)"""
+    
+    def __init__(self):
+        self.count = 0
+    
+    def __call__(self, statement: str):
+        self.count += 1
+    
+    def install(self, database_cls: type):
+        """Подключает счетчик к каждому новому соединению Database"""
+        open_connection = database_cls._open_connection
+        counter = self
+        
+        def counted(self) -> sqlite3.Connection:
+            conn = open_connection(self)
+            conn.set_trace_callback(counter)
+            return conn
+        
+        database_cls._open_connection = counted
+
+
+class Replay:
+    """Отправляет апдейты боту по одному и собирает замеры по видам апдейтов"""
+    
+    def __init__(self, bot_module, telegram: FakeTelegram, queries: QueryCounter):
+        self.bot = bot_module.bot
+        self.db = bot_module.db
+        self.telegram = telegram
+        self.queries = queries
+        self._ids = itertools.count(1)
+        # Вид апдейта -> замеры
+        self.samples: Dict[str, dict] = {}
+    
+    def message(self, user: int, text: str, label: Optional[str] = None):
+        payload = {"message_id": next(self._ids), "date": 0, "text": text,
+                   "chat": {"id": user, "type": "private"},
+                   "from": {"id": user, "is_bot": False, "first_name": "Bench"}}
+        if text.startswith("/"):
+            payload["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        self._send(label, {"update_id": next(self._ids), "message": payload})
+    
+    def callback(self, user: int, data: str, label: Optional[str] = None):
+        # Кнопка нажата в последнем сообщении с клавиатурой
+        message_id = self.telegram.keyboards.get(user, (1, []))[0]
+        payload = {"id": str(next(self._ids)), "chat_instance": "bench", "data": data,
+                   "from": {"id": user, "is_bot": False, "first_name": "Bench"},
+                   "message": {"message_id": message_id, "date": 0, "text": "menu",
+                               "chat": {"id": user, "type": "private"}}}
+        self._send(label, {"update_id": next(self._ids), "callback_query": payload})
+    
+    def buttons(self, user: int, prefix: str) -> List[str]:
+        """callback_data кнопок последней клавиатуры пользователя, начинающиеся с prefix"""
+        return [data for data in self.telegram.keyboards.get(user, (0, []))[1] if data.startswith(prefix)]
+    
+    def _send(self, label: Optional[str], update: dict):
+        """Обрабатывает апдейт; label=None - подготовка сценария, без замера"""
+        queries_before, calls_before = self.queries.count, self.telegram.calls
+        failed = False
+        start = time.perf_counter()
+        try:
+            self.bot.process_new_updates([types.Update.de_json(update)])
+        except Exception:
+            failed = True
+        elapsed = time.perf_counter() - start
+        if label is None:
+            return
+        
+        samples = self.samples.setdefault(label, {"latencies": [], "queries": [], "calls": [], "errors": 0})
+        samples["latencies"].append(elapsed)
+        samples["queries"].append(self.queries.count - queries_before)
+        samples["calls"].append(self.telegram.calls - calls_before)
+        samples["errors"] += failed
+    
+    def take_samples(self) -> Dict[str, dict]:
+        samples, self.samples = self.samples, {}
+        return samples
+
+
+def seed_trip(replay: Replay, user: int, number: int, expenses: int = 0) -> int:
+    """Путешествие и расходы напрямую через базу, без замера (страны пользователя не повторяются)"""
+    trip_id = replay.db.create_trip(user, "Россия", f"Страна {number}", "RUB", "USD", 1 / 92, 10 ** 7)
+    if expenses:
+        replay.db.add_expenses_bulk(trip_id, [(i % 90 + 1.5, (i % 90 + 1.5) * 92, f"расход {i}")
+                                              for i in range(expenses)])
+    return trip_id
+
+
+def trip_creation(replay: Replay, args):
+    """Новые пользователи: /start, /newtrip, страны, начальная сумма"""
+    for i in range(args.users):
+        user = 1_000_000 + i
+        from_country, to_country = COUNTRY_PAIRS[i % len(COUNTRY_PAIRS)]
+        replay.message(user, "/start", "start")
+        replay.message(user, "/newtrip", "newtrip")
+        replay.message(user, from_country, "from_country")
+        replay.message(user, to_country, "to_country")
+        replay.message(user, "100000", "initial_amount")
+
+
+def expense_burst(replay: Replay, args):
+    """Пользователи с путешествием вводят расходы вперемешку и подтверждают их"""
+    users = [2_000_000 + i for i in range(args.users)]
+    for user in users:
+        seed_trip(replay, user, 0)
+        replay.message(user, "/start")
+    
+    for k in range(args.expenses):
+        for user in users:
+            replay.message(user, EXPENSE_MESSAGES[k % len(EXPENSE_MESSAGES)], "expense")
+            replay.callback(user, "expense_yes", "expense_yes")
+
+
+def history_browsing(replay: Replay, args):
+    """История расходов: первая страница, args.pages страниц назад и обратно"""
+    users = [3_000_000 + i for i in range(args.users)]
+    for user in users:
+        seed_trip(replay, user, 0, expenses=args.history)
+        replay.message(user, "/start")
+    
+    for user in users:
+        replay.callback(user, "history", "history")
+        for direction in ("|older|", "|newer|"):
+            for _ in range(args.pages):
+                page = [data for data in replay.buttons(user, "history_page|") if direction in data]
+                if not page:
+                    break
+                replay.callback(user, page[0], "history_page")
+
+
+def trip_switching(replay: Replay, args):
+    """Список путешествий, вторая страница списка и переключение активного путешествия"""
+    users = [4_000_000 + i for i in range(args.users)]
+    for user in users:
+        for trip in range(args.trips):
+            seed_trip(replay, user, trip)
+        replay.message(user, "/start")
+    
+    for round_index in range(args.switches):
+        for user in users:
+            replay.message(user, "/switch", "switch")
+            older = replay.buttons(user, "trips_page|older|")
+            if round_index % 2 and older:
+                replay.callback(user, older[0], "trips_page")
+            trips = replay.buttons(user, "switch_trip|")
+            if trips:
+                replay.callback(user, trips[round_index % len(trips)], "switch_trip")
+            replay.callback(user, "back_to_menu", "back_to_menu")
+
+
+# Сценарии в порядке запуска: название -> функция
+SCENARIOS: Dict[str, Callable] = {
+    "trip_creation": trip_creation,
+    "expense_burst": expense_burst,
+    "history_browsing": history_browsing,
+    "trip_switching": trip_switching,
+}
+
+
+def summarize(samples: Dict[str, dict]) -> dict:
+    """Отчет сценария: апдейты в секунду и замеры по видам апдейтов"""
+    by_type = {}
+    total_updates = 0
+    total_time = 0.0
+    for label, sample in samples.items():
+        latencies = sample["latencies"]
+        total_updates += len(latencies)
+        total_time += sum(latencies)
+        by_type[label] = {
+            "count": len(latencies),
+            "errors": sample["errors"],
+            "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+            "queries_per_update": round(sum(sample["queries"]) / len(latencies), 2),
+            "queries_max": max(sample["queries"]),
+            "telegram_calls_per_update": round(sum(sample["calls"]) / len(latencies), 2),
+        }
+    return {
+        "updates": total_updates,
+        # Время обработки апдейтов ботом, без подготовки сценария
+        "updates_per_sec": round(total_updates / total_time, 1) if total_time else None,
+        "by_type": by_type,
+    }
+
+
+def load_bot(db_path: str, rate_api_url: str, telegram: FakeTelegram, queries: QueryCounter):
+    """Импортирует bot.py с временной базой, заглушкой API курсов и транспортом без сети"""
+    os.environ["DB_PATH"] = db_path
+    os.environ["RATE_API_URL"] = rate_api_url
+    os.environ.setdefault("BOT_TOKEN", "123456:replay")
+    
+    apihelper.CUSTOM_REQUEST_SENDER = telegram
+    queries.install(Database)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import bot
+    # Апдейты обрабатываются в вызывающем потоке, чтобы замер был временем обработки
+    bot.bot.threaded = False
+    return bot
+
+
+def print_report(report: dict):
+    for name, scenario in report["scenarios"].items():
+        print(f"\n{name}: {scenario['updates']} апдейтов, {scenario['updates_per_sec']} апдейтов/с")
+        print(f"  {'Вид апдейта':<16} {'N':>5} {'p50, мс':>8} {'p95, мс':>8} {'p99, мс':>8} "
+              f"{'SQL/апд.':>9} {'API/апд.':>9} {'ошибок':>7}")
+        for label, row in scenario["by_type"].items():
+            print(f"  {label:<16} {row['count']:>5} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} "
+                  f"{row['p99_ms']:>8.2f} {row['queries_per_update']:>9.2f} "
+                  f"{row['telegram_calls_per_update']:>9.2f} {row['errors']:>7}")
+
+
+def print_comparison(old: dict, new: dict):
+    """Разница с сохраненным отчетом: апдейты в секунду, p95 и число выражений SQLite"""
+    print("\nСравнение с сохраненным отчетом (было -> стало):")
+    for name, scenario in new["scenarios"].items():
+        before = old.get("scenarios", {}).get(name)
+        if not before:
+            print(f"  {name}: нет в сохраненном отчете")
+            continue
+        print(f"  {name}: {before['updates_per_sec']} -> {scenario['updates_per_sec']} апдейтов/с")
+        for label, row in scenario["by_type"].items():
+            was = before["by_type"].get(label)
+            if not was:
+                continue
+            print(f"    {label:<16} p95: {was['p95_ms']:.2f} -> {row['p95_ms']:.2f} мс, "
+                  f"SQL на апдейт: {was['queries_per_update']:.2f} -> {row['queries_per_update']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=20, help="пользователей в каждом сценарии")
+    parser.add_argument("--expenses", type=int, default=10, help="сообщений с расходами на пользователя")
+    parser.add_argument("--history", type=int, default=200, help="расходов в истории на пользователя")
+    parser.add_argument("--pages", type=int, default=5, help="страниц истории назад (и столько же вперед)")
+    parser.add_argument("--trips", type=int, default=15, help="путешествий на пользователя для переключения")
+    parser.add_argument("--switches", type=int, default=4, help="переключений на пользователя")
+    parser.add_argument("--rate-latency", type=float, default=0.0, help="задержка заглушки API курсов, секунды")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--json", help="куда сохранить отчет (- - вывести только отчет в stdout)")
+    parser.add_argument("--compare", help="сохраненный отчет для сравнения")
+    args = parser.parse_args()
+    
+    # Адрес заглушки нужен до импорта current_api: из него строятся адреса провайдеров
+    rate_api_url = f"http://127.0.0.1:{free_port()}"
+    telegram = FakeTelegram()
+    queries = QueryCounter()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = load_bot(os.path.join(tmp, "replay.db"), rate_api_url, telegram, queries)
+        from fake_rates import FakeRates, FakeRatesServer
+        server = FakeRatesServer(FakeRates(latency=args.rate_latency),
+                                 port=int(rate_api_url.rsplit(":", 1)[1])).start()
+        replay = Replay(bot, telegram, queries)
+        
+        report = {
+            "config": {key: value for key, value in vars(args).items() if key not in ("json", "compare")},
+            "environment": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version},
+            "scenarios": {},
+        }
+        # Сообщения обработчиков об ошибках API и базы не нужны в отчете
+        with contextlib.redirect_stdout(io.StringIO()):
+            # Порядок SCENARIOS, а не командной строки: от него зависит, какие курсы уже в кэше
+            for name in [name for name in SCENARIOS if name in args.scenarios]:
+                SCENARIOS[name](replay, args)
+                report["scenarios"][name] = summarize(replay.take_samples())
+        
+        server.stop()
+        bot.db.close()
+    
+    # С --json - в stdout идет только отчет, чтобы его можно было перенаправить в файл
+    if args.json != "-":
+        print_report(report)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(json.load(f), report)
+    if args.json:
+        text = json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True)
+        if args.json == "-":
+            print(text)
+        else:
+            with open(args.json, "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+            print(f"\nОтчет сохранен: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,20 @@
+import asyncio
+import json
 import os
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
+import aiohttp
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -8,6 +22,379 @@ load_dotenv()
 # Получение токенов из переменных окружения
 API_KEY = os.getenv("CURRENCY_API_KEY")
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+# Адрес API курсов (для работы без интернета - адрес заглушки fake_rates.py)
+RATE_API_URL = os.getenv("RATE_API_URL", "https://api.exchangerate.host").rstrip("/")
+
+# Время жизни курса валютной пары в кэше (секунды)
+RATE_CACHE_TTL = float(os.getenv("RATE_CACHE_TTL", "600"))
+# Базовая валюта снимка /live для матрицы кросс-курсов
+RATE_MATRIX_BASE = os.getenv("RATE_MATRIX_BASE", "USD")
+# Период обновления матрицы кросс-курсов (секунды)
+RATE_MATRIX_REFRESH = float(os.getenv("RATE_MATRIX_REFRESH", "3600"))
+# Таймауты соединения и чтения для запросов к API курсов (секунды)
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "5"))
+# Число повторов при сетевых ошибках и ответах 429/5xx
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+# Базовая пауза между повторами (секунды), растет экспоненциально
+HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.3"))
+# Размер пула keep-alive соединений
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+# Порядок провайдеров курсов через запятую: matrix (/live), convert (/convert), table (локальная таблица)
+RATE_PROVIDERS = os.getenv("RATE_PROVIDERS", "matrix,convert,table")
+# Сколько ошибок провайдера подряд открывают его автомат
+RATE_BREAKER_FAILURES = int(os.getenv("RATE_BREAKER_FAILURES", "3"))
+# Сколько секунд автомат открыт до пробного запроса
+RATE_BREAKER_RESET = float(os.getenv("RATE_BREAKER_RESET", "30"))
+# JSON-файл локальной таблицы курсов: {"USD": 1, "EUR": 0.92, ...}
+RATE_TABLE_PATH = os.getenv("RATE_TABLE_PATH", "")
+
+
+class LatencyRecorder:
+    """Счетчики запросов и задержки последних запросов для статистики"""
+    
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    
+    def __init__(self, retries: int = HTTP_RETRIES, backoff: float = HTTP_RETRY_BACKOFF):
+        self.retries = retries
+        self.backoff = backoff
+        # Задержки последних запросов (секунды)
+        self._latencies = deque(maxlen=1000)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.retried = 0
+    
+    def _retry_delay(self, attempt: int) -> float:
+        """Экспоненциальная пауза перед повтором со случайным разбросом"""
+        with self._lock:
+            self.retried += 1
+        return self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+    
+    def _record(self, latency: float, failed: bool):
+        with self._lock:
+            self.requests += 1
+            if failed:
+                self.errors += 1
+            self._latencies.append(latency)
+    
+    def latency_stats(self) -> dict:
+        """Число запросов, ошибок, повторов и перцентили задержки (мс)"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {"requests": self.requests, "errors": self.errors, "retried": self.retried}
+        
+        if latencies:
+            def percentile(p: float) -> float:
+                return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2)
+            
+            stats.update({
+                "p50_ms": percentile(0.5),
+                "p95_ms": percentile(0.95),
+                "p99_ms": percentile(0.99),
+                "max_ms": round(latencies[-1] * 1000, 2),
+            })
+        return stats
+
+
+class HttpClient(LatencyRecorder):
+    """
+    HTTP-клиент для API курсов.
+    
+    Использует одну сессию с пулом keep-alive соединений (TLS-рукопожатие
+    не повторяется на каждый запрос), ограничивает время ожидания ответа,
+    повторяет неудачные запросы с экспоненциальной паузой и случайным
+    разбросом и запоминает задержку каждого запроса.
+    """
+    
+    def __init__(self, connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+                 read_timeout: float = HTTP_READ_TIMEOUT,
+                 retries: int = HTTP_RETRIES,
+                 backoff: float = HTTP_RETRY_BACKOFF,
+                 pool_size: int = HTTP_POOL_SIZE):
+        super().__init__(retries, backoff)
+        self.timeout = (connect_timeout, read_timeout)
+        
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+    
+    def get(self, url: str, params: Optional[dict] = None) -> requests.Response:
+        """
+        Выполняет GET-запрос с таймаутами и повторами.
+        
+        Raises:
+            requests.exceptions.RequestException: если все попытки неудачны
+        """
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+                if response.status_code in self.RETRY_STATUSES and attempt < self.retries:
+                    self._record(time.perf_counter() - start, failed=True)
+                else:
+                    response.raise_for_status()
+                    self._record(time.perf_counter() - start, failed=False)
+                    return response
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self._record(time.perf_counter() - start, failed=True)
+                if attempt >= self.retries:
+                    raise
+            except requests.exceptions.RequestException:
+                self._record(time.perf_counter() - start, failed=True)
+                raise
+            
+            time.sleep(self._retry_delay(attempt))
+
+
+class AsyncHttpClient(LatencyRecorder):
+    """
+    Асинхронный вариант HttpClient на aiohttp для режима AsyncTeleBot.
+    
+    Таймауты, повторы и статистика задержек те же, что у HttpClient.
+    Сессия создается при первом запросе внутри работающего цикла событий.
+    """
+    
+    def __init__(self, connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+                 read_timeout: float = HTTP_READ_TIMEOUT,
+                 retries: int = HTTP_RETRIES,
+                 backoff: float = HTTP_RETRY_BACKOFF,
+                 pool_size: int = HTTP_POOL_SIZE):
+        super().__init__(retries, backoff)
+        self.timeout = aiohttp.ClientTimeout(connect=connect_timeout, sock_read=read_timeout)
+        self.pool_size = pool_size
+        self._session: Optional[aiohttp.ClientSession] = None
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit=self.pool_size)
+            )
+        return self._session
+    
+    async def get_json(self, url: str, params: Optional[dict] = None) -> dict:
+        """
+        Выполняет GET-запрос с таймаутами и повторами и возвращает JSON.
+        
+        Raises:
+            aiohttp.ClientError, asyncio.TimeoutError: если все попытки неудачны
+        """
+        # aiohttp принимает только строковые параметры
+        params = {key: str(value) for key, value in (params or {}).items() if value is not None}
+        session = self._get_session()
+        
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            try:
+                async with session.get(url, params=params) as response:
+                    if response.status in self.RETRY_STATUSES and attempt < self.retries:
+                        self._record(time.perf_counter() - start, failed=True)
+                    else:
+                        response.raise_for_status()
+                        data = await response.json(content_type=None)
+                        self._record(time.perf_counter() - start, failed=False)
+                        return data
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                self._record(time.perf_counter() - start, failed=True)
+                if attempt >= self.retries:
+                    raise
+            except aiohttp.ClientError:
+                self._record(time.perf_counter() - start, failed=True)
+                raise
+            
+            await asyncio.sleep(self._retry_delay(attempt))
+    
+    async def close(self):
+        """Закрывает сессию (при остановке бота)"""
+        if self._session is not None:
+            await self._session.close()
+
+
+http_client = HttpClient()
+async_http_client = AsyncHttpClient()
+
+
+def _live_params(default: str, currencies: list[str], api_key: Optional[str] = API_KEY) -> dict:
+    return {
+        "access_key": api_key,
+        "source": default,
+        "currencies": ",".join(currencies)
+    }
+
+
+def _convert_params(amount: float, from_currency: str, to_currency: str,
+                    api_key: Optional[str] = API_KEY) -> dict:
+    return {
+        "access_key": api_key,
+        "from": from_currency,
+        "to": to_currency,
+        "amount": amount
+    }
+
+
+def _check_convert_response(data: dict) -> Optional[dict]:
+    """Возвращает ответ /convert или None, если API сообщил об ошибке"""
+    # Проверяем успешность запроса
+    if not data.get("success", False):
+        error_info = data.get('error', {})
+        if isinstance(error_info, dict):
+            print(f"API вернул ошибку: {error_info.get('info', 'Unknown error')}")
+        else:
+            print(f"API вернул ошибку: {error_info}")
+        return None
+    
+    return data
+
+
+def _is_rejection(data: dict) -> bool:
+    """
+    Отклонил ли API сам запрос (неизвестный код валюты, неверная сумма).
+    
+    Такой ответ значит, что пары нет, а не что провайдер недоступен: сбоем
+    считаются только ошибки с кодом 5xx.
+    """
+    error = data.get("error")
+    code = error.get("code") if isinstance(error, dict) else None
+    return not data.get("success", False) and not (isinstance(code, int) and code >= 500)
+
+
+def _is_rejected_status(status: int) -> bool:
+    """HTTP 4xx, кроме 429 (перегрузка): запрос отклонен, провайдер доступен"""
+    return 400 <= status < 500 and status not in LatencyRecorder.RETRY_STATUSES
+
+
+def _parse_rate(data: Optional[dict]) -> Optional[float]:
+    """Извлекает курс из ответа /convert для 1 единицы валюты"""
+    if data:
+        # Проверяем разные возможные структуры ответа
+        if "info" in data and "quote" in data["info"]:
+            return float(data["info"]["quote"])
+        elif "result" in data:
+            return float(data["result"])
+        elif "query" in data and "result" in data:
+            return float(data["query"]["result"])
+    
+    return None
+
+
+class RateHistory:
+    """
+    История полученных курсов в базе (таблица rates).
+    
+    Каждый курс, полученный от API, записывается со временем получения.
+    RateCache обращается к истории при промахе кэша в памяти (например,
+    после перезапуска) и берет из нее последний курс, когда API недоступен.
+    Хранилище (Database) подключается через attach(), поэтому модуль не
+    зависит от database.py.
+    """
+    
+    def __init__(self, via: str = RATE_MATRIX_BASE):
+        # Базовая валюта снимков /live: через нее считаются кросс-курсы
+        self.via = via
+        self._store = None
+        self._async_store = None
+        self.saved = 0
+        self.errors = 0
+    
+    def attach(self, store, async_store=None):
+        """
+        Подключает хранилище с методами save_rates и get_rate_at.
+        
+        async_store - асинхронная обертка того же хранилища (AsyncDatabase):
+        через нее async_lookup и async_record обращаются к базе из пула
+        потоков, не блокируя цикл событий.
+        """
+        self._store = store
+        self._async_store = async_store
+    
+    def record(self, rates: List[Tuple[str, str, float]]):
+        """Сохраняет курсы (base, quote, rate); ошибка записи не мешает конвертации"""
+        if self._store is None or not rates:
+            return
+        try:
+            self._store.save_rates(rates)
+            self.saved += len(rates)
+        except Exception as e:
+            self._write_failed(e)
+    
+    async def async_record(self, rates: List[Tuple[str, str, float]]):
+        """Асинхронный вариант record: запись выполняется вне цикла событий"""
+        if self._store is None or not rates:
+            return
+        if self._async_store is None:
+            await asyncio.to_thread(self.record, rates)
+            return
+        try:
+            await self._async_store.save_rates(rates)
+            self.saved += len(rates)
+        except Exception as e:
+            self._write_failed(e)
+    
+    def _write_failed(self, error: Exception):
+        self.errors += 1
+        print(f"Ошибка при сохранении истории курсов: {error}")
+    
+    def lookup(self, from_currency: str, to_currency: str,
+               at: Optional[datetime] = None) -> Optional[Tuple[float, float]]:
+        """
+        Курс из истории на момент at.
+        
+        Args:
+            from_currency: Исходная валюта
+            to_currency: Целевая валюта
+            at: Момент времени (UTC, без часового пояса); None - последний курс
+        
+        Returns:
+            tuple: (курс, сколько секунд ему было на момент at) или None
+        """
+        if self._store is None:
+            return None
+        
+        try:
+            found = self._store.get_rate_at(from_currency, to_currency, self._at_text(at), via=self.via)
+        except Exception as e:
+            self._read_failed(e)
+            return None
+        return self._with_age(found, at)
+    
+    async def async_lookup(self, from_currency: str, to_currency: str,
+                           at: Optional[datetime] = None) -> Optional[Tuple[float, float]]:
+        """Асинхронный вариант lookup: чтение выполняется вне цикла событий"""
+        if self._store is None:
+            return None
+        if self._async_store is None:
+            return await asyncio.to_thread(self.lookup, from_currency, to_currency, at)
+        
+        try:
+            found = await self._async_store.get_rate_at(from_currency, to_currency, self._at_text(at),
+                                                        via=self.via)
+        except Exception as e:
+            self._read_failed(e)
+            return None
+        return self._with_age(found, at)
+    
+    @staticmethod
+    def _at_text(at: Optional[datetime]) -> Optional[str]:
+        return at.strftime("%Y-%m-%d %H:%M:%S") if at else None
+    
+    @staticmethod
+    def _with_age(found: Optional[tuple], at: Optional[datetime]) -> Optional[Tuple[float, float]]:
+        """(курс, время получения) из базы -> (курс, возраст на момент at)"""
+        if not found:
+            return None
+        rate, fetched_at = found
+        moment = at or datetime.now(timezone.utc).replace(tzinfo=None)
+        age = (moment - datetime.strptime(fetched_at, "%Y-%m-%d %H:%M:%S")).total_seconds()
+        return rate, max(age, 0.0)
+    
+    def _read_failed(self, error: Exception):
+        self.errors += 1
+        print(f"Ошибка при чтении истории курсов: {error}")
+
+
+rate_history = RateHistory()
 
 
 def get_current_rate(default: str = "USD", currencies: list[str] = ["EUR", "GBP", "JPY"]):
@@ -21,16 +408,10 @@ def get_current_rate(default: str = "USD", currencies: list[str] = ["EUR", "GBP"
     Returns:
         dict: Данные с курсами валют
     """
-    url = "https://api.exchangerate.host/live"
-    params = {
-        "access_key": API_KEY,
-        "source": default,
-        "currencies": ",".join(currencies)
-    }
+    url = f"{RATE_API_URL}/live"
     
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
+        response = http_client.get(url, params=_live_params(default, currencies))
         data = response.json()
         return data
     except requests.exceptions.RequestException as e:
@@ -38,71 +419,708 @@ def get_current_rate(default: str = "USD", currencies: list[str] = ["EUR", "GBP"
         return None
 
 
-def convert_currency(amount: float, from_currency: str, to_currency: str):
+def fetch_exchange_rate(from_currency: str, to_currency: str) -> Optional[float]:
     """
-    Конвертирует сумму из одной валюты в другую.
+    Запрашивает курс обмена между двумя валютами у API (без кэша).
     
     Args:
-        amount: Сумма для конвертации
         from_currency: Исходная валюта
         to_currency: Целевая валюта
     
     Returns:
-        dict: Данные с результатом конвертации или None при ошибке
+        float: Курс обмена (сколько to_currency за 1 from_currency) или None при ошибке
+        и пока автомат провайдера открыт
     """
-    url = "https://api.exchangerate.host/convert"
-    params = {
-        "access_key": API_KEY,
-        "from": from_currency,
-        "to": to_currency,
-        "amount": amount
-    }
+    # Запрос идет через автомат провайдера /convert: при сбоях API не ждем таймаута
+    return convert_provider.call(from_currency, to_currency)
+
+
+class RateCache:
+    """
+    Кэш курсов валютных пар с ограниченным временем жизни.
     
-    try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
+    Суммы конвертируются локально как amount × rate по курсу из кэша. При промахе сначала
+    проверяется история курсов в базе (курс моложе ttl берется без запроса),
+    затем API. Если API недоступен, возвращается последний известный
+    (устаревший) курс: из памяти, а если его там нет - из истории, и только
+    потом курс локальных провайдеров (fallback, например таблица курсов).
+    
+    Одновременные промахи по одной паре (или по обратной к ней) обслуживаются
+    одним запросом к API: первый вызов идет в сеть, остальные ждут его
+    результат, и каждый считает свою сумму локально.
+    """
+    
+    def __init__(self, fetch: Callable[[str, str], Optional[float]],
+                 async_fetch: Optional[Callable[[str, str], Awaitable[Optional[float]]]] = None,
+                 ttl: float = RATE_CACHE_TTL,
+                 history: Optional[RateHistory] = None,
+                 fallback: Optional[Callable[[str, str], Optional[float]]] = None):
+        self._fetch = fetch
+        self._async_fetch = async_fetch
+        self._fallback = fallback
+        self.ttl = ttl
+        self.history = history
+        # (from, to) -> (курс, время получения по time.monotonic)
+        self._rates: dict[tuple[str, str], tuple[float, float]] = {}
+        self._lock = threading.Lock()
+        # Запросы к API, которые выполняются прямо сейчас: (from, to) -> Future / asyncio.Task
+        self._inflight: dict[tuple[str, str], Future] = {}
+        self._async_inflight: dict[tuple[str, str], asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.history_hits = 0
+        self.offline_hits = 0
+        self.fallback_hits = 0
+        self.failures = 0
+        self.fetches = 0
+        self.coalesced = 0
+    
+    def put(self, from_currency: str, to_currency: str, rate: float, age: float = 0.0):
+        """Сохраняет курс пары и обратный к нему; age - сколько секунд курсу уже есть"""
+        now = time.monotonic() - age
+        with self._lock:
+            self._rates[(from_currency, to_currency)] = (rate, now)
+            self._rates[(to_currency, from_currency)] = (1 / rate, now)
+    
+    def get_rate(self, from_currency: str, to_currency: str) -> Optional[float]:
+        """
+        Возвращает курс (сколько to_currency за 1 from_currency).
+        
+        Returns:
+            float: Курс из кэша или истории, свежий курс из API, устаревший
+            курс при недоступности API или None, если курса нет нигде
+        """
+        if from_currency == to_currency:
+            return 1.0
         
+        rate, entry = self._lookup(from_currency, to_currency)
+        if rate is not None:
+            return rate
+        rate, stored = self._from_history(from_currency, to_currency)
+        if rate is not None:
+            return rate
+        return self._resolve(from_currency, to_currency,
+                             self._fetch_shared(from_currency, to_currency), entry, stored)
+    
+    async def async_get_rate(self, from_currency: str, to_currency: str) -> Optional[float]:
+        """Асинхронный вариант get_rate для режима AsyncTeleBot"""
+        if from_currency == to_currency:
+            return 1.0
         
-        # Проверяем успешность запроса
-        if not data.get("success", False):
-            error_info = data.get('error', {})
-            if isinstance(error_info, dict):
-                print(f"API вернул ошибку: {error_info.get('info', 'Unknown error')}")
+        rate, entry = self._lookup(from_currency, to_currency)
+        if rate is not None:
+            return rate
+        stored = await self.history.async_lookup(from_currency, to_currency) if self.history else None
+        rate = self._fresh_history(from_currency, to_currency, stored)
+        if rate is not None:
+            return rate
+        return self._resolve(from_currency, to_currency,
+                             await self._async_fetch_shared(from_currency, to_currency), entry, stored)
+    
+    def _lookup(self, from_currency: str, to_currency: str) -> tuple[Optional[float], Optional[tuple]]:
+        """Свежий курс из кэша (или None) и сама запись кэша"""
+        with self._lock:
+            entry = self._rates.get((from_currency, to_currency))
+            if entry and time.monotonic() - entry[1] < self.ttl:
+                self.hits += 1
+                return entry[0], entry
+            self.misses += 1
+        return None, entry
+    
+    def _join_flight(self, inflight: dict, from_currency: str, to_currency: str):
+        """Запрос пары, который уже выполняется, и нужно ли обратить его курс"""
+        flight = inflight.get((from_currency, to_currency))
+        if flight is not None:
+            return flight, False
+        flight = inflight.get((to_currency, from_currency))
+        return flight, flight is not None
+    
+    def _fetch_shared(self, from_currency: str, to_currency: str) -> Optional[float]:
+        """Запрос курса к API, общий для одновременных вызовов по одной паре"""
+        with self._lock:
+            flight, invert = self._join_flight(self._inflight, from_currency, to_currency)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[(from_currency, to_currency)] = Future()
+                self.fetches += 1
             else:
-                print(f"API вернул ошибку: {error_info}")
+                self.coalesced += 1
+        
+        if leader:
+            try:
+                rate = self._fetch(from_currency, to_currency)
+                # Курс попадает в кэш до снятия записи о запросе, чтобы следующий
+                # вызов не начал еще один запрос в промежутке
+                if rate:
+                    self.put(from_currency, to_currency, rate)
+                flight.set_result(rate)
+            except Exception as e:
+                flight.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._inflight[(from_currency, to_currency)]
+        
+        rate = flight.result()
+        return 1 / rate if invert and rate else rate
+    
+    async def _async_fetch_and_put(self, from_currency: str, to_currency: str) -> Optional[float]:
+        rate = await self._async_fetch(from_currency, to_currency)
+        if rate:
+            self.put(from_currency, to_currency, rate)
+        return rate
+    
+    async def _async_fetch_shared(self, from_currency: str, to_currency: str) -> Optional[float]:
+        """Асинхронный вариант _fetch_shared (все вызовы в одном цикле событий)"""
+        task, invert = self._join_flight(self._async_inflight, from_currency, to_currency)
+        if task is None:
+            task = asyncio.ensure_future(self._async_fetch_and_put(from_currency, to_currency))
+            key = (from_currency, to_currency)
+            self._async_inflight[key] = task
+            task.add_done_callback(lambda _: self._async_inflight.pop(key, None))
+            with self._lock:
+                self.fetches += 1
+        else:
+            with self._lock:
+                self.coalesced += 1
+        
+        # shield: отмена одного ожидающего не отменяет общий запрос
+        rate = await asyncio.shield(task)
+        return 1 / rate if invert and rate else rate
+    
+    def _from_history(self, from_currency: str, to_currency: str
+                      ) -> tuple[Optional[float], Optional[tuple]]:
+        """Курс из истории, если он моложе ttl (или None), и сама запись истории"""
+        stored = self.history.lookup(from_currency, to_currency) if self.history else None
+        return self._fresh_history(from_currency, to_currency, stored), stored
+    
+    def _fresh_history(self, from_currency: str, to_currency: str,
+                       stored: Optional[tuple]) -> Optional[float]:
+        """Курс записи истории, если он моложе ttl (кладется в кэш), иначе None"""
+        if stored and stored[1] < self.ttl:
+            self.put(from_currency, to_currency, stored[0], age=stored[1])
+            with self._lock:
+                self.history_hits += 1
+            return stored[0]
+        return None
+    
+    def _resolve(self, from_currency: str, to_currency: str,
+                 rate: Optional[float], entry: Optional[tuple],
+                 stored: Optional[tuple] = None) -> Optional[float]:
+        """Сохраняет полученный курс или возвращает устаревший при ошибке"""
+        if rate:
+            self.put(from_currency, to_currency, rate)
+            return rate
+        
+        with self._lock:
+            self.failures += 1
+            if entry:
+                self.stale_hits += 1
+                return entry[0]
+            if stored:
+                # API недоступен, а в памяти курса нет (например, после перезапуска)
+                self.offline_hits += 1
+                return stored[0]
+        
+        # Курс локального провайдера не кэшируется: при восстановлении API берется свежий
+        rate = self._fallback(from_currency, to_currency) if self._fallback else None
+        if rate:
+            with self._lock:
+                self.fallback_hits += 1
+        return rate
+    
+    def age(self, from_currency: str, to_currency: str) -> Optional[float]:
+        """Возраст курса пары в секундах или None, если его нет в кэше"""
+        with self._lock:
+            entry = self._rates.get((from_currency, to_currency))
+        if entry is None:
             return None
+        return time.monotonic() - entry[1]
+    
+    def stats(self) -> dict:
+        """Счетчики попаданий, промахов и выдачи устаревших курсов"""
+        with self._lock:
+            return {
+                "pairs": len(self._rates),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_hits": self.stale_hits,
+                "history_hits": self.history_hits,
+                "offline_hits": self.offline_hits,
+                "fallback_hits": self.fallback_hits,
+                "failures": self.failures,
+                "fetches": self.fetches,
+                "coalesced": self.coalesced,
+            }
+
+
+class RateMatrix:
+    """
+    Матрица кросс-курсов, построенная из одного снимка /live.
+    
+    Снимок содержит курсы всех валют относительно базовой, поэтому
+    любой кросс-курс считается локально: rate(i -> j) = q[j] / q[i].
+    Вся матрица пересчитывается одной векторной операцией NumPy,
+    и N валютных пар обходятся одним запросом к API вместо N.
+    """
+    
+    def __init__(self, base: str = RATE_MATRIX_BASE,
+                 currencies: Optional[list[str]] = None,
+                 refresh_interval: float = RATE_MATRIX_REFRESH,
+                 fetch_live: Callable[..., Optional[dict]] = get_current_rate):
+        self.base = base
+        self.currencies = sorted(set(currencies or COUNTRY_TO_CURRENCY.values()) | {base})
+        self.refresh_interval = refresh_interval
+        # Источник снимка /live: функция (default, currencies) -> ответ API
+        self._fetch_live = fetch_live
+        self._index = {currency: i for i, currency in enumerate(self.currencies)}
+        # matrix[i, j] - сколько currencies[j] за 1 currencies[i]
+        self._matrix: Optional[np.ndarray] = None
+        self.updated_at: Optional[float] = None
+        self._lock = threading.Lock()
+        # Одно обновление снимка за раз: одновременные промахи не шлют по запросу /live
+        self._refresh_lock = threading.Lock()
+    
+    def refresh(self) -> bool:
+        """Загружает свежий снимок /live и пересчитывает матрицу"""
+        with self._refresh_lock:
+            return self._refresh()
+    
+    def refresh_if_stale(self) -> bool:
+        """
+        Обновляет устаревшую матрицу по запросу.
         
-        return data
-    except requests.exceptions.RequestException as e:
-        print(f"Ошибка при конвертации валюты: {e}")
+        Обновляет только один вызов; остальные, пока идет обновление,
+        отвечают по устаревшему снимку, а если снимка еще нет - ждут
+        результата того же обновления, не отправляя своего запроса.
+        
+        Returns:
+            bool: Есть ли снимок, по которому можно ответить
+        """
+        if self.is_fresh():
+            return True
+        if self._refresh_lock.acquire(blocking=False):
+            try:
+                # Матрицу мог обновить вызов, который только что отпустил блокировку
+                return self.is_fresh() or self._refresh()
+            finally:
+                self._refresh_lock.release()
+        if self._matrix is not None:
+            return True
+        with self._refresh_lock:
+            return self.is_fresh()
+    
+    def _refresh(self) -> bool:
+        quotes_currencies = [c for c in self.currencies if c != self.base]
+        data = self._fetch_live(default=self.base, currencies=quotes_currencies)
+        
+        if not data or not data.get("success", True) or "quotes" not in data:
+            print("Не удалось обновить матрицу курсов")
+            return False
+        
+        # Курсы относительно базовой валюты; ключи вида "USDEUR"
+        quotes = np.full(len(self.currencies), np.nan)
+        quotes[self._index[self.base]] = 1.0
+        for key, value in data["quotes"].items():
+            index = self._index.get(key[len(self.base):])
+            if index is not None and value:
+                quotes[index] = float(value)
+        
+        matrix = quotes[np.newaxis, :] / quotes[:, np.newaxis]
+        
+        rate_history.record([
+            (self.base, currency, float(quotes[index]))
+            for currency, index in self._index.items()
+            if currency != self.base and not np.isnan(quotes[index])
+        ])
+        
+        with self._lock:
+            self._matrix = matrix
+            self.updated_at = time.monotonic()
+        return True
+    
+    def is_fresh(self) -> bool:
+        """Проверяет, что матрица есть и не старше периода обновления"""
+        return (self.updated_at is not None
+                and time.monotonic() - self.updated_at < self.refresh_interval)
+    
+    def get_rate(self, from_currency: str, to_currency: str) -> Optional[float]:
+        """Кросс-курс пары или None, если валюты нет в снимке"""
+        i = self._index.get(from_currency)
+        j = self._index.get(to_currency)
+        matrix = self._matrix
+        if matrix is None or i is None or j is None:
+            return None
+        rate = matrix[i, j]
+        if np.isnan(rate):
+            return None
+        return float(rate)
+    
+    def get_rates(self, pairs: list[tuple[str, str]]) -> np.ndarray:
+        """Кросс-курсы для списка пар одной векторной выборкой (NaN для неизвестных)"""
+        matrix = self._matrix
+        result = np.full(len(pairs), np.nan)
+        if matrix is None or not pairs:
+            return result
+        
+        known = [k for k, (a, b) in enumerate(pairs) if a in self._index and b in self._index]
+        if known:
+            rows = np.array([self._index[pairs[k][0]] for k in known])
+            cols = np.array([self._index[pairs[k][1]] for k in known])
+            result[known] = matrix[rows, cols]
+        return result
+
+
+class RateProviderError(Exception):
+    """Провайдер курсов недоступен или вернул ошибку"""
+
+
+class CircuitBreaker:
+    """
+    Автомат отключения провайдера курсов.
+    
+    После failures ошибок подряд автомат открывается: запросы к провайдеру
+    отклоняются сразу, без ожидания таймаутов. Через reset_timeout секунд
+    пропускается один пробный запрос (полуоткрытое состояние): успех
+    закрывает автомат, ошибка снова открывает его.
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, failures: int = RATE_BREAKER_FAILURES, reset_timeout: float = RATE_BREAKER_RESET):
+        self.failure_threshold = failures
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+    
+    def allow(self) -> bool:
+        """Можно ли обратиться к провайдеру сейчас"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            # В полуоткрытом состоянии к провайдеру идет только один пробный запрос
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._consecutive = 0
+            self._probing = False
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._consecutive += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self._consecutive >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opened += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+    
+    def release(self):
+        """Снимает пробный запрос, который не дал результата (например, отменен)"""
+        with self._lock:
+            self._probing = False
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "opened": self.opened,
+            }
+
+
+class RateProvider(ABC):
+    """
+    Источник курсов валют.
+    
+    Подкласс реализует fetch (и при необходимости async_fetch): возвращает
+    курс пары, None, если такой пары у провайдера нет, или бросает
+    RateProviderError, если провайдер недоступен. call и async_call
+    пропускают запрос через автомат: пока он открыт, сразу возвращается None.
+    """
+    
+    name = "provider"
+    # Локальный провайдер не ходит в сеть; его курсы берутся последними, после кэша
+    local = False
+    
+    def __init__(self, breaker: Optional[CircuitBreaker] = None):
+        self.breaker = breaker or CircuitBreaker()
+    
+    @abstractmethod
+    def fetch(self, from_currency: str, to_currency: str) -> Optional[float]:
+        """Курс пары; None, если пары нет; RateProviderError, если провайдер недоступен"""
+    
+    async def async_fetch(self, from_currency: str, to_currency: str) -> Optional[float]:
+        """По умолчанию синхронный fetch выполняется вне цикла событий"""
+        return await asyncio.to_thread(self.fetch, from_currency, to_currency)
+    
+    def call(self, from_currency: str, to_currency: str) -> Optional[float]:
+        """Курс от провайдера; None при ошибке и пока автомат открыт"""
+        if not self.breaker.allow():
+            return None
+        try:
+            rate = self.fetch(from_currency, to_currency)
+        except Exception as e:
+            self._failed(e)
+            return None
+        self.breaker.record_success()
+        return rate
+    
+    async def async_call(self, from_currency: str, to_currency: str) -> Optional[float]:
+        """Асинхронный вариант call"""
+        if not self.breaker.allow():
+            return None
+        try:
+            rate = await self.async_fetch(from_currency, to_currency)
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception as e:
+            self._failed(e)
+            return None
+        self.breaker.record_success()
+        return rate
+    
+    def _failed(self, error: Exception):
+        print(f"Провайдер курсов {self.name} недоступен: {error}")
+        self.breaker.record_failure()
+    
+    def stats(self) -> dict:
+        return self.breaker.stats()
+
+
+class MatrixProvider(RateProvider):
+    """
+    Кросс-курсы из матрицы; устаревшая матрица обновляется запросом /live
+    (одним на все одновременные промахи, см. RateMatrix.refresh_if_stale)
+    """
+    
+    name = "matrix"
+    
+    def __init__(self, matrix: RateMatrix, breaker: Optional[CircuitBreaker] = None):
+        super().__init__(breaker)
+        self.matrix = matrix
+    
+    def fetch(self, from_currency: str, to_currency: str) -> Optional[float]:
+        if not self.matrix.refresh_if_stale():
+            raise RateProviderError("не удалось обновить снимок /live")
+        return self.matrix.get_rate(from_currency, to_currency)
+    
+    async def async_fetch(self, from_currency: str, to_currency: str) -> Optional[float]:
+        if self.matrix.is_fresh():
+            return self.matrix.get_rate(from_currency, to_currency)
+        # Обновление матрицы синхронное, поэтому выполняется вне цикла событий
+        return await asyncio.to_thread(self.fetch, from_currency, to_currency)
+
+
+class ConvertProvider(RateProvider):
+    """Курс одной пары через /convert"""
+    
+    name = "convert"
+    
+    def __init__(self, url: str = f"{RATE_API_URL}/convert",
+                 api_key: Optional[str] = API_KEY,
+                 client: HttpClient = http_client,
+                 async_client: AsyncHttpClient = async_http_client,
+                 breaker: Optional[CircuitBreaker] = None):
+        super().__init__(breaker)
+        self.url = url
+        self.api_key = api_key
+        self.client = client
+        self.async_client = async_client
+    
+    def fetch(self, from_currency: str, to_currency: str) -> Optional[float]:
+        try:
+            data = self.client.get(self.url, params=self._params(from_currency, to_currency)).json()
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and _is_rejected_status(e.response.status_code):
+                print(f"API отклонил запрос курса {from_currency} -> {to_currency}: {e}")
+                return None
+            raise RateProviderError(e) from e
+        except (requests.exceptions.RequestException, ValueError) as e:
+            raise RateProviderError(e) from e
+        rate = self._rate(data)
+        if rate:
+            rate_history.record([(from_currency, to_currency, rate)])
+        return rate
+    
+    async def async_fetch(self, from_currency: str, to_currency: str) -> Optional[float]:
+        try:
+            data = await self.async_client.get_json(self.url, params=self._params(from_currency, to_currency))
+        except aiohttp.ClientResponseError as e:
+            if _is_rejected_status(e.status):
+                print(f"API отклонил запрос курса {from_currency} -> {to_currency}: {e}")
+                return None
+            raise RateProviderError(e) from e
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            raise RateProviderError(e) from e
+        rate = self._rate(data)
+        if rate:
+            # Запись в историю идет через пул базы, а не в цикле событий
+            await rate_history.async_record([(from_currency, to_currency, rate)])
+        return rate
+    
+    def _params(self, from_currency: str, to_currency: str) -> dict:
+        return _convert_params(1.0, from_currency, to_currency, self.api_key)
+    
+    def _rate(self, data: dict) -> Optional[float]:
+        checked = _check_convert_response(data)
+        # Отказ по самому запросу (например, неизвестная валюта из CSV) - пары нет;
+        # иначе такие запросы одного пользователя открыли бы общий автомат
+        if checked is None and _is_rejection(data):
+            return None
+        rate = _parse_rate(checked)
+        if not rate:
+            raise RateProviderError("API не вернул курс")
+        return rate
+
+
+class TableProvider(RateProvider):
+    """
+    Курсы из локальной таблицы (JSON-файл RATE_TABLE_PATH).
+    
+    Таблица - курсы валют относительно одной базовой, например
+    {"USD": 1, "EUR": 0.92, "RUB": 91.5}; кросс-курс считается как
+    table[to] / table[from]. Курсы приблизительные, поэтому RateCache
+    берет их, только если нет ни свежего, ни устаревшего курса от API.
+    """
+    
+    name = "table"
+    local = True
+    
+    def __init__(self, rates: Optional[Dict[str, float]] = None, path: str = RATE_TABLE_PATH,
+                 breaker: Optional[CircuitBreaker] = None):
+        super().__init__(breaker)
+        self.rates = dict(rates) if rates is not None else self._load(path)
+    
+    @staticmethod
+    def _load(path: str) -> Dict[str, float]:
+        if not path:
+            return {}
+        try:
+            with open(path, encoding="utf-8") as file:
+                return {currency.upper(): float(rate) for currency, rate in json.load(file).items() if rate}
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"Не удалось загрузить таблицу курсов {path}: {e}")
+            return {}
+    
+    def fetch(self, from_currency: str, to_currency: str) -> Optional[float]:
+        if from_currency not in self.rates or to_currency not in self.rates:
+            return None
+        return self.rates[to_currency] / self.rates[from_currency]
+    
+    async def async_fetch(self, from_currency: str, to_currency: str) -> Optional[float]:
+        return self.fetch(from_currency, to_currency)
+
+
+class ProviderChain:
+    """
+    Упорядоченный список провайдеров курсов.
+    
+    fetch опрашивает сетевых провайдеров по порядку и возвращает первый
+    полученный курс; провайдер с открытым автоматом пропускается без
+    запроса, поэтому при сбое API ответ не ждет таймаутов. Локальные
+    провайдеры опрашиваются в fallback, после курсов из кэша и истории.
+    """
+    
+    def __init__(self, providers: List[RateProvider]):
+        self.providers = providers
+    
+    def fetch(self, from_currency: str, to_currency: str) -> Optional[float]:
+        for provider in self.providers:
+            if not provider.local:
+                rate = provider.call(from_currency, to_currency)
+                if rate:
+                    return rate
         return None
+    
+    async def async_fetch(self, from_currency: str, to_currency: str) -> Optional[float]:
+        for provider in self.providers:
+            if not provider.local:
+                rate = await provider.async_call(from_currency, to_currency)
+                if rate:
+                    return rate
+        return None
+    
+    def fallback(self, from_currency: str, to_currency: str) -> Optional[float]:
+        for provider in self.providers:
+            if provider.local:
+                rate = provider.call(from_currency, to_currency)
+                if rate:
+                    return rate
+        return None
+    
+    def stats(self) -> dict:
+        """Состояние автомата и число ошибок каждого провайдера"""
+        return {provider.name: provider.stats() for provider in self.providers}
 
 
-def get_exchange_rate(from_currency: str, to_currency: str) -> Optional[float]:
+# Один провайдер /convert на модуль: у прогрева и у цепочки общий автомат
+convert_provider = ConvertProvider()
+
+
+def fetch_rate(from_currency: str, to_currency: str) -> Optional[float]:
     """
-    Получает курс обмена между двумя валютами.
+    Получает курс пары у провайдеров в порядке RATE_PROVIDERS.
     
     Args:
         from_currency: Исходная валюта
         to_currency: Целевая валюта
     
     Returns:
-        float: Курс обмена (сколько to_currency за 1 from_currency) или None при ошибке
+        float: Курс обмена или None, если все провайдеры недоступны
     """
-    # Конвертируем 1 единицу для получения курса
-    data = convert_currency(1.0, from_currency, to_currency)
+    return rate_providers.fetch(from_currency, to_currency)
+
+
+async def async_fetch_rate(from_currency: str, to_currency: str) -> Optional[float]:
+    """Асинхронный вариант fetch_rate"""
+    return await rate_providers.async_fetch(from_currency, to_currency)
+
+
+def local_rate(from_currency: str, to_currency: str) -> Optional[float]:
+    """Курс локальных провайдеров (таблицы) - последний запасной вариант"""
+    return rate_providers.fallback(from_currency, to_currency)
+
+
+rate_cache = RateCache(fetch_rate, async_fetch_rate, history=rate_history, fallback=local_rate)
+
+
+def get_exchange_rate(from_currency: str, to_currency: str) -> Optional[float]:
+    """
+    Получает курс обмена между двумя валютами (через кэш).
     
-    if data:
-        # Проверяем разные возможные структуры ответа
-        if "info" in data and "quote" in data["info"]:
-            return float(data["info"]["quote"])
-        elif "result" in data:
-            return float(data["result"])
-        elif "query" in data and "result" in data:
-            return float(data["query"]["result"])
+    Args:
+        from_currency: Исходная валюта
+        to_currency: Целевая валюта
     
-    return None
+    Returns:
+        float: Курс обмена (сколько to_currency за 1 from_currency) или None при ошибке
+    """
+    return rate_cache.get_rate(from_currency, to_currency)
+
+
+async def async_get_exchange_rate(from_currency: str, to_currency: str) -> Optional[float]:
+    """Асинхронный вариант get_exchange_rate"""
+    return await rate_cache.async_get_rate(from_currency, to_currency)
 
 
 # Маппинг стран к валютам (основные страны)
@@ -159,6 +1177,212 @@ COUNTRY_TO_CURRENCY = {
     "Новая Зеландия": "NZD", "New Zealand": "NZD", "NZ": "NZD",
 }
 
+# Все, что не буква и не цифра, при сравнении названий считается пробелом
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def _deletions(word: str, max_deletes: int) -> set:
+    """Все варианты слова без 0..max_deletes символов"""
+    variants = {word}
+    frontier = {word}
+    for _ in range(max_deletes):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        variants |= frontier
+    return variants
+
+
+def _levenshtein(a: str, b: str, limit: int) -> int:
+    """Расстояние Левенштейна; если оно больше limit, возвращает limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        row = [i]
+        for j, char_b in enumerate(b, 1):
+            row.append(min(row[j - 1] + 1, previous[j] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(row) > limit:
+            return limit + 1
+        previous = row
+    return min(previous[-1], limit + 1)
+
+
+def normalize_country(name: str) -> str:
+    """Приводит название страны к виду для сравнения: регистр, ё, пунктуация, пробелы"""
+    name = name.casefold().replace("ё", "е")
+    return " ".join(_NON_WORD.sub(" ", name).split())
+
+
+class CountryIndex:
+    """
+    Индекс названий стран, построенный один раз при импорте.
+    
+    Поиск идет по ступеням, следующая выполняется, только если предыдущая
+    ничего не нашла:
+    1. точное совпадение без учета регистра и пунктуации (словарь);
+    2. ввод - начало названия или одного из его слов ("Герман", "Штаты");
+    3. название целиком входит во ввод по границам слов ("Россия, Москва");
+    4. опечатки: расстояние Левенштейна до названия не больше 1-2.
+    
+    Ступени 2-3 идут по префиксному дереву, а опечатки ищутся по словарю
+    заранее вычисленных удалений символов (symmetric delete), поэтому время
+    поиска зависит от длины ввода, а не от размера таблицы. Короткие названия и коды
+    ("IN", "США", "ОАЭ") сравниваются только точно, иначе "IN" находился бы
+    внутри "Finland".
+    """
+    
+    # Служебные ключи узлов дерева (не совпадают ни с одним символом)
+    _END = 0    # названия, которые целиком заканчиваются в узле
+    _ITEMS = 1  # названия, проходящие через узел (с начала или с любого слова)
+    
+    # Максимальное число опечаток в названии
+    MAX_DISTANCE = 2
+    
+    def __init__(self, mapping: Dict[str, str], exact_only_len: int = 3,
+                 min_prefix_len: int = 3, min_fuzzy_len: int = 4):
+        self.min_prefix_len = min_prefix_len
+        self.min_fuzzy_len = min_fuzzy_len
+        # Название как в таблице -> валюта (самый частый случай - ввод без изменений)
+        self._raw = dict(mapping)
+        # Нормализованное название -> (исходное название, валюта)
+        self._exact: Dict[str, Tuple[str, str]] = {}
+        # Названия для неточного поиска: (нормализованное, исходное, валюта)
+        self._names: List[Tuple[str, str, str]] = []
+        self._trie: dict = {}
+        # Название без 0..MAX_DISTANCE символов -> id названий
+        self._deletes: Dict[str, List[int]] = {}
+        
+        for name, currency in mapping.items():
+            normalized = normalize_country(name)
+            if normalized in self._exact:
+                # При совпадении нормализованных названий побеждает первое
+                continue
+            self._exact[normalized] = (name, currency)
+            if len(normalized) <= exact_only_len:
+                continue
+            
+            name_id = len(self._names)
+            self._names.append((normalized, name, currency))
+            
+            # Название добавляется в дерево целиком и с начала каждого слова
+            starts = [0] + [i + 1 for i, char in enumerate(normalized) if char == " "]
+            for start in starts:
+                node = self._trie
+                for char in normalized[start:]:
+                    node = node.setdefault(char, {})
+                    items = node.setdefault(self._ITEMS, [])
+                    if name_id not in items:
+                        items.append(name_id)
+                if start == 0:
+                    node.setdefault(self._END, []).append(name_id)
+            
+            for variant in _deletions(normalized, self.MAX_DISTANCE):
+                self._deletes.setdefault(variant, []).append(name_id)
+    
+    def _ranked(self, name_ids, limit: int) -> List[Tuple[str, str]]:
+        # Короткие названия точнее, при равной длине - порядок в таблице
+        ordered = sorted(set(name_ids), key=lambda i: (len(self._names[i][0]), i))
+        return [self._names[i][1:] for i in ordered[:limit]]
+    
+    def _prefix_matches(self, query: str) -> List[int]:
+        node = self._trie
+        for char in query:
+            node = node.get(char)
+            if node is None:
+                return []
+        return node.get(self._ITEMS, [])
+    
+    def _contained_matches(self, query: str) -> List[int]:
+        found = []
+        starts = [0] + [i + 1 for i, char in enumerate(query) if char == " "]
+        for start in starts:
+            node = self._trie
+            for pos in range(start, len(query)):
+                node = node.get(query[pos])
+                if node is None:
+                    break
+                # Название должно заканчиваться на границе слова ввода
+                if self._END in node and (pos + 1 == len(query) or query[pos + 1] == " "):
+                    found.extend(node[self._END])
+        return found
+    
+    def _fuzzy_matches(self, query: str, max_distance: int) -> List[Tuple[int, int]]:
+        """(расстояние, id) для названий не дальше max_distance правок от ввода"""
+        # Если строки отличаются не более чем на k правок, то они совпадают
+        # после удаления не более k символов из каждой
+        candidates = set()
+        for variant in _deletions(query, max_distance):
+            candidates.update(self._deletes.get(variant, ()))
+        
+        found = []
+        for name_id in candidates:
+            distance = _levenshtein(query, self._names[name_id][0], max_distance)
+            if distance <= max_distance:
+                found.append((distance, name_id))
+        return found
+    
+    def match(self, country: str, limit: int = 3) -> List[Tuple[str, str]]:
+        """
+        Ищет страну по названию.
+        
+        Returns:
+            list: До limit пар (название, валюта), лучшая первой; пустой список,
+            если ничего не найдено
+        """
+        raw = country.strip()
+        if raw in self._raw:
+            return [(raw, self._raw[raw])]
+        
+        query = normalize_country(country)
+        if not query:
+            return []
+        
+        exact = self._exact.get(query)
+        if exact:
+            return [exact]
+        
+        if len(query) >= self.min_prefix_len:
+            prefix = self._prefix_matches(query)
+            if prefix:
+                return self._ranked(prefix, limit)
+        
+        contained = self._contained_matches(query)
+        if contained:
+            # Самое длинное вхождение точнее: "Южная Корея" лучше, чем "Корея"
+            ordered = sorted(set(contained), key=lambda i: (-len(self._names[i][0]), i))
+            return [self._names[i][1:] for i in ordered[:limit]]
+        
+        if len(query) >= self.min_fuzzy_len:
+            max_distance = 1 if len(query) <= 5 else self.MAX_DISTANCE
+            fuzzy = sorted(set(self._fuzzy_matches(query, max_distance)))
+            return [self._names[name_id][1:] for _, name_id in fuzzy[:limit]]
+        
+        return []
+
+
+country_index = CountryIndex(COUNTRY_TO_CURRENCY)
+
+rate_matrix = RateMatrix()
+
+
+def build_rate_providers(names: str = RATE_PROVIDERS) -> ProviderChain:
+    """Цепочка провайдеров по списку имен через запятую"""
+    factories = {
+        "matrix": lambda: MatrixProvider(rate_matrix),
+        "convert": lambda: convert_provider,
+        "table": TableProvider,
+    }
+    providers = []
+    for name in names.split(","):
+        name = name.strip()
+        if name in factories:
+            providers.append(factories[name]())
+        elif name:
+            print(f"Неизвестный провайдер курсов: {name}")
+    return ProviderChain(providers)
+
+
+rate_providers = build_rate_providers()
+
 
 def get_currency_by_country(country: str) -> Optional[str]:
     """
@@ -170,26 +1394,8 @@ def get_currency_by_country(country: str) -> Optional[str]:
     Returns:
         str: Код валюты (ISO 4217) или None если не найдено
     """
-    country_normalized = country.strip()
-    
-    # Сначала проверяем точное совпадение (приоритет русским названиям)
-    if country_normalized in COUNTRY_TO_CURRENCY:
-        return COUNTRY_TO_CURRENCY[country_normalized]
-    
-    # Проверяем без учета регистра
-    for key, currency in COUNTRY_TO_CURRENCY.items():
-        if key.lower() == country_normalized.lower():
-            return currency
-    
-    # Проверяем частичное совпадение (для случаев типа "Соединенные Штаты Америки")
-    country_lower = country_normalized.lower()
-    for key, currency in COUNTRY_TO_CURRENCY.items():
-        key_lower = key.lower()
-        if country_lower in key_lower or key_lower in country_lower:
-            return currency
-    
-    # Если не найдено, возвращаем None
-    return None
+    matches = country_index.match(country, limit=1)
+    return matches[0][1] if matches else None
 
 
 if __name__ == "__main__":
@@ -1,81 +1,255 @@
+import asyncio
+import contextvars
+import functools
 import sqlite3
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Optional, List, Dict, Tuple
+from typing import Optional, List, Dict, Tuple, Iterator
+
+
+# Таймаут ожидания блокировки SQLite (мс)
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+# Размер кэша подготовленных выражений на одно соединение
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+# Число потоков, выполняющих запросы к базе в асинхронном режиме
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "4"))
+# Сколько строк читается из базы за раз при выгрузке расходов
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "500"))
+
+
+# Миграции схемы: (версия, описание, шаги). Шаг - SQL-запрос или функция,
+# получающая курсор. Новые миграции добавляются в конец со следующим номером,
+# уже выпущенные не меняются.
+MIGRATIONS = [
+    (1, "начальная схема", [
+        # Таблица путешествий
+        """
+        CREATE TABLE IF NOT EXISTS trips (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            from_country TEXT NOT NULL,
+            to_country TEXT NOT NULL,
+            from_currency TEXT NOT NULL,
+            to_currency TEXT NOT NULL,
+            rate REAL NOT NULL,
+            balance_from REAL NOT NULL DEFAULT 0,
+            balance_to REAL NOT NULL DEFAULT 0,
+            is_active INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(user_id, from_country, to_country)
+        )
+        """,
+        # Таблица расходов
+        """
+        CREATE TABLE IF NOT EXISTS expenses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            trip_id INTEGER NOT NULL,
+            amount_from REAL NOT NULL,
+            amount_to REAL NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            description TEXT,
+            FOREIGN KEY (trip_id) REFERENCES trips(id) ON DELETE CASCADE
+        )
+        """,
+        # Таблица состояний пользователей (для FSM)
+        """
+        CREATE TABLE IF NOT EXISTS user_states (
+            user_id INTEGER PRIMARY KEY,
+            state TEXT,
+            data TEXT
+        )
+        """,
+        # Таблица для хранения message_id главного меню
+        """
+        CREATE TABLE IF NOT EXISTS user_menu_messages (
+            user_id INTEGER PRIMARY KEY,
+            message_id INTEGER NOT NULL
+        )
+        """,
+    ]),
+    (2, "индексы для частых запросов", [
+        # Активное путешествие: WHERE user_id = ? AND is_active = 1
+        """
+        CREATE INDEX IF NOT EXISTS idx_trips_user_active
+        ON trips(user_id) WHERE is_active = 1
+        """,
+        # Список путешествий: WHERE user_id = ? ORDER BY created_at DESC без сортировки
+        """
+        CREATE INDEX IF NOT EXISTS idx_trips_user_created
+        ON trips(user_id, created_at)
+        """,
+        # История: WHERE trip_id = ? ORDER BY timestamp DESC LIMIT ? без сортировки
+        """
+        CREATE INDEX IF NOT EXISTS idx_expenses_trip_time
+        ON expenses(trip_id, timestamp)
+        """,
+    ]),
+    (3, "итоги расходов в trips", [
+        "ALTER TABLE trips ADD COLUMN spent_from REAL NOT NULL DEFAULT 0",
+        "ALTER TABLE trips ADD COLUMN spent_to REAL NOT NULL DEFAULT 0",
+        "ALTER TABLE trips ADD COLUMN expense_count INTEGER NOT NULL DEFAULT 0",
+        # Заполняем итоги по уже записанным расходам
+        """
+        UPDATE trips SET
+            spent_from = (SELECT COALESCE(SUM(amount_from), 0) FROM expenses WHERE trip_id = trips.id),
+            spent_to = (SELECT COALESCE(SUM(amount_to), 0) FROM expenses WHERE trip_id = trips.id),
+            expense_count = (SELECT COUNT(*) FROM expenses WHERE trip_id = trips.id)
+        """,
+    ]),
+    (4, "индекс постраничной истории расходов", [
+        # Ключ страницы - пара (timestamp, id): у расходов, добавленных
+        # в одну секунду, одинаковый timestamp
+        """
+        CREATE INDEX IF NOT EXISTS idx_expenses_trip_time_id
+        ON expenses(trip_id, timestamp, id)
+        """,
+        # Новый индекс покрывает все запросы старого
+        "DROP INDEX IF EXISTS idx_expenses_trip_time",
+    ]),
+    (5, "версия списка путешествий", [
+        # Счетчик меняется при создании, переключении и удалении путешествий;
+        # по нему бот понимает, что закэшированный список устарел
+        """
+        CREATE TABLE IF NOT EXISTS trip_list_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+        """,
+    ]),
+    (6, "история курсов и курс расхода", [
+        # Каждый курс, полученный от API: (сколько quote за 1 base, когда получен)
+        """
+        CREATE TABLE IF NOT EXISTS rates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            base TEXT NOT NULL,
+            quote TEXT NOT NULL,
+            rate REAL NOT NULL,
+            fetched_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Последний курс пары на момент T: WHERE base = ? AND quote = ? AND fetched_at <= ?
+        # ORDER BY fetched_at DESC LIMIT 1 - один переход по индексу
+        """
+        CREATE INDEX IF NOT EXISTS idx_rates_pair_time
+        ON rates(base, quote, fetched_at)
+        """,
+        # Курс, по которому посчитан расход (как trips.rate: сколько to_currency за 1 from_currency)
+        "ALTER TABLE expenses ADD COLUMN rate REAL",
+        "UPDATE expenses SET rate = amount_to / amount_from WHERE amount_from > 0",
+    ]),
+]
+
+# Граница "последний курс" для поиска в истории. Строка, а не число: у колонки
+# TIMESTAMP числовое сродство, и число сравнивалось бы с текстовыми датами неверно
+LATEST_TIMESTAMP = "9999-12-31 23:59:59"
+
+# Допустимое расхождение итогов при проверке (погрешность сложения float)
+TOTALS_TOLERANCE = 1e-6
 
 
 class Database:
     def __init__(self, db_path: str = None):
         # Используем путь из переменной окружения или значение по умолчанию
-        import os
         self.db_path = db_path or os.getenv("DB_PATH", "travel_wallet.db")
         # Создаем директорию для базы данных, если её нет
         db_dir = os.path.dirname(self.db_path)
         if db_dir and not os.path.exists(db_dir):
             os.makedirs(db_dir, exist_ok=True)
+        
+        # Одно долгоживущее соединение на каждый рабочий поток
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        
         self.init_database()
     
-    def get_connection(self):
-        """Создает соединение с базой данных"""
-        conn = sqlite3.connect(self.db_path)
+    def _open_connection(self) -> sqlite3.Connection:
+        """Открывает и настраивает новое соединение"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            # Соединение используется только своим потоком, но закрываться
+            # может из основного потока при остановке
+            check_same_thread=False,
+            # SQLite переиспользует подготовленные выражения по тексту запроса
+            cached_statements=DB_STATEMENT_CACHE_SIZE
+        )
         conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
         return conn
     
+    def get_connection(self) -> sqlite3.Connection:
+        """
+        Возвращает соединение текущего потока.
+        
+        Соединение создается при первом обращении из потока и дальше
+        переиспользуется, поэтому закрывать его в методах не нужно.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open_connection()
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+    
+    def close(self):
+        """Закрывает все открытые соединения (при остановке бота)"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+    
     def init_database(self):
-        """Инициализирует таблицы базы данных"""
+        """Инициализирует таблицы базы данных и применяет миграции"""
+        self.migrate()
+    
+    def get_schema_version(self) -> int:
+        """Текущая версия схемы (PRAGMA user_version)"""
+        return self.get_connection().execute("PRAGMA user_version").fetchone()[0]
+    
+    def migrate(self):
+        """
+        Применяет миграции, номер которых больше PRAGMA user_version.
+        
+        Каждая миграция выполняется в своей транзакции вместе с обновлением
+        user_version: при ошибке схема остается в предыдущей версии. BEGIN
+        IMMEDIATE не дает двум процессам применять миграции одновременно.
+        """
         conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Таблица путешествий
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS trips (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                from_country TEXT NOT NULL,
-                to_country TEXT NOT NULL,
-                from_currency TEXT NOT NULL,
-                to_currency TEXT NOT NULL,
-                rate REAL NOT NULL,
-                balance_from REAL NOT NULL DEFAULT 0,
-                balance_to REAL NOT NULL DEFAULT 0,
-                is_active INTEGER NOT NULL DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(user_id, from_country, to_country)
-            )
-        """)
-        
-        # Таблица расходов
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS expenses (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                trip_id INTEGER NOT NULL,
-                amount_from REAL NOT NULL,
-                amount_to REAL NOT NULL,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                description TEXT,
-                FOREIGN KEY (trip_id) REFERENCES trips(id) ON DELETE CASCADE
-            )
-        """)
-        
-        # Таблица состояний пользователей (для FSM)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_states (
-                user_id INTEGER PRIMARY KEY,
-                state TEXT,
-                data TEXT
-            )
-        """)
-        
-        # Таблица для хранения message_id главного меню
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_menu_messages (
-                user_id INTEGER PRIMARY KEY,
-                message_id INTEGER NOT NULL
-            )
-        """)
         
-        conn.commit()
-        conn.close()
+        for version, description, steps in MIGRATIONS:
+            if version <= self.get_schema_version():
+                continue
+            
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Пока ждали блокировку, миграцию мог применить другой процесс
+                if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                    conn.rollback()
+                    continue
+                
+                cursor = conn.cursor()
+                for step in steps:
+                    if callable(step):
+                        step(cursor)
+                    else:
+                        cursor.execute(step)
+                cursor.execute(f"PRAGMA user_version = {int(version)}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            
+            print(f"Миграция базы данных {version}: {description}")
     
     def create_trip(self, user_id: int, from_country: str, to_country: str,
                    from_currency: str, to_currency: str, rate: float,
@@ -104,12 +278,15 @@ class Database:
                   to_currency, rate, initial_amount, balance_to))
             
             trip_id = cursor.lastrowid
+            self._bump_trip_list_version(cursor, user_id)
             conn.commit()
             return trip_id
         except sqlite3.IntegrityError:
+            conn.rollback()
             return None
-        finally:
-            conn.close()
+        except Exception:
+            conn.rollback()
+            raise
     
     def get_active_trip(self, user_id: int) -> Optional[Dict]:
         """Получает активное путешествие пользователя"""
@@ -121,12 +298,55 @@ class Database:
         """, (user_id,))
         
         row = cursor.fetchone()
-        conn.close()
         
         if row:
             return dict(row)
         return None
     
+    def get_dashboard(self, user_id: int) -> Dict:
+        """
+        Все, что нужно для отрисовки меню, одним запросом.
+        
+        Returns:
+            dict: trip - активное путешествие с итогами расходов (или None),
+            menu_message_id - id сообщения с меню (или None), state - кортеж
+            (состояние, данные) как у get_user_state (или None)
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        # Одна строка на пользователя, даже если у него нет ни путешествия,
+        # ни меню, ни состояния
+        cursor.execute("""
+            SELECT t.*,
+                   m.message_id AS dashboard_menu_message_id,
+                   s.user_id AS dashboard_state_user_id,
+                   s.state AS dashboard_state,
+                   s.data AS dashboard_state_data
+            FROM (SELECT ? AS user_id) u
+            LEFT JOIN trips t ON t.user_id = u.user_id AND t.is_active = 1
+            LEFT JOIN user_menu_messages m ON m.user_id = u.user_id
+            LEFT JOIN user_states s ON s.user_id = u.user_id
+            LIMIT 1
+        """, (user_id,))
+        
+        row = cursor.fetchone()
+        trip_columns = [column[0] for column in cursor.description][:-4]
+        
+        trip = None
+        if row["id"] is not None:
+            trip = {column: row[i] for i, column in enumerate(trip_columns)}
+        
+        state = None
+        if row["dashboard_state_user_id"] is not None:
+            state = (row["dashboard_state"], row["dashboard_state_data"])
+        
+        return {
+            "trip": trip,
+            "menu_message_id": row["dashboard_menu_message_id"],
+            "state": state,
+        }
+    
     def get_user_trips(self, user_id: int) -> List[Dict]:
         """Получает все путешествия пользователя"""
         conn = self.get_connection()
@@ -137,10 +357,82 @@ class Database:
         """, (user_id,))
         
         rows = cursor.fetchall()
-        conn.close()
         
         return [dict(row) for row in rows]
     
+    def get_trips_page(self, user_id: int, before_id: Optional[int] = None,
+                       page_size: int = 10, after_id: Optional[int] = None
+                       ) -> Tuple[List[Dict], bool, bool]:
+        """
+        Страница списка путешествий, от новых к старым (keyset-пагинация).
+        
+        Читает только поля, нужные для кнопок списка. Параметры и результат -
+        как у get_expenses_page.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        columns = "id, from_country, to_country, is_active"
+        if after_id is not None:
+            cursor.execute(f"""
+                SELECT {columns} FROM trips
+                WHERE user_id = ?
+                  AND (created_at, id) > (SELECT created_at, id FROM trips WHERE id = ?)
+                ORDER BY created_at, id
+                LIMIT ?
+            """, (user_id, after_id, page_size + 1))
+            rows = [dict(row) for row in cursor.fetchall()]
+            has_newer = len(rows) > page_size
+            return list(reversed(rows[:page_size])), True, has_newer
+        
+        if before_id is not None:
+            cursor.execute(f"""
+                SELECT {columns} FROM trips
+                WHERE user_id = ?
+                  AND (created_at, id) < (SELECT created_at, id FROM trips WHERE id = ?)
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?
+            """, (user_id, before_id, page_size + 1))
+        else:
+            cursor.execute(f"""
+                SELECT {columns} FROM trips
+                WHERE user_id = ?
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?
+            """, (user_id, page_size + 1))
+        
+        rows = [dict(row) for row in cursor.fetchall()]
+        has_older = len(rows) > page_size
+        return rows[:page_size], has_older, before_id is not None
+    
+    def get_active_currency_pairs(self) -> List[Tuple[str, str]]:
+        """Различные пары (from_currency, to_currency) активных путешествий"""
+        cursor = self.get_connection().cursor()
+        cursor.execute("""
+            SELECT DISTINCT from_currency, to_currency
+            FROM trips
+            WHERE is_active = 1
+        """)
+        return [(row[0], row[1]) for row in cursor.fetchall()]
+    
+    def get_trip_list_version(self, user_id: int) -> int:
+        """Версия списка путешествий пользователя (0, если список не менялся)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT version FROM trip_list_versions WHERE user_id = ?", (user_id,))
+        row = cursor.fetchone()
+        
+        return row[0] if row else 0
+    
+    @staticmethod
+    def _bump_trip_list_version(cursor: sqlite3.Cursor, user_id: int):
+        """Увеличивает версию списка путешествий (в транзакции, меняющей trips)"""
+        cursor.execute("""
+            INSERT INTO trip_list_versions (user_id, version) VALUES (?, 1)
+            ON CONFLICT(user_id) DO UPDATE SET version = version + 1
+        """, (user_id,))
+    
     def switch_trip(self, user_id: int, trip_id: int) -> bool:
         """Переключает активное путешествие"""
         conn = self.get_connection()
@@ -156,11 +448,14 @@ class Database:
             cursor.execute("""
                 UPDATE trips SET is_active = 1 WHERE id = ? AND user_id = ?
             """, (trip_id, user_id))
+            switched = cursor.rowcount > 0
             
+            self._bump_trip_list_version(cursor, user_id)
             conn.commit()
-            return cursor.rowcount > 0
-        finally:
-            conn.close()
+            return switched
+        except Exception:
+            conn.rollback()
+            raise
     
     def add_expense(self, trip_id: int, amount_to: float, amount_from: float,
                    description: Optional[str] = None) -> bool:
@@ -170,31 +465,153 @@ class Database:
         
         try:
             
-            # Добавляем запись о расходе
+            # Добавляем запись о расходе вместе с курсом, по которому он посчитан
             cursor.execute("""
-                INSERT INTO expenses (trip_id, amount_from, amount_to, description)
-                VALUES (?, ?, ?, ?)
-            """, (trip_id, amount_from, amount_to, description))
+                INSERT INTO expenses (trip_id, amount_from, amount_to, description, rate)
+                VALUES (?, ?, ?, ?, ?)
+            """, (trip_id, amount_from, amount_to, description, self._expense_rate(amount_to, amount_from)))
             
-            # Обновляем баланс путешествия
-            cursor.execute("""
-                UPDATE trips 
-                SET balance_from = balance_from - ?, 
-                    balance_to = balance_to - ?
-                WHERE id = ?
-            """, (amount_from, amount_to, trip_id))
+            # Обновляем баланс и итоги путешествия в той же транзакции
+            self._apply_expense_delta(cursor, trip_id, amount_from, amount_to, 1)
             
             conn.commit()
             
             
             return True
         except Exception as e:
+            conn.rollback()
             print(f"Ошибка при добавлении расхода: {e}")
             import traceback
             traceback.print_exc()
             return False
-        finally:
-            conn.close()
+    
+    def add_expenses_bulk(self, trip_id: int, expenses: List[Tuple]) -> bool:
+        """
+        Добавляет несколько расходов одной транзакцией.
+        
+        Args:
+            trip_id: ID путешествия
+            expenses: Список (amount_to, amount_from, description) или
+                (amount_to, amount_from, description, timestamp); без timestamp
+                или с None используется текущее время
+        
+        Returns:
+            bool: True, если все расходы записаны
+        """
+        if not expenses:
+            return True
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.executemany("""
+                INSERT INTO expenses (trip_id, amount_from, amount_to, description, timestamp, rate)
+                VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)
+            """, [(trip_id, expense[1], expense[0], expense[2], expense[3] if len(expense) > 3 else None,
+                   self._expense_rate(expense[0], expense[1]))
+                  for expense in expenses])
+            
+            # Баланс и итоги обновляются один раз на весь пакет
+            self._apply_expense_delta(
+                cursor, trip_id,
+                sum(expense[1] for expense in expenses),
+                sum(expense[0] for expense in expenses),
+                len(expenses)
+            )
+            
+            # Одна фиксация (и один fsync) на все расходы
+            conn.commit()
+            return True
+        except Exception as e:
+            conn.rollback()
+            print(f"Ошибка при добавлении расходов: {e}")
+            return False
+    
+    @staticmethod
+    def _expense_rate(amount_to: float, amount_from: float) -> Optional[float]:
+        """Курс расхода: сколько to_currency за 1 from_currency"""
+        return amount_to / amount_from if amount_from else None
+    
+    @staticmethod
+    def _apply_expense_delta(cursor: sqlite3.Cursor, trip_id: int, amount_from: float,
+                             amount_to: float, count: int):
+        """
+        Меняет баланс и итоги расходов путешествия.
+        
+        Вызывается в транзакции, изменяющей expenses: для нового расхода с
+        положительными суммами и count=1, для удаленного - с отрицательными и
+        count=-1, для исправленного - с разницей сумм и count=0.
+        """
+        cursor.execute("""
+            UPDATE trips 
+            SET balance_from = balance_from - ?, 
+                balance_to = balance_to - ?,
+                spent_from = spent_from + ?,
+                spent_to = spent_to + ?,
+                expense_count = expense_count + ?
+            WHERE id = ?
+        """, (amount_from, amount_to, amount_from, amount_to, count, trip_id))
+    
+    def save_rates(self, rates: List[Tuple[str, str, float]]):
+        """
+        Записывает полученные от API курсы в историю.
+        
+        Args:
+            rates: Список (base, quote, rate): сколько quote за 1 base
+        """
+        conn = self.get_connection()
+        try:
+            conn.executemany("INSERT INTO rates (base, quote, rate) VALUES (?, ?, ?)", rates)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    
+    def _rate_at(self, cursor: sqlite3.Cursor, base: str, quote: str,
+                 at: Optional[str]) -> Optional[Tuple[float, str]]:
+        """Последний курс пары на момент at (или вообще последний), прямой или обратный"""
+        found = []
+        for pair_base, pair_quote, invert in ((base, quote, False), (quote, base, True)):
+            cursor.execute("""
+                SELECT rate, fetched_at FROM rates
+                WHERE base = ? AND quote = ? AND fetched_at <= ?
+                ORDER BY fetched_at DESC
+                LIMIT 1
+            """, (pair_base, pair_quote, at or LATEST_TIMESTAMP))
+            row = cursor.fetchone()
+            if row and row[0]:
+                found.append((1 / row[0] if invert else row[0], row[1]))
+        # Из прямого и обратного курса берем более свежий
+        return max(found, key=lambda item: item[1]) if found else None
+    
+    def get_rate_at(self, base: str, quote: str, at: Optional[str] = None,
+                    via: Optional[str] = None) -> Optional[Tuple[float, str]]:
+        """
+        Курс из истории на момент времени (as-of).
+        
+        Args:
+            base: Исходная валюта
+            quote: Целевая валюта
+            at: Момент времени в формате CURRENT_TIMESTAMP (UTC); None - последний курс
+            via: Валюта снимков /live: если пары нет, курс считается как
+                rate(via -> quote) / rate(via -> base)
+        
+        Returns:
+            tuple: (сколько quote за 1 base, когда получен) или None
+        """
+        cursor = self.get_connection().cursor()
+        
+        rate = self._rate_at(cursor, base, quote, at)
+        if rate or not via or via in (base, quote):
+            return rate
+        
+        to_base = self._rate_at(cursor, via, base, at)
+        to_quote = self._rate_at(cursor, via, quote, at)
+        if not to_base or not to_quote:
+            return None
+        # Кросс-курс не свежее старшего из двух курсов
+        return to_quote[0] / to_base[0], min(to_base[1], to_quote[1])
     
     def update_trip_rate(self, trip_id: int, new_rate: float) -> bool:
         """Обновляет курс обмена для путешествия"""
@@ -220,8 +637,9 @@ class Database:
                 conn.commit()
                 return True
             return False
-        finally:
-            conn.close()
+        except Exception:
+            conn.rollback()
+            raise
     
     def get_expenses(self, trip_id: int, limit: int = 10) -> List[Dict]:
         """Получает историю расходов для путешествия"""
@@ -236,25 +654,105 @@ class Database:
         """, (trip_id, limit))
         
         rows = cursor.fetchall()
-        conn.close()
         
         return [dict(row) for row in rows]
     
-    def set_user_state(self, user_id: int, state: Optional[str], data: Optional[str] = None):
-        """Устанавливает состояние пользователя для FSM"""
+    def get_expenses_page(self, trip_id: int, before_id: Optional[int] = None,
+                          page_size: int = 10, after_id: Optional[int] = None
+                          ) -> Tuple[List[Dict], bool, bool]:
+        """
+        Страница истории расходов, от новых к старым (keyset-пагинация).
+        
+        Страница начинается сразу после расхода-курсора, поэтому ее стоимость
+        не зависит от того, насколько далеко пролистана история (в отличие
+        от OFFSET).
+        
+        Args:
+            trip_id: ID путешествия
+            before_id: Вернуть расходы старше этого (следующая страница)
+            page_size: Число расходов на странице
+            after_id: Вернуть расходы новее этого (предыдущая страница)
+        
+        Returns:
+            tuple: (расходы от новых к старым, есть ли старше, есть ли новее)
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        if state is None:
-            cursor.execute("DELETE FROM user_states WHERE user_id = ?", (user_id,))
+        # Лишняя строка показывает, есть ли что-то за страницей
+        if after_id is not None:
+            cursor.execute("""
+                SELECT * FROM expenses
+                WHERE trip_id = ?
+                  AND (timestamp, id) > (SELECT timestamp, id FROM expenses WHERE id = ?)
+                ORDER BY timestamp, id
+                LIMIT ?
+            """, (trip_id, after_id, page_size + 1))
+            rows = [dict(row) for row in cursor.fetchall()]
+            has_newer = len(rows) > page_size
+            return list(reversed(rows[:page_size])), True, has_newer
+        
+        if before_id is not None:
+            cursor.execute("""
+                SELECT * FROM expenses
+                WHERE trip_id = ?
+                  AND (timestamp, id) < (SELECT timestamp, id FROM expenses WHERE id = ?)
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
+            """, (trip_id, before_id, page_size + 1))
         else:
             cursor.execute("""
-                INSERT OR REPLACE INTO user_states (user_id, state, data)
-                VALUES (?, ?, ?)
-            """, (user_id, state, data))
+                SELECT * FROM expenses
+                WHERE trip_id = ?
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
+            """, (trip_id, page_size + 1))
+        
+        rows = [dict(row) for row in cursor.fetchall()]
+        has_older = len(rows) > page_size
+        return rows[:page_size], has_older, before_id is not None
+    
+    def iter_expenses(self, trip_id: int, chunk_size: int = EXPORT_FETCH_SIZE) -> Iterator[Dict]:
+        """
+        Все расходы путешествия от старых к новым, порциями по chunk_size строк.
+        
+        В памяти одновременно находится не больше одной порции. Генератор
+        использует соединение потока, поэтому его нужно дочитать в том же
+        потоке, где он создан.
+        """
+        cursor = self.get_connection().cursor()
+        cursor.execute("""
+            SELECT id, timestamp, amount_to, amount_from, description
+            FROM expenses
+            WHERE trip_id = ?
+            ORDER BY timestamp, id
+        """, (trip_id,))
         
-        conn.commit()
-        conn.close()
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield dict(row)
+        finally:
+            cursor.close()
+    
+    def set_user_state(self, user_id: int, state: Optional[str], data: Optional[str] = None):
+        """Устанавливает состояние пользователя для FSM"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        # Контекстный менеджер откатит транзакцию при ошибке,
+        # чтобы она не осталась висеть на долгоживущем соединении
+        with conn:
+            if state is None:
+                cursor.execute("DELETE FROM user_states WHERE user_id = ?", (user_id,))
+            else:
+                cursor.execute("""
+                    INSERT OR REPLACE INTO user_states (user_id, state, data)
+                    VALUES (?, ?, ?)
+                """, (user_id, state, data))
     
     def get_user_state(self, user_id: int) -> Optional[Tuple[str, Optional[str]]]:
         """Получает состояние пользователя"""
@@ -263,7 +761,6 @@ class Database:
         
         cursor.execute("SELECT state, data FROM user_states WHERE user_id = ?", (user_id,))
         row = cursor.fetchone()
-        conn.close()
         
         if row:
             return (row[0], row[1])
@@ -282,14 +779,15 @@ class Database:
             
             # Удаляем путешествие (расходы удалятся автоматически из-за CASCADE)
             cursor.execute("DELETE FROM trips WHERE id = ? AND user_id = ?", (trip_id, user_id))
+            deleted = cursor.rowcount > 0
             
+            self._bump_trip_list_version(cursor, user_id)
             conn.commit()
-            return cursor.rowcount > 0
+            return deleted
         except Exception as e:
+            conn.rollback()
             print(f"Ошибка при удалении путешествия: {e}")
             return False
-        finally:
-            conn.close()
     
     def get_trip_by_id(self, user_id: int, trip_id: int) -> Optional[Dict]:
         """Получает путешествие по ID"""
@@ -301,7 +799,6 @@ class Database:
         """, (trip_id, user_id))
         
         row = cursor.fetchone()
-        conn.close()
         
         if row:
             return dict(row)
@@ -312,13 +809,11 @@ class Database:
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute("""
-            INSERT OR REPLACE INTO user_menu_messages (user_id, message_id)
-            VALUES (?, ?)
-        """, (user_id, message_id))
-        
-        conn.commit()
-        conn.close()
+        with conn:
+            cursor.execute("""
+                INSERT OR REPLACE INTO user_menu_messages (user_id, message_id)
+                VALUES (?, ?)
+            """, (user_id, message_id))
     
     def get_menu_message_id(self, user_id: int) -> Optional[int]:
         """Получает message_id главного меню пользователя"""
@@ -327,23 +822,142 @@ class Database:
         
         cursor.execute("SELECT message_id FROM user_menu_messages WHERE user_id = ?", (user_id,))
         row = cursor.fetchone()
-        conn.close()
         
         if row:
             return row[0]
         return None
     
     def get_total_expenses(self, trip_id: int) -> tuple[float, float]:
-        """Получает общую сумму расходов для путешествия"""
+        """Получает общую сумму расходов для путешествия (из итогов в trips)"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute("""
-            SELECT COALESCE(SUM(amount_from), 0), COALESCE(SUM(amount_to), 0)
-            FROM expenses WHERE trip_id = ?
-        """, (trip_id,))
+        cursor.execute("SELECT spent_from, spent_to FROM trips WHERE id = ?", (trip_id,))
         
         row = cursor.fetchone()
-        conn.close()
         
         return (float(row[0]), float(row[1])) if row else (0.0, 0.0)
+    
+    def audit_totals(self, fix: bool = False) -> List[Dict]:
+        """
+        Сверяет итоги в trips с суммами по таблице expenses.
+        
+        Args:
+            fix: Пересчитать итоги путешествий, в которых найдено расхождение
+        
+        Returns:
+            list: Путешествия с расхождениями: записанные и фактические итоги
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT t.id, t.user_id,
+                   t.spent_from, t.spent_to, t.expense_count,
+                   COALESCE(e.sum_from, 0) AS actual_from,
+                   COALESCE(e.sum_to, 0) AS actual_to,
+                   COALESCE(e.cnt, 0) AS actual_count
+            FROM trips t
+            LEFT JOIN (
+                SELECT trip_id, SUM(amount_from) AS sum_from, SUM(amount_to) AS sum_to, COUNT(*) AS cnt
+                FROM expenses GROUP BY trip_id
+            ) e ON e.trip_id = t.id
+        """)
+        
+        mismatches = [
+            dict(row) for row in cursor.fetchall()
+            if row["expense_count"] != row["actual_count"]
+            or abs(row["spent_from"] - row["actual_from"]) > TOTALS_TOLERANCE
+            or abs(row["spent_to"] - row["actual_to"]) > TOTALS_TOLERANCE
+        ]
+        
+        if fix and mismatches:
+            try:
+                cursor.executemany("""
+                    UPDATE trips
+                    SET spent_from = ?, spent_to = ?, expense_count = ?
+                    WHERE id = ?
+                """, [(m["actual_from"], m["actual_to"], m["actual_count"], m["id"]) for m in mismatches])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        
+        return mismatches
+
+
+class AsyncDatabase:
+    """
+    Асинхронная обертка над Database для режима AsyncTeleBot.
+    
+    Любой метод Database доступен как корутина: вызов выполняется в
+    небольшом пуле потоков, у каждого из которых свое соединение, и не
+    блокирует цикл событий.
+    """
+    
+    def __init__(self, db: Optional[Database] = None, max_workers: int = DB_EXECUTOR_WORKERS):
+        self.db = db or Database()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+    
+    def __getattr__(self, name: str):
+        method = getattr(self.db, name)
+        if not callable(method):
+            return method
+        
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            # Контекст корутины (текущий спан трассировки) переходит в поток пула
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(self._executor, functools.partial(context.run, method, *args, **kwargs))
+        
+        # Запоминаем обертку, чтобы не создавать ее на каждый вызов
+        setattr(self, name, call)
+        return call
+    
+    async def run_sync(self, func, *args):
+        """
+        Выполняет func(database, *args) в пуле базы.
+        
+        Для операций из нескольких запросов, которые должны идти через
+        соединение одного потока (например, выгрузка через iter_expenses).
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, functools.partial(context.run, func, self.db, *args))
+    
+    def close(self):
+        """Дожидается запросов в пуле и закрывает соединения"""
+        self._executor.shutdown(wait=True)
+        self.db.close()
+
+
+def main():
+    """Служебные команды: python database.py audit [--fix]"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Обслуживание базы данных Travel Wallet")
+    parser.add_argument("command", choices=["audit"], help="audit - сверка итогов расходов в trips")
+    parser.add_argument("--db-path", default=None, help="путь к базе (по умолчанию DB_PATH)")
+    parser.add_argument("--fix", action="store_true", help="пересчитать расходящиеся итоги")
+    args = parser.parse_args()
+    
+    db = Database(args.db_path)
+    mismatches = db.audit_totals(fix=args.fix)
+    for m in mismatches:
+        print(f"Путешествие {m['id']} (пользователь {m['user_id']}): "
+              f"записано {m['spent_to']:.2f}/{m['spent_from']:.2f}/{m['expense_count']}, "
+              f"по расходам {m['actual_to']:.2f}/{m['actual_from']:.2f}/{m['actual_count']}")
+    
+    if not mismatches:
+        print("Итоги расходов сходятся")
+    elif args.fix:
+        print(f"Исправлено путешествий: {len(mismatches)}")
+    else:
+        print(f"Расхождений: {len(mismatches)} (запустите с --fix для пересчета)")
+    db.close()
+    return 1 if mismatches and not args.fix else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,101 @@
+"""
+Выгрузка расходов путешествия в CSV или JSON.
+
+Строки читаются из базы порциями (Database.iter_expenses) и сразу пишутся
+в SpooledTemporaryFile: небольшой файл остается в памяти, большой уходит
+на диск, поэтому память не растет с числом расходов.
+"""
+import csv
+import io
+import json
+import os
+import tempfile
+from typing import IO, Iterable, Tuple
+
+from database import Database
+
+# Размер выгрузки, до которого файл держится в памяти, байты
+EXPORT_SPOOL_SIZE = int(os.getenv("EXPORT_SPOOL_SIZE", str(1024 * 1024)))
+
+EXPORT_FORMATS = ("csv", "json")
+
+# Колонки выгрузки
+EXPORT_FIELDS = ("id", "timestamp", "amount_to", "to_currency", "amount_from", "from_currency", "description")
+
+
+def _export_row(trip: dict, expense: dict) -> dict:
+    """Строка выгрузки: расход с валютами путешествия"""
+    return {
+        "id": expense["id"],
+        "timestamp": expense["timestamp"],
+        "amount_to": expense["amount_to"],
+        "to_currency": trip["to_currency"],
+        "amount_from": expense["amount_from"],
+        "from_currency": trip["from_currency"],
+        "description": expense["description"] or "",
+    }
+
+
+def write_csv(trip: dict, expenses: Iterable[dict], out: IO[str]) -> int:
+    """Пишет расходы в CSV построчно. Возвращает число строк"""
+    writer = csv.DictWriter(out, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    count = 0
+    for expense in expenses:
+        writer.writerow(_export_row(trip, expense))
+        count += 1
+    return count
+
+
+def write_json(trip: dict, expenses: Iterable[dict], out: IO[str]) -> int:
+    """
+    Пишет расходы в JSON по одному элементу, не собирая список в памяти.
+    
+    Формат: {"trip": {...}, "expenses": [{...}, ...]}
+    """
+    header = {key: trip[key] for key in ("id", "from_country", "to_country", "from_currency", "to_currency", "rate")}
+    out.write('{"trip": ' + json.dumps(header, ensure_ascii=False) + ', "expenses": [')
+    count = 0
+    for expense in expenses:
+        out.write(",\n" if count else "\n")
+        out.write(json.dumps(_export_row(trip, expense), ensure_ascii=False))
+        count += 1
+    out.write("\n]}\n")
+    return count
+
+
+def export_expenses(db: Database, trip: dict, fmt: str = "csv") -> Tuple[IO[bytes], str, int]:
+    """
+    Выгружает расходы путешествия во временный файл.
+    
+    Вызывается в потоке, которому принадлежит соединение db: генератор
+    iter_expenses читает через соединение текущего потока.
+    
+    Args:
+        db: База данных
+        trip: Путешествие
+        fmt: csv или json
+    
+    Returns:
+        tuple: (файл, открытый на чтение с начала, имя файла, число расходов)
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE, mode="w+b")
+    # BOM в CSV нужен, чтобы Excel открыл кириллицу в UTF-8
+    encoding = "utf-8-sig" if fmt == "csv" else "utf-8"
+    out = io.TextIOWrapper(spool, encoding=encoding, newline="")
+    
+    try:
+        write = write_csv if fmt == "csv" else write_json
+        count = write(trip, db.iter_expenses(trip["id"]), out)
+        out.flush()
+    except Exception:
+        out.close()
+        raise
+    
+    # Отсоединяем обертку, чтобы она не закрыла файл при сборке мусора
+    out.detach()
+    spool.seek(0)
+    return spool, f"trip_{trip['id']}_expenses.{fmt}", count
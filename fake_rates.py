@@ -0,0 +1,276 @@
+"""
+Локальная заглушка API курсов для работы без интернета.
+
+FakeRates отвечает в форматах /live и /convert exchangerate.host по
+детерминированной таблице курсов (DEFAULT_RATES, относительно USD) с
+настраиваемой задержкой, долей ошибок и дрейфом курсов. Использовать ее
+можно двумя способами:
+
+- в процессе: FakeRateProvider подключается в ProviderChain, а
+  FakeRates.live - в RateMatrix(fetch_live=...);
+- по HTTP: FakeRatesServer (или запуск этого файла) поднимает сервер,
+  и бот направляется на него через RATE_API_URL.
+
+Запуск:
+    python fake_rates.py --port 8600 --latency 0.05 --error-rate 0.1
+    RATE_API_URL=http://127.0.0.1:8600 python bot.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from current_api import RateProvider, RateProviderError
+
+# Курсы относительно USD (сколько валюты за 1 USD)
+DEFAULT_RATES = {
+    "USD": 1.0, "EUR": 0.92, "GBP": 0.79, "JPY": 151.0, "CNY": 7.2, "RUB": 92.0,
+    "AED": 3.67, "AUD": 1.52, "BRL": 5.05, "CAD": 1.36, "CHF": 0.9, "CZK": 23.3,
+    "DKK": 6.87, "HUF": 362.0, "ILS": 3.7, "INR": 83.3, "KRW": 1350.0, "MXN": 17.0,
+    "NOK": 10.8, "NZD": 1.66, "PLN": 3.98, "SAR": 3.75, "SEK": 10.6, "SGD": 1.35,
+    "THB": 36.5, "TRY": 32.3, "ZAR": 18.6,
+}
+
+
+class FakeHttpError(Exception):
+    """Имитация ответа 5xx"""
+
+
+class FakeRates:
+    """
+    Детерминированный источник курсов в форматах exchangerate.host.
+    
+    Args:
+        rates: Курсы относительно USD (по умолчанию DEFAULT_RATES)
+        latency: Задержка каждого ответа, секунды
+        error_rate: Доля ответов {"success": false}
+        http_error_rate: Доля ответов 503 (в процессе - FakeHttpError)
+        drift: Максимальное относительное изменение курсов за один запрос
+        seed: Зерно генератора ошибок и дрейфа: одинаковая последовательность
+            запросов дает одинаковые ответы
+    """
+    
+    def __init__(self, rates: Optional[Dict[str, float]] = None, latency: float = 0.0,
+                 error_rate: float = 0.0, http_error_rate: float = 0.0,
+                 drift: float = 0.0, seed: int = 0):
+        self.rates = dict(rates or DEFAULT_RATES)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.http_error_rate = http_error_rate
+        self.drift = drift
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # Число запросов по видам: live, convert
+        self.requests: Dict[str, int] = {"live": 0, "convert": 0}
+    
+    def _next(self, endpoint: str) -> Optional[dict]:
+        """Учитывает запрос, сдвигает курсы; ответ с ошибкой или None"""
+        with self._lock:
+            self.requests[endpoint] += 1
+            failure = self._random.random()
+            if self.drift:
+                for currency in self.rates:
+                    if currency != "USD":
+                        self.rates[currency] *= 1 + self._random.uniform(-self.drift, self.drift)
+        
+        if failure < self.http_error_rate:
+            raise FakeHttpError("503 Service Unavailable")
+        if failure < self.http_error_rate + self.error_rate:
+            return {"success": False, "error": {"code": 500, "info": "Fake provider failure"}}
+        return None
+    
+    def _quote(self, from_currency: str, to_currency: str) -> Optional[float]:
+        with self._lock:
+            if from_currency not in self.rates or to_currency not in self.rates:
+                return None
+            return self.rates[to_currency] / self.rates[from_currency]
+    
+    def take_requests(self) -> int:
+        """Число запросов с прошлого вызова (для подсчета обращений к API)"""
+        with self._lock:
+            total = sum(self.requests.values())
+            self.requests = dict.fromkeys(self.requests, 0)
+        return total
+    
+    def live(self, default: str = "USD", currencies: Optional[List[str]] = None) -> dict:
+        """Ответ /live: курсы currencies относительно default"""
+        time.sleep(self.latency)
+        error = self._next("live")
+        if error:
+            return error
+        
+        quotes = {}
+        for currency in currencies or self.rates:
+            quote = self._quote(default, currency)
+            if quote is not None and currency != default:
+                quotes[f"{default}{currency}"] = quote
+        return {"success": True, "source": default, "timestamp": int(time.time()), "quotes": quotes}
+    
+    def convert(self, from_currency: str, to_currency: str, amount: float = 1.0) -> dict:
+        """Ответ /convert: amount from_currency в to_currency"""
+        time.sleep(self.latency)
+        error = self._next("convert")
+        if error:
+            return error
+        
+        quote = self._quote(from_currency, to_currency)
+        if quote is None:
+            return {"success": False, "error": {"code": 402, "info": "Invalid currency code"}}
+        return {
+            "success": True,
+            "query": {"from": from_currency, "to": to_currency, "amount": amount},
+            "info": {"timestamp": int(time.time()), "quote": quote},
+            "date": date.today().isoformat(),
+            "result": quote * amount,
+        }
+
+
+class FakeRateProvider(RateProvider):
+    """Провайдер курсов поверх FakeRates без HTTP"""
+    
+    name = "fake"
+    
+    def __init__(self, fake: FakeRates, breaker=None):
+        super().__init__(breaker)
+        self.fake = fake
+    
+    def fetch(self, from_currency: str, to_currency: str) -> Optional[float]:
+        try:
+            data = self.fake.convert(from_currency, to_currency)
+        except FakeHttpError as e:
+            raise RateProviderError(e) from e
+        if not data["success"]:
+            # Как ConvertProvider: отказ по запросу (неизвестная валюта) - пары нет
+            if data["error"]["code"] < 500:
+                return None
+            raise RateProviderError(data["error"]["info"])
+        return data["info"]["quote"]
+
+
+class FakeRatesServer:
+    """
+    HTTP-сервер с /live и /convert поверх FakeRates.
+    
+    Держит соединения keep-alive (HTTP/1.1) и считает принятые TCP-соединения
+    и HTTP-запросы, чтобы по ним можно было проверить пул соединений клиента.
+    """
+    
+    def __init__(self, fake: Optional[FakeRates] = None, host: str = "127.0.0.1", port: int = 0):
+        self.fake = fake or FakeRates()
+        self.connections = 0
+        self.http_requests = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+    
+    @property
+    def url(self) -> str:
+        """Адрес для RATE_API_URL"""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def _count(self, connections: int = 0, requests: int = 0):
+        with self._lock:
+            self.connections += connections
+            self.http_requests += requests
+    
+    def take_counts(self) -> tuple:
+        """Соединения и HTTP-запросы с прошлого вызова"""
+        with self._lock:
+            counts = (self.connections, self.http_requests)
+            self.connections = self.http_requests = 0
+        return counts
+    
+    def _make_handler(self):
+        fake = self.fake
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def setup(self):
+                super().setup()
+                server._count(connections=1)
+            
+            def do_GET(self):
+                server._count(requests=1)
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                try:
+                    if url.path == "/live":
+                        currencies = query.get("currencies")
+                        payload = fake.live(query.get("source", "USD"),
+                                            currencies.split(",") if currencies else None)
+                    elif url.path == "/convert":
+                        payload = fake.convert(query.get("from", ""), query.get("to", ""),
+                                               float(query.get("amount", 1)))
+                    else:
+                        self._reply(404, {"success": False, "error": {"code": 404, "info": "Not found"}})
+                        return
+                except FakeHttpError as e:
+                    self._reply(503, {"success": False, "error": {"code": 503, "info": str(e)}})
+                    return
+                except ValueError:
+                    self._reply(400, {"success": False, "error": {"code": 400, "info": "Bad request"}})
+                    return
+                self._reply(200, payload)
+            
+            def _reply(self, status: int, payload: dict):
+                body = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Клиент уже закрыл соединение по таймауту
+                    pass
+            
+            def log_message(self, format, *args):
+                pass
+        
+        return Handler
+    
+    def start(self) -> "FakeRatesServer":
+        """Запускает сервер в фоновом потоке"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-rates", daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная заглушка API курсов (/live и /convert)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, секунды")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов success: false")
+    parser.add_argument("--http-error-rate", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--drift", type=float, default=0.0, help="изменение курсов за запрос, доля")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    fake = FakeRates(latency=args.latency, error_rate=args.error_rate,
+                     http_error_rate=args.http_error_rate, drift=args.drift, seed=args.seed)
+    server = FakeRatesServer(fake, args.host, args.port)
+    print(f"Заглушка API курсов: {server.url} (RATE_API_URL={server.url})")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,991 @@
+"""
+Обработчики апдейтов Travel Wallet, общие для bot.py и async_bot.py.
+
+Обработчики - корутины класса Handlers: они обращаются к боту и базе
+только через self.bot и self.db, а к курсам, выгрузке и импорту - через
+несколько методов, которые подкласс реализует под свой режим:
+
+- AsyncHandlers (async_bot.py): AsyncTeleBot и AsyncDatabase, запросы к
+  SQLite и импорт выполняются в пулах потоков, не блокируя цикл событий;
+- SyncHandlers (bot.py): TeleBot и Database за обертками SyncAdapter.
+  Корутины обработчиков ждут только их, а они отвечают сразу, поэтому
+  обработчик выполняется за один шаг (complete) прямо в потоке очереди
+  пользователя, без цикла событий.
+
+В bot.py и async_bot.py остается только сборка: бот, база, регистрация
+обработчиков (Handlers.register) и запуск.
+"""
+import asyncio
+import functools
+from abc import ABC, abstractmethod
+from typing import Callable, Optional
+
+from export import export_expenses
+from importer import IMPORT_MAX_FILE_SIZE, import_csv, import_executor
+from current_api import (
+    async_get_exchange_rate,
+    get_exchange_rate,
+    get_currency_by_country
+)
+from views import (
+    UserState,
+    HISTORY_PAGE_SIZE,
+    TRIPS_PAGE_SIZE,
+    NO_ACTIVE_TRIP_TEXT,
+    NEW_TRIP_TEXT,
+    SAME_CURRENCY_TEXT,
+    FETCHING_RATE_TEXT,
+    RATE_UNAVAILABLE_TEXT,
+    INVALID_MANUAL_RATE_TEXT,
+    INVALID_RATE_TEXT,
+    INVALID_AMOUNT_TEXT,
+    TRIP_CREATE_FAILED_TEXT,
+    RATE_UPDATE_FAILED_TEXT,
+    get_unknown_country_text,
+    get_from_country_text,
+    get_to_country_text,
+    get_manual_rate_text,
+    get_rate_updated_text,
+    get_main_menu_text,
+    get_main_menu_keyboard,
+    get_back_keyboard,
+    format_trip,
+    get_trips_list,
+    parse_trips_page,
+    TripListCache,
+    get_delete_confirmation,
+    get_history_text,
+    get_history_keyboard,
+    parse_history_page,
+    EXPORT_USAGE_TEXT,
+    EXPORT_EMPTY_TEXT,
+    EXPORT_FAILED_TEXT,
+    parse_export_format,
+    get_export_caption,
+    IMPORT_HELP_TEXT,
+    IMPORT_TOO_LARGE_TEXT,
+    IMPORT_STARTED_TEXT,
+    IMPORT_FAILED_TEXT,
+    get_import_progress_text,
+    get_import_result_text,
+    get_set_rate_text,
+    get_expense_confirmation,
+    get_expenses_added_text,
+    format_expense_state,
+    parse_expense_state,
+    parse_positive_number,
+    parse_expense_batch
+)
+
+
+def complete(coro):
+    """
+    Выполняет корутину обработчика синхронного режима до конца.
+    
+    Корутина ждет только обертки SyncAdapter, которые не приостанавливаются,
+    поэтому завершается за один шаг без цикла событий.
+    """
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError("Обработчик синхронного режима ожидает цикл событий")
+
+
+class SyncAdapter:
+    """
+    Синхронный объект (TeleBot, Database) с интерфейсом AsyncDatabase:
+    любой метод доступен как корутина, которая сразу вызывает метод.
+    """
+    
+    def __init__(self, target):
+        self.target = target
+    
+    def __getattr__(self, name: str):
+        # Метод берется при каждом вызове: обертки метрик и трассировки
+        # (install_metrics, install_tracing) ставятся на класс позже
+        method = getattr(self.target, name)
+        if not callable(method):
+            return method
+        
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        
+        return call
+
+
+class Handlers(ABC):
+    """
+    Обработчики команд, кнопок и текста.
+    
+    Подкласс реализует exchange_rate, export, import_file и run_import для
+    своего режима и обработчик бота для корутины (_bot_handler); без них
+    подкласс не создается.
+    """
+    
+    def __init__(self, bot, db, trip_list_cache: Optional[TripListCache] = None):
+        self.bot = bot
+        self.db = db
+        self.trip_list_cache = trip_list_cache or TripListCache()
+        # Обработчики текстовых сообщений для шагов FSM
+        self.state_handlers = {
+            UserState.WAITING_FROM_COUNTRY: self.handle_from_country,
+            UserState.WAITING_TO_COUNTRY: self.handle_to_country,
+            UserState.WAITING_MANUAL_RATE: self.handle_manual_rate,
+            UserState.WAITING_INITIAL_AMOUNT: self.handle_initial_amount,
+            UserState.WAITING_NEW_RATE: self.handle_new_rate,
+        }
+    
+    @abstractmethod
+    async def exchange_rate(self, from_currency: str, to_currency: str) -> Optional[float]:
+        """Курс пары из кэша или API (None, если курса нет)"""
+    
+    @abstractmethod
+    async def export(self, trip: dict, fmt: str):
+        """Выгрузка расходов путешествия: (файл, имя файла, число расходов)"""
+    
+    @abstractmethod
+    async def import_file(self, trip: dict, data: bytes, report_progress: Callable):
+        """Импорт расходов из CSV; report_progress - корутина (число импортированных)"""
+    
+    @abstractmethod
+    async def run_import(self, chat_id: int, status_message_id: int, trip: dict, file_id: str):
+        """Запускает import_document так, чтобы импорт не задерживал очередь апдейтов"""
+    
+    @abstractmethod
+    def _bot_handler(self, handler: Callable) -> Callable:
+        """Обработчик для регистрации в боте из метода-корутины"""
+    
+    def register(self, bot):
+        """
+        Регистрирует обработчики в боте.
+        
+        Порядок важен: единый обработчик текста - последним, после всех команд.
+        """
+        def on_message(handler: Callable, **filters):
+            bot.register_message_handler(self._bot_handler(handler), **filters)
+        
+        def on_callback(handler: Callable, func: Callable):
+            bot.register_callback_query_handler(self._bot_handler(handler), func=func)
+        
+        on_message(self.start_command, commands=['start'])
+        on_callback(self.new_trip_callback, lambda call: call.data == "new_trip")
+        on_message(self.new_trip_command, commands=['newtrip'])
+        on_callback(self.my_trips_callback, lambda call: call.data == "my_trips")
+        on_callback(self.trips_page_callback, lambda call: call.data.startswith("trips_page|"))
+        on_callback(self.switch_trip_callback, lambda call: call.data.startswith("switch_trip|"))
+        on_callback(self.view_trip_callback, lambda call: call.data.startswith("view_trip|"))
+        on_callback(self.delete_trip_callback, lambda call: call.data.startswith("delete_trip|"))
+        on_callback(self.confirm_delete_callback, lambda call: call.data.startswith("confirm_delete|"))
+        on_message(self.switch_command, commands=['switch'])
+        on_callback(self.balance_callback, lambda call: call.data == "balance")
+        on_message(self.balance_command, commands=['balance'])
+        on_callback(self.history_callback, lambda call: call.data == "history")
+        on_callback(self.history_page_callback, lambda call: call.data.startswith("history_page|"))
+        on_message(self.history_command, commands=['history'])
+        on_message(self.export_command, commands=['export'])
+        on_message(self.document_handler, content_types=['document'])
+        on_callback(self.set_rate_callback, lambda call: call.data == "set_rate")
+        on_message(self.setrate_command, commands=['setrate'])
+        on_callback(self.back_to_menu_callback, lambda call: call.data == "back_to_menu")
+        on_callback(self.expense_yes_callback, lambda call: call.data == "expense_yes")
+        on_callback(self.expense_no_callback, lambda call: call.data == "expense_no")
+        on_message(self.handle_text, func=lambda m: m.text and not m.text.startswith('/'))
+    
+    async def remember_menu(self, user_id: int, message_id: int, dashboard: dict):
+        """Сохраняет id сообщения с меню, если он изменился"""
+        if message_id != dashboard["menu_message_id"]:
+            await self.db.save_menu_message_id(user_id, message_id)
+    
+    async def show_main_menu(self, chat_id: int, user_id: int, message_id: int = None, edit: bool = False,
+                             dashboard: Optional[dict] = None):
+        """
+        Показывает или обновляет главное меню.
+        
+        dashboard - результат db.get_dashboard, если он уже получен в этом апдейте
+        и путешествие с тех пор не менялось; иначе читается одним запросом.
+        """
+        if dashboard is None:
+            dashboard = await self.db.get_dashboard(user_id)
+        text = get_main_menu_text(dashboard["trip"])
+        keyboard = get_main_menu_keyboard()
+        
+        if edit and message_id:
+            try:
+                msg = await self.bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    text=text,
+                    reply_markup=keyboard
+                )
+                if msg:
+                    await self.remember_menu(user_id, msg.message_id, dashboard)
+            except Exception as e:
+                # Если не удалось отредактировать, отправляем новое
+                msg = await self.bot.send_message(chat_id, text, reply_markup=keyboard)
+                await self.remember_menu(user_id, msg.message_id, dashboard)
+        else:
+            msg = await self.bot.send_message(chat_id, text, reply_markup=keyboard)
+            await self.remember_menu(user_id, msg.message_id, dashboard)
+    
+    async def start_command(self, message):
+        """Обработчик команды /start"""
+        user_id = message.from_user.id
+        
+        # Очищаем состояние пользователя
+        await self.db.set_user_state(user_id, None)
+        
+        # Показываем главное меню с информацией об активном путешествии
+        await self.show_main_menu(message.chat.id, user_id)
+    
+    async def new_trip_callback(self, call):
+        """Обработчик создания нового путешествия"""
+        user_id = call.from_user.id
+        
+        # Разрешаем создавать несколько путешествий
+        await self.db.set_user_state(user_id, UserState.WAITING_FROM_COUNTRY)
+        
+        # Убираем меню и запрашиваем страну отправления
+        await self.bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=NEW_TRIP_TEXT
+        )
+    
+    async def new_trip_command(self, message):
+        """Команда /newtrip"""
+        user_id = message.from_user.id
+        
+        # Разрешаем создавать несколько путешествий
+        await self.db.set_user_state(user_id, UserState.WAITING_FROM_COUNTRY)
+        await self.bot.send_message(message.chat.id, NEW_TRIP_TEXT)
+    
+    async def handle_from_country(self, message, state_data: Optional[str]):
+        """Обработка ввода страны отправления"""
+        user_id = message.from_user.id
+        from_country = message.text.strip()
+        
+        from_currency = get_currency_by_country(from_country)
+        if not from_currency:
+            await self.bot.send_message(message.chat.id, get_unknown_country_text(from_country, from_country=True))
+            return
+        
+        # Сохраняем данные во временном хранилище
+        await self.db.set_user_state(user_id, UserState.WAITING_TO_COUNTRY,
+                                     f"{from_country}|{from_currency}")
+        
+        await self.bot.send_message(message.chat.id, get_from_country_text(from_country, from_currency))
+    
+    async def handle_to_country(self, message, state_data: Optional[str]):
+        """Обработка ввода страны назначения"""
+        user_id = message.from_user.id
+        to_country = message.text.strip()
+        
+        to_currency = get_currency_by_country(to_country)
+        if not to_currency:
+            await self.bot.send_message(message.chat.id, get_unknown_country_text(to_country, from_country=False))
+            return
+        
+        # Данные, сохраненные на предыдущем шаге
+        from_country, from_currency = state_data.split("|")
+        
+        if from_currency == to_currency:
+            await self.bot.send_message(message.chat.id, SAME_CURRENCY_TEXT)
+            return
+        
+        # Получаем курс обмена через API и сразу переходим к запросу суммы
+        await self.bot.send_message(message.chat.id, FETCHING_RATE_TEXT)
+        
+        rate = await self.exchange_rate(from_currency, to_currency)
+        
+        if rate is None:
+            await self.bot.send_message(message.chat.id, RATE_UNAVAILABLE_TEXT)
+            await self.db.set_user_state(user_id, UserState.WAITING_MANUAL_RATE,
+                                         f"{from_country}|{from_currency}|{to_country}|{to_currency}")
+            return
+        
+        # Сохраняем курс и сразу запрашиваем начальную сумму
+        await self.db.set_user_state(user_id, UserState.WAITING_INITIAL_AMOUNT,
+                                     f"{from_country}|{from_currency}|{to_country}|{to_currency}|{rate}")
+        
+        await self.bot.send_message(message.chat.id, get_to_country_text(to_country, to_currency, from_currency, rate))
+    
+    # Убраны обработчики подтверждения курса - теперь курс берется автоматически из API
+    
+    async def handle_manual_rate(self, message, state_data: Optional[str]):
+        """Обработка ввода курса вручную"""
+        user_id = message.from_user.id
+        
+        rate = parse_positive_number(message.text)
+        if rate is None:
+            await self.bot.send_message(message.chat.id, INVALID_MANUAL_RATE_TEXT)
+            return
+        
+        from_country, from_currency, to_country, to_currency = state_data.split("|")
+        
+        await self.db.set_user_state(user_id, UserState.WAITING_INITIAL_AMOUNT,
+                                     f"{from_country}|{from_currency}|{to_country}|{to_currency}|{rate}")
+        
+        await self.bot.send_message(message.chat.id, get_manual_rate_text(from_currency, to_currency, rate))
+    
+    async def handle_initial_amount(self, message, state_data: Optional[str]):
+        """Обработка ввода начальной суммы"""
+        user_id = message.from_user.id
+        
+        amount = parse_positive_number(message.text)
+        if amount is None:
+            await self.bot.send_message(message.chat.id, INVALID_AMOUNT_TEXT)
+            return
+        
+        from_country, from_currency, to_country, to_currency, rate = state_data.split("|")
+        rate = float(rate)
+        
+        # Начальный баланс считается по курсу, полученному на предыдущем шаге
+        trip_id = await self.db.create_trip(
+            user_id=user_id,
+            from_country=from_country,
+            to_country=to_country,
+            from_currency=from_currency,
+            to_currency=to_currency,
+            rate=rate,
+            initial_amount=amount
+        )
+        
+        if trip_id:
+            await self.db.set_user_state(user_id, None)
+            
+            # Возвращаемся в главное меню с обновленной информацией
+            # Меню покажет всю информацию о созданном путешествии
+            await self.show_main_menu(message.chat.id, user_id)
+        else:
+            await self.bot.send_message(message.chat.id, TRIP_CREATE_FAILED_TEXT)
+    
+    async def load_trips_page(self, user_id: int, before_id: Optional[int] = None,
+                              after_id: Optional[int] = None):
+        """
+        Страница списка путешествий: (клавиатура, текст) или None, если путешествий нет.
+        
+        Отрисованная страница берется из кэша, пока версия списка пользователя
+        не изменилась, - тогда нужен только один запрос по первичному ключу.
+        """
+        page_key = f"{before_id}|{after_id}"
+        version = await self.db.get_trip_list_version(user_id)
+        page = self.trip_list_cache.get(user_id, page_key, version)
+        if page:
+            return page
+        
+        trips, has_older, has_newer = await self.db.get_trips_page(
+            user_id, before_id=before_id, page_size=TRIPS_PAGE_SIZE, after_id=after_id
+        )
+        if not trips and (before_id or after_id):
+            # Путешествие-курсор удалено - начинаем с первой страницы
+            trips, has_older, has_newer = await self.db.get_trips_page(user_id, page_size=TRIPS_PAGE_SIZE)
+        if not trips:
+            return None
+        
+        page = get_trips_list(trips, has_older, has_newer)
+        self.trip_list_cache.put(user_id, page_key, version, page)
+        return page
+    
+    async def my_trips_callback(self, call):
+        """Показывает список путешествий пользователя"""
+        user_id = call.from_user.id
+        page = await self.load_trips_page(user_id)
+        
+        if not page:
+            await self.bot.answer_callback_query(call.id, "У вас пока нет путешествий")
+            await self.show_main_menu(call.message.chat.id, user_id)
+            return
+        
+        keyboard, text = page
+        
+        await self.bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=text,
+            reply_markup=keyboard
+        )
+    
+    async def trips_page_callback(self, call):
+        """Листание списка путешествий"""
+        user_id = call.from_user.id
+        before_id, after_id = parse_trips_page(call.data)
+        page = await self.load_trips_page(user_id, before_id, after_id)
+        
+        if not page:
+            await self.bot.answer_callback_query(call.id, "У вас пока нет путешествий")
+            await self.show_main_menu(call.message.chat.id, user_id, call.message.message_id, edit=True)
+            return
+        
+        keyboard, text = page
+        
+        await self.bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=text,
+            reply_markup=keyboard
+        )
+        await self.bot.answer_callback_query(call.id)
+    
+    async def switch_trip_callback(self, call):
+        """Переключает активное путешествие"""
+        user_id = call.from_user.id
+        trip_id = int(call.data.split("|")[1])
+        
+        if await self.db.switch_trip(user_id, trip_id):
+            trip = await self.db.get_active_trip(user_id)
+            await self.bot.answer_callback_query(call.id, "✅ Путешествие активировано!")
+            
+            await self.bot.edit_message_text(
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id,
+                text=format_trip(trip, "✅ Активное путешествие:"),
+                reply_markup=get_back_keyboard(text="🔙 Назад в меню")
+            )
+        else:
+            await self.bot.answer_callback_query(call.id, "❌ Ошибка при переключении", show_alert=True)
+    
+    async def view_trip_callback(self, call):
+        """Просмотр активного путешествия"""
+        user_id = call.from_user.id
+        trip_id = int(call.data.split("|")[1])
+        
+        trip = await self.db.get_trip_by_id(user_id, trip_id)
+        
+        if not trip:
+            await self.bot.answer_callback_query(call.id, "Путешествие не найдено", show_alert=True)
+            return
+        
+        await self.bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=format_trip(trip, "✅ Активное путешествие:"),
+            reply_markup=get_back_keyboard("my_trips")
+        )
+    
+    async def delete_trip_callback(self, call):
+        """Обработчик удаления путешествия"""
+        user_id = call.from_user.id
+        trip_id = int(call.data.split("|")[1])
+        
+        # Получаем информацию о путешествии
+        trip = await self.db.get_trip_by_id(user_id, trip_id)
+        
+        if not trip:
+            await self.bot.answer_callback_query(call.id, "Путешествие не найдено", show_alert=True)
+            return
+        
+        # Показываем подтверждение удаления
+        text, keyboard = get_delete_confirmation(trip)
+        
+        await self.bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=text,
+            reply_markup=keyboard
+        )
+    
+    async def confirm_delete_callback(self, call):
+        """Подтверждение удаления путешествия"""
+        user_id = call.from_user.id
+        trip_id = int(call.data.split("|")[1])
+        
+        if await self.db.delete_trip(user_id, trip_id):
+            await self.bot.answer_callback_query(call.id, "✅ Путешествие удалено")
+            
+            # Возвращаемся к списку путешествий
+            page = await self.load_trips_page(user_id)
+            
+            if not page:
+                await self.show_main_menu(call.message.chat.id, user_id, call.message.message_id, edit=True)
+            else:
+                # Показываем обновленный список
+                keyboard, text = page
+                
+                await self.bot.edit_message_text(
+                    chat_id=call.message.chat.id,
+                    message_id=call.message.message_id,
+                    text=text,
+                    reply_markup=keyboard
+                )
+        else:
+            await self.bot.answer_callback_query(call.id, "❌ Ошибка при удалении", show_alert=True)
+    
+    async def switch_command(self, message):
+        """Команда /switch"""
+        user_id = message.from_user.id
+        page = await self.load_trips_page(user_id)
+        
+        if not page:
+            await self.show_main_menu(message.chat.id, user_id)
+            return
+        
+        keyboard, text = page
+        
+        await self.bot.send_message(
+            message.chat.id,
+            text,
+            reply_markup=keyboard
+        )
+    
+    async def balance_callback(self, call):
+        """Показывает баланс активного путешествия"""
+        user_id = call.from_user.id
+        dashboard = await self.db.get_dashboard(user_id)
+        trip = dashboard["trip"]
+        
+        if not trip:
+            await self.bot.answer_callback_query(call.id, "У вас нет активного путешествия")
+            await self.bot.send_message(
+                call.message.chat.id,
+                NO_ACTIVE_TRIP_TEXT,
+                reply_markup=get_main_menu_keyboard()
+            )
+            return
+        
+        await self.bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=format_trip(trip, "💰 Баланс путешествия:"),
+            reply_markup=get_back_keyboard()
+        )
+    
+    async def balance_command(self, message):
+        """Команда /balance"""
+        user_id = message.from_user.id
+        dashboard = await self.db.get_dashboard(user_id)
+        trip = dashboard["trip"]
+        
+        if not trip:
+            await self.show_main_menu(message.chat.id, user_id, dashboard=dashboard)
+            return
+        
+        await self.bot.send_message(
+            message.chat.id,
+            format_trip(trip, "💰 Баланс путешествия:"),
+            reply_markup=get_back_keyboard()
+        )
+    
+    async def history_callback(self, call):
+        """Показывает историю расходов"""
+        user_id = call.from_user.id
+        trip = await self.db.get_active_trip(user_id)
+        
+        if not trip:
+            await self.bot.answer_callback_query(call.id, "У вас нет активного путешествия")
+            await self.bot.send_message(
+                call.message.chat.id,
+                NO_ACTIVE_TRIP_TEXT,
+                reply_markup=get_main_menu_keyboard()
+            )
+            return
+        
+        expenses, has_older, has_newer = await self.db.get_expenses_page(trip["id"], page_size=HISTORY_PAGE_SIZE)
+        
+        await self.bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=get_history_text(trip, expenses),
+            reply_markup=get_history_keyboard(trip["id"], expenses, has_older, has_newer)
+        )
+    
+    async def history_page_callback(self, call):
+        """Листание истории расходов"""
+        user_id = call.from_user.id
+        trip_id, before_id, after_id = parse_history_page(call.data)
+        
+        trip = await self.db.get_trip_by_id(user_id, trip_id)
+        if not trip:
+            await self.bot.answer_callback_query(call.id, "Путешествие не найдено", show_alert=True)
+            return
+        
+        expenses, has_older, has_newer = await self.db.get_expenses_page(
+            trip_id, before_id=before_id, page_size=HISTORY_PAGE_SIZE, after_id=after_id
+        )
+        if not expenses:
+            # Расход-курсор удален - начинаем с первой страницы
+            expenses, has_older, has_newer = await self.db.get_expenses_page(trip_id, page_size=HISTORY_PAGE_SIZE)
+        
+        await self.bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=get_history_text(trip, expenses),
+            reply_markup=get_history_keyboard(trip_id, expenses, has_older, has_newer)
+        )
+        await self.bot.answer_callback_query(call.id)
+    
+    async def history_command(self, message):
+        """Команда /history"""
+        user_id = message.from_user.id
+        trip = await self.db.get_active_trip(user_id)
+        
+        if not trip:
+            await self.show_main_menu(message.chat.id, user_id)
+            return
+        
+        expenses, has_older, has_newer = await self.db.get_expenses_page(trip["id"], page_size=HISTORY_PAGE_SIZE)
+        
+        await self.bot.send_message(
+            message.chat.id,
+            get_history_text(trip, expenses),
+            reply_markup=get_history_keyboard(trip["id"], expenses, has_older, has_newer)
+        )
+    
+    async def export_command(self, message):
+        """Команда /export [csv|json]: все расходы активного путешествия файлом"""
+        user_id = message.from_user.id
+        trip = await self.db.get_active_trip(user_id)
+        
+        if not trip:
+            await self.show_main_menu(message.chat.id, user_id)
+            return
+        
+        fmt = parse_export_format(message.text)
+        if fmt is None:
+            await self.bot.send_message(message.chat.id, EXPORT_USAGE_TEXT)
+            return
+        
+        if not trip["expense_count"]:
+            await self.bot.send_message(message.chat.id, EXPORT_EMPTY_TEXT)
+            return
+        
+        # Расходы читаются порциями и пишутся во временный файл, память не растет с их числом
+        try:
+            export_file, file_name, count = await self.export(trip, fmt)
+        except Exception as e:
+            print(f"Ошибка при выгрузке расходов: {e}")
+            await self.bot.send_message(message.chat.id, EXPORT_FAILED_TEXT)
+            return
+        
+        with export_file:
+            await self.bot.send_document(
+                message.chat.id,
+                export_file,
+                visible_file_name=file_name,
+                caption=get_export_caption(trip, count)
+            )
+    
+    async def import_document(self, chat_id: int, status_message_id: int, trip: dict, file_id: str):
+        """Скачивает CSV и импортирует расходы, показывая ход импорта в статусном сообщении"""
+        async def report_progress(imported: int):
+            try:
+                await self.bot.edit_message_text(get_import_progress_text(imported), chat_id, status_message_id)
+            except Exception as e:
+                print(f"Ошибка при обновлении хода импорта: {e}")
+        
+        try:
+            file_info = await self.bot.get_file(file_id)
+            data = await self.bot.download_file(file_info.file_path)
+            result = await self.import_file(trip, data, report_progress)
+        except Exception as e:
+            print(f"Ошибка при импорте расходов: {e}")
+            await self.bot.edit_message_text(IMPORT_FAILED_TEXT, chat_id, status_message_id)
+            return
+        
+        await self.bot.edit_message_text(get_import_result_text(trip, result), chat_id, status_message_id)
+    
+    async def document_handler(self, message):
+        """CSV-файл: импорт расходов в активное путешествие"""
+        user_id = message.from_user.id
+        trip = await self.db.get_active_trip(user_id)
+        
+        if not trip:
+            await self.show_main_menu(message.chat.id, user_id)
+            return
+        
+        document = message.document
+        if not (document.file_name or "").lower().endswith(".csv"):
+            await self.bot.send_message(message.chat.id, IMPORT_HELP_TEXT)
+            return
+        
+        if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+            await self.bot.send_message(message.chat.id, IMPORT_TOO_LARGE_TEXT)
+            return
+        
+        status = await self.bot.send_message(message.chat.id, IMPORT_STARTED_TEXT)
+        
+        # Большой файл импортируется несколько секунд, поэтому работа уходит в
+        # отдельный пул и не задерживает очередь апдейтов
+        await self.run_import(message.chat.id, status.message_id, trip, document.file_id)
+    
+    async def set_rate_callback(self, call):
+        """Запрос на изменение курса"""
+        user_id = call.from_user.id
+        trip = await self.db.get_active_trip(user_id)
+        
+        if not trip:
+            await self.bot.answer_callback_query(call.id, "У вас нет активного путешествия")
+            await self.bot.send_message(
+                call.message.chat.id,
+                NO_ACTIVE_TRIP_TEXT,
+                reply_markup=get_main_menu_keyboard()
+            )
+            return
+        
+        await self.db.set_user_state(user_id, UserState.WAITING_NEW_RATE, str(trip["id"]))
+        
+        await self.bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=get_set_rate_text(trip)
+        )
+    
+    async def handle_new_rate(self, message, state_data: Optional[str]):
+        """Обработка нового курса"""
+        user_id = message.from_user.id
+        
+        new_rate = parse_positive_number(message.text)
+        if new_rate is None:
+            await self.bot.send_message(message.chat.id, INVALID_RATE_TEXT)
+            return
+        
+        trip_id = int(state_data)
+        
+        if await self.db.update_trip_rate(trip_id, new_rate):
+            await self.db.set_user_state(user_id, None)
+            dashboard = await self.db.get_dashboard(user_id)
+            
+            # Обновляем главное меню
+            menu_message_id = dashboard["menu_message_id"]
+            if menu_message_id:
+                await self.show_main_menu(message.chat.id, user_id, menu_message_id, edit=True, dashboard=dashboard)
+            
+            await self.bot.send_message(message.chat.id, get_rate_updated_text(dashboard["trip"], new_rate))
+        else:
+            await self.bot.send_message(message.chat.id, RATE_UPDATE_FAILED_TEXT)
+    
+    async def setrate_command(self, message):
+        """Команда /setrate"""
+        user_id = message.from_user.id
+        trip = await self.db.get_active_trip(user_id)
+        
+        if not trip:
+            await self.show_main_menu(message.chat.id, user_id)
+            return
+        
+        await self.db.set_user_state(user_id, UserState.WAITING_NEW_RATE, str(trip["id"]))
+        
+        await self.bot.send_message(message.chat.id, get_set_rate_text(trip))
+    
+    async def back_to_menu_callback(self, call):
+        """Возврат в главное меню"""
+        user_id = call.from_user.id
+        await self.show_main_menu(call.message.chat.id, user_id, call.message.message_id, edit=True)
+    
+    # Обработка чисел как расходов
+    async def handle_expense(self, message, dashboard: dict):
+        """Обработка сообщений с числами как расходов"""
+        # Пропускаем команды - они обрабатываются отдельными обработчиками
+        if not message.text or message.text.startswith('/'):
+            return
+        
+        user_id = message.from_user.id
+        state = dashboard["state"]
+        
+        # Проверяем, не находится ли пользователь в процессе создания путешествия
+        if state and state[0] not in [None, UserState.WAITING_EXPENSE_CONFIRMATION]:
+            return  # Пропускаем, если пользователь в процессе создания путешествия
+        
+        # Активное путешествие уже прочитано вместе с состоянием
+        trip = dashboard["trip"]
+        if not trip:
+            # Если нет активного путешествия, показываем меню
+            await self.show_main_menu(message.chat.id, user_id, dashboard=dashboard)
+            return
+        
+        # Одно или несколько чисел (через запятую или по строкам, с описаниями)
+        entries, skipped = parse_expense_batch(message.text)
+        if not entries:
+            return  # Не число, игнорируем
+        
+        # Один курс на все расходы сообщения, из кэша (API вызывается только при промахе).
+        # Суммы введены в валюте страны пребывания (to_currency),
+        # конвертируем их в домашнюю валюту (from_currency)
+        home_rate = await self.exchange_rate(trip["to_currency"], trip["from_currency"])
+        
+        if home_rate is None:
+            # Если курс недоступен, используем сохраненный курс
+            # rate: сколько to_currency за 1 from_currency
+            # Значит: amount_from = amount_to / rate
+            home_rate = 1 / trip["rate"]
+        
+        expenses = [(amount_to, amount_to * home_rate, description) for amount_to, description in entries]
+        
+        # Сохраняем данные для подтверждения, включая message_id исходного сообщения
+        await self.db.set_user_state(user_id, UserState.WAITING_EXPENSE_CONFIRMATION,
+                                     format_expense_state(trip["id"], expenses, message.message_id))
+        
+        # Показываем конвертацию и кнопки подтверждения
+        text, keyboard = get_expense_confirmation(trip, expenses, skipped)
+        
+        # Отправляем временное сообщение (оно будет удалено после подтверждения)
+        await self.bot.send_message(message.chat.id, text, reply_markup=keyboard)
+    
+    async def expense_yes_callback(self, call):
+        """Подтверждение расхода"""
+        user_id = call.from_user.id
+        dashboard = await self.db.get_dashboard(user_id)
+        state = dashboard["state"]
+        
+        if not state or state[0] != UserState.WAITING_EXPENSE_CONFIRMATION:
+            await self.bot.answer_callback_query(call.id, "Ошибка: состояние не найдено")
+            return
+        
+        # Получаем путешествие сначала
+        trip = dashboard["trip"]
+        if not trip:
+            await self.bot.answer_callback_query(call.id, "Путешествие не найдено", show_alert=True)
+            return
+        
+        trip_id, expenses, user_message_id = parse_expense_state(state[1])
+        
+        # Проверяем баланс
+        if trip["balance_to"] < sum(expense[0] for expense in expenses):
+            await self.bot.answer_callback_query(call.id, "Недостаточно средств!", show_alert=True)
+            return
+        
+        # Добавляем расходы одной транзакцией
+        if await self.db.add_expenses_bulk(trip_id, expenses):
+            await self.db.set_user_state(user_id, None)
+            
+            # Удаляем сообщение пользователя с числом
+            if user_message_id:
+                try:
+                    await self.bot.delete_message(call.message.chat.id, user_message_id)
+                except Exception:
+                    pass
+            
+            # Удаляем сообщение с подтверждением расхода
+            try:
+                await self.bot.delete_message(call.message.chat.id, call.message.message_id)
+            except Exception:
+                pass
+            
+            # Возвращаемся в главное меню с обновленной информацией
+            # (путешествие изменилось, поэтому show_main_menu перечитает его)
+            menu_message_id = dashboard["menu_message_id"]
+            if menu_message_id:
+                try:
+                    # Редактируем существующее меню
+                    await self.show_main_menu(call.message.chat.id, user_id, menu_message_id, edit=True)
+                    await self.bot.answer_callback_query(call.id, get_expenses_added_text(trip, expenses))
+                except Exception as e:
+                    # Если не удалось обновить меню, создаем новое
+                    await self.show_main_menu(call.message.chat.id, user_id)
+                    await self.bot.answer_callback_query(call.id, get_expenses_added_text(trip, expenses))
+            else:
+                # Если меню не найдено, создаем новое
+                await self.show_main_menu(call.message.chat.id, user_id)
+                await self.bot.answer_callback_query(call.id, get_expenses_added_text(trip, expenses))
+        else:
+            await self.bot.answer_callback_query(call.id, "Ошибка при добавлении расхода", show_alert=True)
+    
+    async def expense_no_callback(self, call):
+        """Отмена расхода"""
+        user_id = call.from_user.id
+        dashboard = await self.db.get_dashboard(user_id)
+        state = dashboard["state"]
+        
+        # Получаем message_id сообщения пользователя из состояния
+        user_message_id = None
+        if state and state[0] == UserState.WAITING_EXPENSE_CONFIRMATION:
+            try:
+                user_message_id = parse_expense_state(state[1])[2]
+            except (ValueError, IndexError, KeyError):
+                pass
+        
+        await self.db.set_user_state(user_id, None)
+        
+        # Удаляем сообщение пользователя с числом
+        if user_message_id:
+            try:
+                await self.bot.delete_message(call.message.chat.id, user_message_id)
+            except Exception:
+                pass
+        
+        # Удаляем сообщение с подтверждением и возвращаемся в меню
+        try:
+            await self.bot.delete_message(call.message.chat.id, call.message.message_id)
+        except Exception:
+            pass
+        
+        # Возвращаемся в главное меню (путешествие не менялось)
+        menu_message_id = dashboard["menu_message_id"]
+        if menu_message_id:
+            try:
+                await self.show_main_menu(call.message.chat.id, user_id, menu_message_id, edit=True, dashboard=dashboard)
+            except:
+                await self.show_main_menu(call.message.chat.id, user_id, dashboard=dashboard)
+        else:
+            await self.show_main_menu(call.message.chat.id, user_id, dashboard=dashboard)
+        
+        await self.bot.answer_callback_query(call.id, "❌ Расход не учтен")
+    
+    # Единый обработчик текста (должен быть последним, после всех команд).
+    # Состояние пользователя и активное путешествие читаются из базы одним
+    # запросом за апдейт; шаг FSM выбирается по словарю state_handlers
+    async def handle_text(self, message):
+        """Маршрутизация текстовых сообщений по состоянию FSM"""
+        dashboard = await self.db.get_dashboard(message.from_user.id)
+        state = dashboard["state"]
+        
+        handler = self.state_handlers.get(state[0]) if state else None
+        if handler:
+            await handler(message, state[1])
+        else:
+            await self.handle_expense(message, dashboard)
+
+
+class SyncHandlers(Handlers):
+    """Обработчики для TeleBot и Database (bot.py)"""
+    
+    def __init__(self, bot, db, trip_list_cache: Optional[TripListCache] = None):
+        super().__init__(SyncAdapter(bot), SyncAdapter(db), trip_list_cache)
+    
+    async def exchange_rate(self, from_currency: str, to_currency: str) -> Optional[float]:
+        return get_exchange_rate(from_currency, to_currency)
+    
+    async def export(self, trip: dict, fmt: str):
+        return export_expenses(self.db.target, trip, fmt)
+    
+    async def import_file(self, trip: dict, data: bytes, report_progress: Callable):
+        return import_csv(self.db.target, trip, data, lambda imported: complete(report_progress(imported)))
+    
+    async def run_import(self, chat_id: int, status_message_id: int, trip: dict, file_id: str):
+        # Импорт целиком выполняется в отдельном пуле
+        import_executor.submit(complete, self.import_document(chat_id, status_message_id, trip, file_id))
+    
+    def _bot_handler(self, handler: Callable) -> Callable:
+        @functools.wraps(handler)
+        def run(update):
+            return complete(handler(update))
+        
+        return run
+
+
+class AsyncHandlers(Handlers):
+    """Обработчики для AsyncTeleBot и AsyncDatabase (async_bot.py)"""
+    
+    async def exchange_rate(self, from_currency: str, to_currency: str) -> Optional[float]:
+        return await async_get_exchange_rate(from_currency, to_currency)
+    
+    async def export(self, trip: dict, fmt: str):
+        # Расходы читаются через соединение одного потока пула базы
+        return await self.db.run_sync(export_expenses, trip, fmt)
+    
+    async def import_file(self, trip: dict, data: bytes, report_progress: Callable):
+        loop = asyncio.get_running_loop()
+        
+        def progress(imported: int):
+            # Вызывается из потока импорта: правка сообщения уходит в цикл событий
+            asyncio.run_coroutine_threadsafe(report_progress(imported), loop)
+        
+        return await loop.run_in_executor(import_executor, import_csv, self.db.db, trip, data, progress)
+    
+    async def run_import(self, chat_id: int, status_message_id: int, trip: dict, file_id: str):
+        # Разбор и запись файла идут в пуле импорта (import_csv), здесь только ожидание
+        await self.import_document(chat_id, status_message_id, trip, file_id)
+    
+    def _bot_handler(self, handler: Callable) -> Callable:
+        return handler
@@ -0,0 +1,278 @@
+"""
+Импорт расходов из CSV в существующее путешествие.
+
+Файл разбирается построчно, строки пишутся порциями по IMPORT_CHUNK_SIZE:
+каждая порция - одна транзакция add_expenses_bulk (executemany и одно
+обновление итогов), поэтому запись других пользователей не ждет весь файл.
+Курс запрашивается один раз на каждую валюту файла, а не на строку.
+"""
+import csv
+import io
+import itertools
+import math
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from current_api import get_exchange_rate
+from database import Database
+
+# Строк в одной транзакции
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+# Максимум строк в одном файле
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "100000"))
+# Сколько импортов выполняется одновременно
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "2"))
+# Telegram отдает ботам файлы не больше 20 МБ
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024
+# Не чаще одного сообщения о ходе импорта за столько секунд (лимиты Telegram на правки)
+IMPORT_PROGRESS_INTERVAL = 2.0
+# Сколько ошибочных строк показывать в отчете
+IMPORT_ERRORS_SHOWN = 5
+
+# Импорт выполняется вне очереди апдейтов пользователя, чтобы большой файл
+# не задерживал обработку сообщений других пользователей той же очереди
+import_executor = ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix="import")
+
+# Названия колонок (в нижнем регистре) для каждого поля
+COLUMN_ALIASES = {
+    "amount": ("amount_to", "amount", "sum", "сумма"),
+    "currency": ("to_currency", "currency", "валюта"),
+    "description": ("description", "comment", "описание", "комментарий"),
+    "timestamp": ("timestamp", "date", "дата"),
+}
+
+# Форматы даты, которые понимает импорт
+TIMESTAMP_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d",
+                     "%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M", "%d.%m.%Y")
+
+_CURRENCY_CODE = re.compile(r"^[A-Z]{3}$")
+
+
+class ImportRow(NamedTuple):
+    """Строка файла после проверки"""
+    line: int
+    amount: float
+    currency: str
+    description: Optional[str]
+    timestamp: Optional[str]
+
+
+class ImportResult(NamedTuple):
+    """Итог импорта"""
+    imported: int
+    amount_to: float
+    amount_from: float
+    error_count: int
+    # Первые ошибки: (номер строки, причина)
+    errors: List[Tuple[int, str]]
+    # Файл обработан не полностью (лимит строк или ошибка чтения)
+    truncated: bool
+
+
+def parse_amount(value: str) -> Optional[float]:
+    """Положительная сумма: "1 234,50" -> 1234.5, иначе None"""
+    value = value.replace(" ", "").replace(" ", "").replace(",", ".")
+    try:
+        amount = float(value)
+    except ValueError:
+        return None
+    return amount if math.isfinite(amount) and amount > 0 else None
+
+
+def parse_timestamp(value: str) -> Optional[str]:
+    """Дата в формате CURRENT_TIMESTAMP SQLite, иначе None"""
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            continue
+    return None
+
+
+class CsvExpenseReader:
+    """
+    Потоковый разбор CSV с расходами.
+    
+    Первая строка - заголовок с колонками из COLUMN_ALIASES (обязательна
+    только сумма). Если первая строка начинается с числа, заголовка нет:
+    колонки - сумма и описание. Разделитель (",", ";" или табуляция)
+    определяется по первой строке.
+    """
+    
+    def __init__(self, data: bytes, default_currency: str):
+        self.default_currency = default_currency
+        self.error_count = 0
+        self.errors: List[Tuple[int, str]] = []
+        self.truncated = False
+        # Байты декодируются по мере чтения, без копии всего файла в str
+        self._text = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig", newline="")
+    
+    def add_error(self, line: int, reason: str):
+        self.error_count += 1
+        if len(self.errors) < IMPORT_ERRORS_SHOWN:
+            self.errors.append((line, reason))
+    
+    def _columns(self, header: List[str]) -> Optional[Dict[str, int]]:
+        """Номера колонок по заголовку; None, если первая строка - данные"""
+        if header and parse_amount(header[0]) is not None:
+            return None
+        names = [name.strip().lower() for name in header]
+        columns = {}
+        for field, aliases in COLUMN_ALIASES.items():
+            for alias in aliases:
+                if alias in names:
+                    columns[field] = names.index(alias)
+                    break
+        return columns
+    
+    def _parse_row(self, line: int, row: List[str], columns: Dict[str, int]) -> Optional[ImportRow]:
+        def cell(field: str) -> str:
+            index = columns.get(field)
+            return row[index].strip() if index is not None and index < len(row) else ""
+        
+        amount = parse_amount(cell("amount"))
+        if amount is None:
+            self.add_error(line, "сумма должна быть положительным числом")
+            return None
+        
+        currency = cell("currency").upper() or self.default_currency
+        if not _CURRENCY_CODE.match(currency):
+            self.add_error(line, f"неизвестная валюта '{currency}'")
+            return None
+        
+        timestamp = None
+        if cell("timestamp"):
+            timestamp = parse_timestamp(cell("timestamp"))
+            if timestamp is None:
+                self.add_error(line, f"неверная дата '{cell('timestamp')}'")
+                return None
+        
+        return ImportRow(line, amount, currency, cell("description") or None, timestamp)
+    
+    def rows(self) -> Iterator[ImportRow]:
+        """Проверенные строки файла; ошибочные пропускаются и попадают в errors"""
+        first_line = self._text.readline()
+        if not first_line:
+            return
+        delimiter = max((",", ";", "\t"), key=first_line.count)
+        reader = csv.reader(itertools.chain([first_line], self._text), delimiter=delimiter)
+        
+        header = next(reader)
+        columns = self._columns(header)
+        first_data_line = 2
+        if columns is None:
+            # Без заголовка: сумма и описание
+            columns = {"amount": 0, "description": 1}
+            reader = itertools.chain([header], reader)
+            first_data_line = 1
+        elif "amount" not in columns:
+            self.add_error(1, "нет колонки с суммой (amount, amount_to или сумма)")
+            self.truncated = True
+            return
+        
+        count = 0
+        for line, row in enumerate(reader, start=first_data_line):
+            if not any(value.strip() for value in row):
+                continue
+            if count >= IMPORT_MAX_ROWS:
+                self.truncated = True
+                return
+            parsed = self._parse_row(line, row, columns)
+            if parsed:
+                count += 1
+                yield parsed
+    
+    def chunks(self, size: int = IMPORT_CHUNK_SIZE) -> Iterator[List[ImportRow]]:
+        """Строки порциями по size"""
+        rows = self.rows()
+        while True:
+            chunk = list(itertools.islice(rows, size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def get_currency_rates(trip: dict, currency: str,
+                       get_rate: Callable = get_exchange_rate) -> Optional[Tuple[float, float]]:
+    """
+    Множители перевода суммы в валюте currency в валюты путешествия.
+    
+    Returns:
+        tuple: (в to_currency, в from_currency) или None, если курс недоступен
+    """
+    if currency == trip["to_currency"]:
+        # Если курс недоступен, используем сохраненный курс путешествия
+        home_rate = get_rate(currency, trip["from_currency"])
+        return 1.0, home_rate or 1 / trip["rate"]
+    if currency == trip["from_currency"]:
+        local_rate = get_rate(currency, trip["to_currency"])
+        return local_rate or trip["rate"], 1.0
+    
+    local_rate = get_rate(currency, trip["to_currency"])
+    home_rate = get_rate(currency, trip["from_currency"])
+    if local_rate is None or home_rate is None:
+        return None
+    return local_rate, home_rate
+
+
+def import_csv(db: Database, trip: dict, data: bytes,
+               progress: Optional[Callable[[int], None]] = None,
+               get_rate: Callable = get_exchange_rate,
+               chunk_size: int = IMPORT_CHUNK_SIZE) -> ImportResult:
+    """
+    Импортирует расходы из CSV в путешествие.
+    
+    Args:
+        db: База данных
+        trip: Путешествие
+        data: Содержимое файла (UTF-8)
+        progress: Вызывается с числом импортированных строк после записи порции,
+            не чаще раза в IMPORT_PROGRESS_INTERVAL секунд
+        get_rate: Функция курса (from_currency, to_currency)
+        chunk_size: Строк в одной транзакции
+    
+    Returns:
+        ImportResult: Число строк, суммы и ошибки
+    """
+    reader = CsvExpenseReader(data, trip["to_currency"])
+    rates: Dict[str, Optional[Tuple[float, float]]] = {}
+    imported = 0
+    total_to = total_from = 0.0
+    last_progress = time.monotonic()
+    
+    try:
+        for chunk in reader.chunks(chunk_size):
+            expenses = []
+            for row in chunk:
+                if row.currency not in rates:
+                    rates[row.currency] = get_currency_rates(trip, row.currency, get_rate)
+                currency_rates = rates[row.currency]
+                if currency_rates is None:
+                    reader.add_error(row.line, f"нет курса для {row.currency}")
+                    continue
+                to_factor, from_factor = currency_rates
+                expenses.append((row.amount * to_factor, row.amount * from_factor, row.description, row.timestamp))
+            
+            if not expenses:
+                continue
+            if not db.add_expenses_bulk(trip["id"], expenses):
+                reader.truncated = True
+                break
+            
+            imported += len(expenses)
+            total_to += sum(expense[0] for expense in expenses)
+            total_from += sum(expense[1] for expense in expenses)
+            if progress and time.monotonic() - last_progress >= IMPORT_PROGRESS_INTERVAL:
+                progress(imported)
+                last_progress = time.monotonic()
+    except (UnicodeDecodeError, csv.Error) as e:
+        # Уже записанные порции остаются, отчет покажет, где чтение прервалось
+        print(f"Ошибка чтения CSV: {e}")
+        reader.add_error(0, "файл не в кодировке UTF-8 или поврежден")
+        reader.truncated = True
+    
+    return ImportResult(imported, total_to, total_from, reader.error_count, reader.errors, reader.truncated)
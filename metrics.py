@@ -0,0 +1,299 @@
+"""
+Метрики бота: гистограммы задержек, счетчики ошибок и число выполняющихся
+вызовов для обработчиков апдейтов, методов Database и запросов к API курсов.
+
+install_metrics() оборачивает зарегистрированные обработчики бота, методы класса
+Database и HTTP-клиенты current_api, а start_metrics_server() отдает
+метрики в текстовом формате Prometheus на METRICS_HOST:METRICS_PORT/metrics.
+Обертка добавляет к вызову два замера perf_counter и обновление счетчиков
+своего потока без блокировок (накладные расходы - bench/metrics_overhead.py).
+"""
+import bisect
+import functools
+import inspect
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+
+from current_api import AsyncHttpClient, HttpClient
+from database import Database
+
+load_dotenv()
+
+# Порт сервера метрик (0 - метрики выключены, обертки не ставятся)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+# Адрес сервера метрик: по умолчанию доступен только локально
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Верхние границы корзин гистограммы задержек (секунды)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Списки обработчиков бота, которые оборачивает install_metrics()
+HANDLER_LISTS = ("message_handlers", "edited_message_handlers", "callback_query_handlers")
+# Служебные методы Database, которые вызываются внутри других и только засоряют метрики
+DB_METHODS_EXCLUDED = ("get_connection",)
+
+
+class _Shard:
+    """Счетчики одного потока: их меняет только этот поток, поэтому без блокировки"""
+    
+    __slots__ = ("buckets", "total", "count", "errors", "in_flight")
+    
+    def __init__(self):
+        # Последняя корзина - +Inf
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.errors = 0
+        self.in_flight = 0
+    
+    def record(self, elapsed: float, failed: bool):
+        self.in_flight -= 1
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+        self.total += elapsed
+        self.count += 1
+        if failed:
+            self.errors += 1
+
+
+class CallStats:
+    """
+    Гистограмма задержек, ошибки и число выполняющихся вызовов одного имени.
+    
+    У каждого потока свой набор счетчиков (_Shard), поэтому вызов не берет
+    блокировку; snapshot складывает счетчики всех потоков.
+    """
+    
+    __slots__ = ("_shards", "_local", "_lock")
+    
+    def __init__(self):
+        self._shards: List[_Shard] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+    
+    def shard(self) -> _Shard:
+        """Счетчики текущего потока"""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+    
+    def snapshot(self) -> Tuple[List[int], float, int, int, int]:
+        """Корзины, сумма, число вызовов, ошибки и выполняющиеся вызовы"""
+        with self._lock:
+            shards = list(self._shards)
+        buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        total = 0.0
+        count = errors = in_flight = 0
+        for shard in shards:
+            for index, bucket in enumerate(shard.buckets):
+                buckets[index] += bucket
+            total += shard.total
+            count += shard.count
+            errors += shard.errors
+            in_flight += shard.in_flight
+        return buckets, total, count, errors, in_flight
+
+
+def _quantile(buckets: List[int], count: int, q: float) -> Optional[float]:
+    """Верхняя граница корзины, в которую попадает квантиль q (None - за последней границей)"""
+    rank = q * count
+    seen = 0
+    for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+        seen += bucket
+        if seen >= rank:
+            return bound
+    return None
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """Метрики вызовов по паре (вид, имя): handler, db, http"""
+    
+    def __init__(self):
+        self._calls: Dict[Tuple[str, str], CallStats] = {}
+        self._lock = threading.Lock()
+    
+    def stats_for(self, kind: str, name: str) -> CallStats:
+        key = (kind, name)
+        stats = self._calls.get(key)
+        if stats is None:
+            with self._lock:
+                stats = self._calls.setdefault(key, CallStats())
+        return stats
+    
+    def wrap(self, func: Callable, kind: str, name: Optional[str] = None,
+             label: Optional[Callable[..., str]] = None) -> Callable:
+        """
+        Оборачивает функцию (или корутину) замером задержки.
+        
+        Args:
+            func: Функция
+            kind: Вид вызова (handler, db, http)
+            name: Имя в метриках (по умолчанию имя функции)
+            label: Функция аргументов вызова -> имя, если имя зависит от аргументов
+        """
+        if getattr(func, "__metrics__", False):
+            return func
+        # Для имени без label счетчики находятся один раз, при оборачивании
+        fixed = self.stats_for(kind, name or func.__name__) if label is None else None
+        
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                stats = fixed or self.stats_for(kind, label(*args, **kwargs))
+                # Корутина выполняется в потоке цикла событий, поэтому счетчики потока те же до конца вызова
+                shard = stats.shard()
+                shard.in_flight += 1
+                failed = True
+                start = time.perf_counter()
+                try:
+                    result = await func(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    shard.record(time.perf_counter() - start, failed)
+            
+            async_wrapper.__metrics__ = True
+            return async_wrapper
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stats = fixed or self.stats_for(kind, label(*args, **kwargs))
+            shard = stats.shard()
+            shard.in_flight += 1
+            failed = True
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                shard.record(time.perf_counter() - start, failed)
+        
+        wrapper.__metrics__ = True
+        return wrapper
+    
+    def wrap_methods(self, cls: type, kind: str, exclude: Tuple[str, ...] = ()):
+        """Оборачивает публичные методы класса (генераторы не оборачиваются: их время - время итерации)"""
+        for name, member in list(vars(cls).items()):
+            if name.startswith("_") or name in exclude:
+                continue
+            if not inspect.isfunction(member) or inspect.isgeneratorfunction(member):
+                continue
+            setattr(cls, name, self.wrap(member, kind, name))
+    
+    def _items(self) -> List[Tuple[Tuple[str, str], Tuple]]:
+        with self._lock:
+            calls = sorted(self._calls.items())
+        return [(key, stats.snapshot()) for key, stats in calls]
+    
+    def render(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        items = self._items()
+        histogram, errors, in_flight = [], [], []
+        for (kind, name), (buckets, total, count, error_count, running) in items:
+            labels = f'kind="{_escape(kind)}",name="{_escape(name)}"'
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+                cumulative += bucket
+                histogram.append(f'travel_bot_call_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            histogram.append(f'travel_bot_call_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            histogram.append(f"travel_bot_call_duration_seconds_sum{{{labels}}} {total}")
+            histogram.append(f"travel_bot_call_duration_seconds_count{{{labels}}} {count}")
+            errors.append(f"travel_bot_call_errors_total{{{labels}}} {error_count}")
+            in_flight.append(f"travel_bot_calls_in_flight{{{labels}}} {running}")
+        
+        lines = [
+            "# HELP travel_bot_call_duration_seconds Длительность вызовов обработчиков, базы и API курсов",
+            "# TYPE travel_bot_call_duration_seconds histogram",
+            *histogram,
+            "# HELP travel_bot_call_errors_total Вызовы, завершившиеся исключением",
+            "# TYPE travel_bot_call_errors_total counter",
+            *errors,
+            "# HELP travel_bot_calls_in_flight Вызовы, которые выполняются сейчас",
+            "# TYPE travel_bot_calls_in_flight gauge",
+            *in_flight,
+        ]
+        return "\n".join(lines) + "\n"
+    
+    def summary(self) -> dict:
+        """Краткая сводка для /stats: число вызовов, ошибки и оценки p50/p99 (мс) по видам"""
+        summary: Dict[str, dict] = {}
+        for (kind, name), (buckets, total, count, error_count, running) in self._items():
+            if not count and not running:
+                continue
+            entry = {"count": count, "errors": error_count, "in_flight": running}
+            if count:
+                p50, p99 = _quantile(buckets, count, 0.5), _quantile(buckets, count, 0.99)
+                entry.update({
+                    "avg_ms": round(total / count * 1000, 3),
+                    "p50_ms": p50 * 1000 if p50 is not None else None,
+                    "p99_ms": p99 * 1000 if p99 is not None else None,
+                })
+            summary.setdefault(kind, {})[name] = entry
+        return summary
+
+
+metrics = MetricsRegistry()
+
+
+def _http_label(client, url: str, *args, **kwargs) -> str:
+    """Имя запроса к API - путь без хоста и параметров: /live, /convert"""
+    return urlparse(url).path or "/"
+
+
+def install_metrics(bot, registry: MetricsRegistry = metrics):
+    """
+    Оборачивает метриками обработчики бота, методы Database и HTTP-клиенты API курсов.
+    
+    Вызывается после регистрации всех обработчиков (перед запуском polling
+    или вебхука). Повторный вызов ничего не оборачивает дважды.
+    """
+    for list_name in HANDLER_LISTS:
+        for handler in getattr(bot, list_name, []):
+            handler["function"] = registry.wrap(handler["function"], "handler")
+    
+    registry.wrap_methods(Database, "db", exclude=DB_METHODS_EXCLUDED)
+    HttpClient.get = registry.wrap(HttpClient.get, "http", label=_http_label)
+    AsyncHttpClient.get_json = registry.wrap(AsyncHttpClient.get_json, "http", label=_http_label)
+
+
+def start_metrics_server(registry: MetricsRegistry = metrics, host: str = METRICS_HOST,
+                         port: int = METRICS_PORT) -> ThreadingHTTPServer:
+    """Запускает HTTP-сервер GET /metrics в фоновом потоке"""
+    
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            pass
+    
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"Метрики: http://{host}:{httpd.server_address[1]}/metrics")
+    return httpd
@@ -0,0 +1,191 @@
+"""
+Фоновый прогрев курсов для валютных пар активных путешествий.
+
+Раз в RATE_PREFETCH_INTERVAL секунд планировщик берет из базы различные
+пары (from_currency, to_currency) активных путешествий, обновляет матрицу
+кросс-курсов одним запросом /live (если она устарела), выбирает курсы всех
+пар из нее одной векторной операцией и кладет их в rate_cache. Пары, которых нет в снимке, запрашиваются через /convert.
+Все фоновые запросы к API укладываются в бюджет RATE_API_BUDGET запросов
+за RATE_API_BUDGET_WINDOW секунд, поэтому обработчик расхода почти никогда
+не ждет сеть, а квота API не расходуется сверх заданной.
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from current_api import RATE_CACHE_TTL, RateCache, RateMatrix, fetch_exchange_rate, rate_cache, rate_matrix
+from database import Database
+
+load_dotenv()
+
+# Период прогрева: меньше времени жизни курса в кэше, чтобы курсы активных пар не устаревали
+RATE_PREFETCH_INTERVAL = float(os.getenv("RATE_PREFETCH_INTERVAL", str(RATE_CACHE_TTL / 2)))
+# Сколько фоновых запросов к API курсов разрешено за окно
+RATE_API_BUDGET = int(os.getenv("RATE_API_BUDGET", "100"))
+# Окно бюджета запросов (секунды)
+RATE_API_BUDGET_WINDOW = float(os.getenv("RATE_API_BUDGET_WINDOW", "86400"))
+
+
+class RequestBudget:
+    """Не больше limit запросов за window секунд (скользящее окно)"""
+    
+    def __init__(self, limit: int = RATE_API_BUDGET, window: float = RATE_API_BUDGET_WINDOW):
+        self.limit = limit
+        self.window = window
+        self._spent = deque()
+        self._lock = threading.Lock()
+    
+    def _expire(self, now: float):
+        while self._spent and now - self._spent[0] >= self.window:
+            self._spent.popleft()
+    
+    def try_spend(self) -> bool:
+        """Резервирует один запрос; False, если бюджет окна исчерпан"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if len(self._spent) >= self.limit:
+                return False
+            self._spent.append(now)
+            return True
+    
+    def remaining(self) -> int:
+        """Сколько запросов еще можно сделать в текущем окне"""
+        with self._lock:
+            self._expire(time.monotonic())
+            return self.limit - len(self._spent)
+
+
+class RatePrefetcher:
+    """Планировщик прогрева курсов активных путешествий"""
+    
+    def __init__(self, db: Database, cache: RateCache = rate_cache, matrix: RateMatrix = rate_matrix,
+                 interval: float = RATE_PREFETCH_INTERVAL, budget: Optional[RequestBudget] = None):
+        self.db = db
+        self.cache = cache
+        self.matrix = matrix
+        self.interval = interval
+        self.budget = budget or RequestBudget()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # Длительность последних обновлений (секунды)
+        self._durations = deque(maxlen=100)
+        self._pairs: list[tuple[str, str]] = []
+        self.rounds = 0
+        self.requests = 0
+        self.skipped = 0
+        self.last_round: dict = {}
+    
+    def refresh(self) -> dict:
+        """
+        Один проход прогрева.
+        
+        Returns:
+            dict: Число пар, сколько прогрето из матрицы и через /convert,
+            сколько пропущено из-за бюджета и длительность прохода (мс)
+        """
+        start = time.perf_counter()
+        pairs = self.db.get_active_currency_pairs()
+        
+        from_matrix = from_api = skipped = failed = 0
+        # Устаревшая матрица обновляется одним запросом /live на все валюты
+        if pairs and not self.matrix.is_fresh():
+            if self.budget.try_spend():
+                self.requests += 1
+                self.matrix.refresh()
+            else:
+                skipped += 1
+        # Курсы устаревшего снимка в кэш не кладутся, чтобы не выдать их за свежие
+        use_matrix = self.matrix.is_fresh()
+        # Курсы всех пар из матрицы одной векторной выборкой (NaN - пары нет в снимке)
+        matrix_rates = self.matrix.get_rates(pairs) if use_matrix else np.full(len(pairs), np.nan)
+        
+        for (from_currency, to_currency), matrix_rate in zip(pairs, matrix_rates):
+            rate = None if np.isnan(matrix_rate) else float(matrix_rate)
+            if rate is not None:
+                from_matrix += 1
+            elif self.budget.try_spend():
+                self.requests += 1
+                rate = fetch_exchange_rate(from_currency, to_currency)
+                from_api += rate is not None
+                failed += rate is None
+            else:
+                skipped += 1
+            if rate:
+                # Кладется и обратный курс: расход конвертируется из to_currency в from_currency
+                self.cache.put(from_currency, to_currency, rate)
+        
+        duration = time.perf_counter() - start
+        round_stats = {
+            "pairs": len(pairs),
+            "from_matrix": from_matrix,
+            "from_api": from_api,
+            "failed": failed,
+            "skipped_budget": skipped,
+            "duration_ms": round(duration * 1000, 2),
+        }
+        with self._lock:
+            self.rounds += 1
+            self.skipped += skipped
+            self._durations.append(duration)
+            self._pairs = pairs
+            self.last_round = round_stats
+        return round_stats
+    
+    def start(self):
+        """Запускает прогрев в фоновом потоке"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="rate-prefetch", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Останавливает фоновый прогрев"""
+        self._stop.set()
+    
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Ошибка при прогреве курсов: {e}")
+            self._stop.wait(self.interval)
+    
+    def stats(self) -> dict:
+        """Длительность обновлений, возраст курсов активных пар и остаток бюджета"""
+        with self._lock:
+            durations = sorted(self._durations)
+            pairs = list(self._pairs)
+            stats = {
+                "rounds": self.rounds,
+                "requests": self.requests,
+                "skipped_budget": self.skipped,
+                "budget_remaining": self.budget.remaining(),
+                "last_round": dict(self.last_round),
+            }
+        
+        if durations:
+            stats.update({
+                "refresh_p50_ms": round(durations[len(durations) // 2] * 1000, 2),
+                "refresh_max_ms": round(durations[-1] * 1000, 2),
+            })
+        
+        # Возраст курса в кэше для каждой активной пары (None - курса нет)
+        ages = [self.cache.age(from_currency, to_currency) for from_currency, to_currency in pairs]
+        known = sorted(age for age in ages if age is not None)
+        stats.update({
+            "pairs_cached": len(known),
+            "pairs_missing": len(ages) - len(known),
+            "max_age_s": round(known[-1], 1) if known else None,
+        })
+        if self.matrix.updated_at is not None:
+            stats["matrix_age_s"] = round(time.monotonic() - self.matrix.updated_at, 1)
+        stats["cache"] = self.cache.stats()
+        return stats
@@ -0,0 +1,352 @@
+"""
+Трассировка апдейтов: куда ушло время медленного ответа.
+
+Каждый вызов обработчика апдейта открывает корневой спан, а вызовы методов
+Database, запросы к API курсов и запросы к Telegram Bot API внутри него -
+дочерние спаны. Текущий спан хранится в contextvars, поэтому трассировка
+работает и в потоках (bot.py), и в цикле событий (async_bot.py). Если
+апдейт обрабатывался дольше TRACE_SLOW_MS, его трасса пишется в лог одной
+строкой JSON: дерево спанов и время по видам (db, http, telegram).
+
+Доля TRACE_PROFILE_SAMPLE апдейтов дополнительно выполняется под cProfile;
+профиль медленного апдейта сохраняется в TRACE_PROFILE_DIR для разбора
+через pstats или snakeviz. Профилировщик один на процесс: с Python 3.12
+cProfile работает через sys.monitoring и видит все потоки, а в цикле
+событий - все корутины, поэтому в профиль попадают и апдейты, которые
+выполнялись одновременно; их число пишется в запись рядом с профилем.
+"""
+import contextvars
+import cProfile
+import functools
+import inspect
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, List, Optional
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+from telebot import apihelper, asyncio_helper
+
+from current_api import AsyncHttpClient, HttpClient
+from database import Database
+from metrics import DB_METHODS_EXCLUDED, HANDLER_LISTS
+
+load_dotenv()
+
+# Порог медленного апдейта, мс (0 - трассировка выключена, обертки не ставятся)
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))
+# Каталог профилей cProfile медленных апдейтов (пусто - профилирование выключено)
+TRACE_PROFILE_DIR = os.getenv("TRACE_PROFILE_DIR", "")
+# Доля апдейтов, которые выполняются под профилировщиком
+TRACE_PROFILE_SAMPLE = float(os.getenv("TRACE_PROFILE_SAMPLE", "0.05"))
+
+
+class Span:
+    """Интервал выполнения: имя, вид, время начала и дочерние спаны"""
+    
+    __slots__ = ("name", "kind", "start", "duration", "error", "children")
+    
+    def __init__(self, name: str, kind: str):
+        self.name = name
+        self.kind = kind
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.error: Optional[str] = None
+        self.children: List["Span"] = []
+    
+    def finish(self, error: Optional[BaseException] = None):
+        self.duration = time.perf_counter() - self.start
+        if error is not None:
+            self.error = type(error).__name__
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    """Открытый спан текущего апдейта или None вне трассы"""
+    return _current_span.get()
+
+
+def _flatten(root: Span) -> List[dict]:
+    """Спаны трассы в порядке обхода: смещение от начала апдейта, длительность и глубина"""
+    spans = []
+    
+    def visit(span: Span, depth: int):
+        entry = {
+            "name": span.name,
+            "kind": span.kind,
+            "offset_ms": round((span.start - root.start) * 1000, 2),
+            "duration_ms": round(span.duration * 1000, 2),
+            "depth": depth,
+        }
+        if span.error:
+            entry["error"] = span.error
+        spans.append(entry)
+        # Дочерние спаны из пула базы могут добавиться не по порядку начала
+        for child in sorted(span.children, key=lambda child: child.start):
+            visit(child, depth + 1)
+    
+    visit(root, 0)
+    return spans
+
+
+def _time_by_kind(root: Span) -> dict:
+    """Время по видам дочерних спанов верхнего уровня и остаток - собственный код обработчика"""
+    totals = {}
+    for child in root.children:
+        totals[child.kind] = totals.get(child.kind, 0.0) + child.duration
+    own = root.duration - sum(totals.values())
+    result = {kind: round(total * 1000, 2) for kind, total in sorted(totals.items())}
+    result["self"] = round(max(own, 0.0) * 1000, 2)
+    return result
+
+
+class Tracer:
+    """Корневые спаны апдейтов, журнал медленных трасс и выборочное профилирование"""
+    
+    def __init__(self, slow_ms: float = TRACE_SLOW_MS, profile_dir: str = TRACE_PROFILE_DIR,
+                 profile_sample: float = TRACE_PROFILE_SAMPLE, log: Callable[[str], None] = print):
+        self.slow_ms = slow_ms
+        self.profile_dir = profile_dir
+        self.profile_sample = profile_sample
+        self.log = log
+        self.traced = 0
+        self.slow = 0
+        self.profiles = 0
+        # Профиль снимается одним профилировщиком за раз; пока он работает,
+        # считаются апдейты, которые выполняются одновременно с профилируемым
+        self._profile_lock = threading.Lock()
+        self._profiling = False
+        self._in_flight = 0
+        self._profile_overlap = 0
+    
+    def _start_profile(self) -> Optional[cProfile.Profile]:
+        """Учитывает начало апдейта и запускает профилировщик, если апдейт попал в выборку"""
+        if not self.profile_dir:
+            return None
+        with self._profile_lock:
+            self._in_flight += 1
+            if self._profiling:
+                # Апдейт выполняется внутри чужого профиля и попадет в него
+                self._profile_overlap += 1
+                return None
+            if random.random() >= self.profile_sample:
+                return None
+            self._profiling = True
+            self._profile_overlap = self._in_flight - 1
+        
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Профилировщик запущен вне трассировки (например, python -m cProfile)
+            with self._profile_lock:
+                self._profiling = False
+            return None
+        return profiler
+    
+    def _finish(self, root: Span, attrs: dict, profiler: Optional[cProfile.Profile]):
+        overlap = 0
+        if profiler is not None:
+            profiler.disable()
+        if self.profile_dir:
+            with self._profile_lock:
+                self._in_flight -= 1
+                if profiler is not None:
+                    overlap = self._profile_overlap
+                    self._profiling = False
+        self.traced += 1
+        duration_ms = root.duration * 1000
+        if duration_ms < self.slow_ms:
+            return
+        
+        self.slow += 1
+        record = {
+            "event": "slow_update",
+            "time": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "handler": root.name,
+            **attrs,
+            "duration_ms": round(duration_ms, 2),
+            "by_kind_ms": _time_by_kind(root),
+            "spans": _flatten(root),
+        }
+        if root.error:
+            record["error"] = root.error
+        if profiler is not None:
+            record["profile"] = self._dump_profile(profiler, root)
+            # Сколько других апдейтов выполнялось во время профиля и попало в него
+            record["profile_other_updates"] = overlap
+        self.log(json.dumps(record, ensure_ascii=False))
+    
+    def _dump_profile(self, profiler: cProfile.Profile, root: Span) -> Optional[str]:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        path = os.path.join(self.profile_dir, f"{stamp}_{root.name}_{int(root.duration * 1000)}ms.prof")
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(path)
+        except OSError as e:
+            print(f"Не удалось сохранить профиль апдейта: {e}")
+            return None
+        self.profiles += 1
+        return path
+    
+    def trace_handler(self, func: Callable) -> Callable:
+        """Оборачивает обработчик апдейта корневым спаном"""
+        if getattr(func, "__traced__", False):
+            return func
+        name = func.__name__
+        
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(update, *args, **kwargs):
+                root = Span(name, "update")
+                token = _current_span.set(root)
+                profiler = self._start_profile()
+                error = None
+                try:
+                    return await func(update, *args, **kwargs)
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    root.finish(error)
+                    _current_span.reset(token)
+                    self._finish(root, _update_attrs(update), profiler)
+            
+            async_wrapper.__traced__ = True
+            return async_wrapper
+        
+        @functools.wraps(func)
+        def wrapper(update, *args, **kwargs):
+            root = Span(name, "update")
+            token = _current_span.set(root)
+            profiler = self._start_profile()
+            error = None
+            try:
+                return func(update, *args, **kwargs)
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                root.finish(error)
+                _current_span.reset(token)
+                self._finish(root, _update_attrs(update), profiler)
+        
+        wrapper.__traced__ = True
+        return wrapper
+    
+    def stats(self) -> dict:
+        return {"traced": self.traced, "slow": self.slow, "profiles": self.profiles, "slow_ms": self.slow_ms}
+
+
+def _update_attrs(update) -> dict:
+    """Пользователь и вид апдейта (Message или CallbackQuery) для журнала"""
+    attrs = {"update_type": type(update).__name__}
+    user = getattr(update, "from_user", None)
+    if user is not None:
+        attrs["user_id"] = user.id
+    return attrs
+
+
+def traced(func: Callable, kind: str, name: Optional[str] = None,
+           label: Optional[Callable[..., str]] = None) -> Callable:
+    """
+    Оборачивает функцию дочерним спаном текущего апдейта.
+    
+    Вне трассы (нет открытого спана) функция вызывается напрямую.
+    
+    Args:
+        func: Функция или корутина
+        kind: Вид спана (db, http, telegram)
+        name: Имя спана (по умолчанию имя функции)
+        label: Функция аргументов вызова -> имя, если имя зависит от аргументов
+    """
+    if getattr(func, "__traced__", False):
+        return func
+    fixed = name or func.__name__
+    
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            parent = _current_span.get()
+            if parent is None:
+                return await func(*args, **kwargs)
+            span = Span(label(*args, **kwargs) if label else fixed, kind)
+            parent.children.append(span)
+            token = _current_span.set(span)
+            error = None
+            try:
+                return await func(*args, **kwargs)
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                span.finish(error)
+                _current_span.reset(token)
+        
+        async_wrapper.__traced__ = True
+        return async_wrapper
+    
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        parent = _current_span.get()
+        if parent is None:
+            return func(*args, **kwargs)
+        span = Span(label(*args, **kwargs) if label else fixed, kind)
+        parent.children.append(span)
+        token = _current_span.set(span)
+        error = None
+        try:
+            return func(*args, **kwargs)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            span.finish(error)
+            _current_span.reset(token)
+    
+    wrapper.__traced__ = True
+    return wrapper
+
+
+def _http_label(client, url: str, *args, **kwargs) -> str:
+    """Имя запроса к API курсов - путь без хоста и параметров: /live, /convert"""
+    return urlparse(url).path or "/"
+
+
+def _telegram_label(token, method_name: str, *args, **kwargs) -> str:
+    """Имя запроса к Bot API - метод: sendMessage, editMessageText"""
+    return method_name
+
+
+tracer = Tracer()
+
+
+def install_tracing(bot, tracer: Tracer = tracer):
+    """
+    Оборачивает обработчики бота корневыми спанами, а методы Database,
+    HTTP-клиенты API курсов и запросы к Telegram - дочерними.
+    
+    Вызывается после регистрации всех обработчиков. Повторный вызов ничего
+    не оборачивает дважды.
+    """
+    for list_name in HANDLER_LISTS:
+        for handler in getattr(bot, list_name, []):
+            handler["function"] = tracer.trace_handler(handler["function"])
+    
+    for name, member in list(vars(Database).items()):
+        if name.startswith("_") or name in DB_METHODS_EXCLUDED:
+            continue
+        if inspect.isfunction(member) and not inspect.isgeneratorfunction(member):
+            setattr(Database, name, traced(member, "db", name))
+    
+    HttpClient.get = traced(HttpClient.get, "http", label=_http_label)
+    AsyncHttpClient.get_json = traced(AsyncHttpClient.get_json, "http", label=_http_label)
+    apihelper._make_request = traced(apihelper._make_request, "telegram", label=_telegram_label)
+    asyncio_helper._process_request = traced(asyncio_helper._process_request, "telegram",
+                                             label=_telegram_label)
@@ -0,0 +1,545 @@
+"""
+Тексты, клавиатуры и разбор ввода пользователя.
+
+Общие для синхронного (bot.py) и асинхронного (async_bot.py) режимов:
+обработчики отличаются только способом вызова Telegram API, базы и API
+курсов, а все, что видит пользователь, строится здесь.
+"""
+import json
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from telebot import types
+
+
+# Состояния FSM
+class UserState:
+    WAITING_FROM_COUNTRY = "waiting_from_country"
+    WAITING_TO_COUNTRY = "waiting_to_country"
+    WAITING_MANUAL_RATE = "waiting_manual_rate"
+    WAITING_INITIAL_AMOUNT = "waiting_initial_amount"
+    WAITING_EXPENSE_CONFIRMATION = "waiting_expense_confirmation"
+    WAITING_NEW_RATE = "waiting_new_rate"
+
+
+# Число расходов на странице истории
+HISTORY_PAGE_SIZE = 10
+# Число путешествий на странице списка
+TRIPS_PAGE_SIZE = 10
+# Максимум расходов в одном сообщении
+MAX_BATCH_EXPENSES = 50
+# Максимальная длина описания расхода
+MAX_DESCRIPTION_LENGTH = 100
+# Сколько отрисованных страниц списка путешествий держать в памяти
+TRIP_LIST_CACHE_SIZE = 1000
+
+NO_ACTIVE_TRIP_TEXT = "❌ У вас нет активного путешествия. Создайте новое!"
+
+NEW_TRIP_TEXT = (
+    "✈️ Создание нового путешествия\n\n"
+    "Введите страну отправления (например: Россия, USA, Китай):"
+)
+
+EMPTY_HISTORY_TEXT = "📊 История расходов пуста.\n\nВы еще не совершили ни одного расхода."
+
+SAME_CURRENCY_TEXT = (
+    "❌ Валюты стран отправления и назначения совпадают!\n"
+    "Пожалуйста, выберите разные страны."
+)
+
+FETCHING_RATE_TEXT = "⏳ Получаю курс обмена через API..."
+
+RATE_UNAVAILABLE_TEXT = (
+    "❌ Не удалось получить курс обмена через API.\n"
+    "Пожалуйста, введите курс вручную (например: 0.0125 для 1 CNY = 0.0125 RUB):"
+)
+
+INVALID_MANUAL_RATE_TEXT = "❌ Неверный формат курса. Введите положительное число (например: 0.08):"
+
+INVALID_RATE_TEXT = "❌ Неверный формат курса. Введите положительное число:"
+
+INVALID_AMOUNT_TEXT = "❌ Неверный формат суммы. Введите положительное число:"
+
+TRIP_CREATE_FAILED_TEXT = "❌ Ошибка при создании путешествия. Возможно, такое путешествие уже существует."
+
+RATE_UPDATE_FAILED_TEXT = "❌ Ошибка при обновлении курса"
+
+EXPORT_USAGE_TEXT = "📤 Выгрузка расходов файлом: /export csv или /export json"
+
+EXPORT_EMPTY_TEXT = "📭 В этом путешествии пока нет расходов для выгрузки."
+
+EXPORT_FAILED_TEXT = "❌ Не удалось выгрузить расходы. Попробуйте позже."
+
+IMPORT_HELP_TEXT = (
+    "📥 Импорт расходов: отправьте CSV-файл (UTF-8).\n\n"
+    "Первая строка - заголовок. Колонки: amount (сумма), "
+    "currency (валюта, по умолчанию валюта страны пребывания), "
+    "description (описание), date (дата: 2024-05-01 или 01.05.2024).\n"
+    "Подходит и файл из /export."
+)
+
+IMPORT_TOO_LARGE_TEXT = "❌ Файл слишком большой. Telegram позволяет боту скачивать файлы до 20 МБ."
+
+IMPORT_STARTED_TEXT = "📥 Импорт расходов: читаю файл..."
+
+IMPORT_FAILED_TEXT = "❌ Не удалось импортировать файл. Попробуйте позже."
+
+
+def get_unknown_country_text(country: str, from_country: bool) -> str:
+    """Сообщение о стране, для которой не удалось определить валюту"""
+    text = f"❌ Не удалось определить валюту для страны '{country}'.\n"
+    if from_country:
+        return text + "Пожалуйста, введите название страны еще раз (например: Россия, USA, Китай):"
+    return text + "Пожалуйста, введите название страны еще раз:"
+
+
+def get_from_country_text(from_country: str, from_currency: str) -> str:
+    """Подтверждение страны отправления и запрос страны назначения"""
+    return (
+        f"✅ Страна отправления: {from_country} ({from_currency})\n\n"
+        "Теперь введите страну назначения:"
+    )
+
+
+def get_to_country_text(to_country: str, to_currency: str, from_currency: str, rate: float) -> str:
+    """Подтверждение страны назначения и курса, запрос начальной суммы"""
+    return (
+        f"✅ Страна назначения: {to_country} ({to_currency})\n"
+        f"💱 Курс: 1 {from_currency} = {rate:.6f} {to_currency}\n\n"
+        f"Введите начальную сумму в валюте {from_currency} (вашей домашней валюте):"
+    )
+
+
+def get_manual_rate_text(from_currency: str, to_currency: str, rate: float) -> str:
+    """Подтверждение курса, введенного вручную, и запрос начальной суммы"""
+    return (
+        f"✅ Курс установлен: 1 {from_currency} = {rate:.6f} {to_currency}\n\n"
+        f"Введите начальную сумму в валюте {from_currency} (вашей домашней валюте):"
+    )
+
+
+def get_rate_updated_text(trip: dict, new_rate: float) -> str:
+    """Подтверждение изменения курса путешествия"""
+    return (
+        f"✅ Курс обновлен!\n\n"
+        f"Новый курс: 1 {trip['from_currency']} = {new_rate:.6f} {trip['to_currency']}\n\n"
+        f"{format_balance(trip)}"
+    )
+
+
+def get_main_menu_text(trip: Optional[dict]) -> str:
+    """Создает текст главного меню с информацией об активном путешествии"""
+    text = "👋 Travel Wallet\n\n"
+    
+    if trip:
+        text += (
+            f"📍 {trip['from_country']} ({trip['from_currency']}) → {trip['to_country']} ({trip['to_currency']})\n\n"
+            f"💸 Потрачено: {trip['spent_to']:,.2f} {trip['to_currency']} = {trip['spent_from']:,.2f} {trip['from_currency']}\n\n"
+            f"💰 Остаток: {trip['balance_to']:,.2f} {trip['to_currency']} = {trip['balance_from']:,.2f} {trip['from_currency']}\n\n"
+            f"💡 Введите сумму расхода в валюте {trip['to_currency']}"
+        )
+    else:
+        text += "У вас нет активного путешествия.\nСоздайте новое путешествие!\n\n"
+        text += "Выберите действие:"
+    
+    return text
+
+
+def get_main_menu_keyboard():
+    """Создает главное меню с inline-кнопками"""
+    keyboard = types.InlineKeyboardMarkup(row_width=1)
+    keyboard.add(types.InlineKeyboardButton("✈️ Создать новое путешествие", callback_data="new_trip"))
+    keyboard.add(types.InlineKeyboardButton("📋 Мои путешествия", callback_data="my_trips"))
+    keyboard.add(types.InlineKeyboardButton("💰 Баланс", callback_data="balance"))
+    keyboard.add(types.InlineKeyboardButton("📊 История расходов", callback_data="history"))
+    keyboard.add(types.InlineKeyboardButton("💱 Изменить курс", callback_data="set_rate"))
+    return keyboard
+
+
+def get_back_keyboard(callback_data: str = "back_to_menu", text: str = "🔙 Назад"):
+    """Клавиатура с одной кнопкой возврата"""
+    keyboard = types.InlineKeyboardMarkup()
+    keyboard.add(types.InlineKeyboardButton(text, callback_data=callback_data))
+    return keyboard
+
+
+def format_balance(trip: dict) -> str:
+    """Форматирует баланс для отображения"""
+    balance_from = trip["balance_from"]
+    balance_to = trip["balance_to"]
+    from_curr = trip["from_currency"]
+    to_curr = trip["to_currency"]
+    
+    return f"💰 Остаток: {balance_to:,.2f} {to_curr} = {balance_from:,.2f} {from_curr}"
+
+
+def format_trip(trip: dict, title: str) -> str:
+    """Карточка путешествия: страны, курс и остаток"""
+    return (
+        f"{title}\n\n"
+        f"📍 Из: {trip['from_country']} ({trip['from_currency']})\n"
+        f"📍 В: {trip['to_country']} ({trip['to_currency']})\n"
+        f"💱 Курс: 1 {trip['from_currency']} = {trip['rate']:.6f} {trip['to_currency']}\n\n"
+        f"{format_balance(trip)}"
+    )
+
+
+def get_trips_list(trips: list[dict], has_older: bool = False, has_newer: bool = False):
+    """
+    Страница списка путешествий пользователя: клавиатура и текст.
+    
+    Курсор страницы (id крайнего путешествия) передается в callback_data:
+    trips_page|older|<id> или trips_page|newer|<id>.
+    """
+    keyboard = types.InlineKeyboardMarkup(row_width=1)
+    
+    for trip in trips:
+        # Создаем строку кнопок для каждого путешествия
+        row_buttons = []
+        
+        # Кнопка переключения (если неактивно) или просмотра (если активно)
+        if trip["is_active"]:
+            row_buttons.append(types.InlineKeyboardButton(
+                f"👁 {trip['from_country']} → {trip['to_country']}",
+                callback_data=f"view_trip|{trip['id']}"
+            ))
+        else:
+            row_buttons.append(types.InlineKeyboardButton(
+                f"🔄 {trip['from_country']} → {trip['to_country']}",
+                callback_data=f"switch_trip|{trip['id']}"
+            ))
+        
+        # Кнопка удаления
+        row_buttons.append(types.InlineKeyboardButton(
+            "🗑",
+            callback_data=f"delete_trip|{trip['id']}"
+        ))
+        
+        keyboard.add(*row_buttons)
+    
+    navigation = []
+    if trips and has_older:
+        navigation.append(types.InlineKeyboardButton(
+            "◀ Раньше", callback_data=f"trips_page|older|{trips[-1]['id']}"))
+    if trips and has_newer:
+        navigation.append(types.InlineKeyboardButton(
+            "Позже ▶", callback_data=f"trips_page|newer|{trips[0]['id']}"))
+    if navigation:
+        keyboard.row(*navigation)
+    
+    keyboard.add(types.InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu"))
+    
+    text = "📋 Ваши путешествия:\n\n"
+    text += "👁 - просмотр активного\n"
+    text += "🔄 - активировать\n"
+    text += "🗑 - удалить\n\n"
+    text += "Выберите действие:"
+    
+    return keyboard, text
+
+
+def parse_trips_page(data: str) -> tuple[Optional[int], Optional[int]]:
+    """Разбирает callback_data страницы списка путешествий в (before_id, after_id)"""
+    _, direction, cursor_id = data.split("|")
+    if direction == "newer":
+        return None, int(cursor_id)
+    return int(cursor_id), None
+
+
+class TripListCache:
+    """
+    Отрисованные страницы списка путешествий (клавиатура и текст).
+    
+    Запись хранит версию списка пользователя (Database.get_trip_list_version),
+    при которой она построена; после создания, переключения или удаления
+    путешествия версия меняется и запись перестает совпадать. Размер
+    ограничен, вытесняются давно не использованные страницы.
+    """
+    
+    def __init__(self, max_size: int = TRIP_LIST_CACHE_SIZE):
+        self.max_size = max_size
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, user_id: int, page_key: str, version: int):
+        """Возвращает (клавиатура, текст) или None, если страницы нет или она устарела"""
+        with self._lock:
+            entry = self._pages.get((user_id, page_key))
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._pages.move_to_end((user_id, page_key))
+            self.hits += 1
+            return entry[1]
+    
+    def put(self, user_id: int, page_key: str, version: int, page):
+        with self._lock:
+            self._pages[(user_id, page_key)] = (version, page)
+            self._pages.move_to_end((user_id, page_key))
+            while len(self._pages) > self.max_size:
+                self._pages.popitem(last=False)
+
+
+def get_delete_confirmation(trip: dict):
+    """Запрос подтверждения удаления путешествия: текст и клавиатура"""
+    text = (
+        f"⚠️ Подтвердите удаление путешествия:\n\n"
+        f"📍 Из: {trip['from_country']} ({trip['from_currency']})\n"
+        f"📍 В: {trip['to_country']} ({trip['to_currency']})\n"
+        f"💰 Баланс: {trip['balance_to']:.2f} {trip['to_currency']} = {trip['balance_from']:.2f} {trip['from_currency']}\n\n"
+        f"Это действие нельзя отменить!"
+    )
+    
+    keyboard = types.InlineKeyboardMarkup()
+    keyboard.add(types.InlineKeyboardButton("✅ Да, удалить", callback_data=f"confirm_delete|{trip['id']}"))
+    keyboard.add(types.InlineKeyboardButton("❌ Отмена", callback_data="my_trips"))
+    
+    return text, keyboard
+
+
+def get_history_text(trip: dict, expenses: list[dict]) -> str:
+    """Текст страницы истории расходов"""
+    if not expenses:
+        return EMPTY_HISTORY_TEXT
+    
+    text = f"📊 История расходов (всего {trip['expense_count']}):\n\n"
+    
+    for exp in expenses:
+        timestamp = exp["timestamp"].split()[0] if exp["timestamp"] else "N/A"
+        # Используем точные значения из базы данных
+        amount_to = float(exp["amount_to"])
+        amount_from = float(exp["amount_from"])
+        
+        text += (
+            f"📅 {timestamp}\n"
+            f"   {amount_to:.2f} {trip['to_currency']} = "
+            f"{amount_from:.2f} {trip['from_currency']}\n\n"
+        )
+    
+    # Итоги по всему путешествию, а не только по странице
+    text += (
+        f"━━━━━━━━━━━━━━━━━━━━\n"
+        f"💸 Всего потрачено:\n"
+        f"{trip['spent_to']:.2f} {trip['to_currency']} = {trip['spent_from']:.2f} {trip['from_currency']}"
+    )
+    return text
+
+
+def get_history_keyboard(trip_id: int, expenses: list[dict], has_older: bool, has_newer: bool):
+    """
+    Кнопки листания истории и возврата в меню.
+    
+    Курсор страницы (id крайнего расхода) передается в callback_data:
+    history_page|<trip_id>|older|<id> или history_page|<trip_id>|newer|<id>.
+    """
+    keyboard = types.InlineKeyboardMarkup(row_width=2)
+    
+    navigation = []
+    if expenses and has_older:
+        navigation.append(types.InlineKeyboardButton(
+            "◀ Раньше", callback_data=f"history_page|{trip_id}|older|{expenses[-1]['id']}"))
+    if expenses and has_newer:
+        navigation.append(types.InlineKeyboardButton(
+            "Позже ▶", callback_data=f"history_page|{trip_id}|newer|{expenses[0]['id']}"))
+    if navigation:
+        keyboard.row(*navigation)
+    
+    keyboard.add(types.InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu"))
+    return keyboard
+
+
+def parse_history_page(data: str) -> tuple[int, Optional[int], Optional[int]]:
+    """Разбирает callback_data страницы истории в (trip_id, before_id, after_id)"""
+    _, trip_id, direction, cursor_id = data.split("|")
+    if direction == "newer":
+        return int(trip_id), None, int(cursor_id)
+    return int(trip_id), int(cursor_id), None
+
+
+def parse_export_format(text: str) -> Optional[str]:
+    """Формат из команды /export [csv|json] (по умолчанию csv), None - неизвестный"""
+    parts = text.split()
+    fmt = parts[1].lower() if len(parts) > 1 else "csv"
+    return fmt if fmt in ("csv", "json") else None
+
+
+def get_export_caption(trip: dict, count: int) -> str:
+    """Подпись к файлу выгрузки"""
+    return f"📤 {trip['from_country']} → {trip['to_country']}: расходов {count}"
+
+
+def get_import_progress_text(imported: int) -> str:
+    """Ход импорта"""
+    return f"📥 Импорт расходов: записано {imported}..."
+
+
+def get_import_result_text(trip: dict, result) -> str:
+    """Итог импорта (ImportResult): сколько записано и какие строки пропущены"""
+    text = (
+        f"📥 Импортировано расходов: {result.imported}\n"
+        f"💸 {result.amount_to:.2f} {trip['to_currency']} = {result.amount_from:.2f} {trip['from_currency']}"
+    )
+    if result.error_count:
+        text += f"\n\n⚠️ Пропущено строк: {result.error_count}"
+        for line, reason in result.errors:
+            text += f"\n• строка {line}: {reason}" if line else f"\n• {reason}"
+    if result.truncated:
+        text += "\n\n⚠️ Файл обработан не полностью."
+    return text
+
+
+def get_set_rate_text(trip: dict) -> str:
+    """Запрос нового курса для путешествия"""
+    return (
+        f"💱 Изменение курса обмена\n\n"
+        f"Текущий курс: 1 {trip['from_currency']} = {trip['rate']:.6f} {trip['to_currency']}\n\n"
+        f"Введите новый курс (сколько {trip['to_currency']} за 1 {trip['from_currency']}):"
+    )
+
+
+def format_expense_line(trip: dict, amount_to: float, amount_from: float,
+                        description: Optional[str]) -> str:
+    """Строка расхода: сумма в обеих валютах и описание"""
+    line = f"{amount_to:.2f} {trip['to_currency']} = {amount_from:.2f} {trip['from_currency']}"
+    return f"{line} ({description})" if description else line
+
+
+def format_skipped(skipped: list[str]) -> str:
+    """Предупреждение о фрагментах сообщения, которые не будут учтены"""
+    shown = ", ".join(f"«{fragment}»" for fragment in skipped[:MAX_SKIPPED_SHOWN])
+    if len(skipped) > MAX_SKIPPED_SHOWN:
+        shown += f" и еще {len(skipped) - MAX_SKIPPED_SHOWN}"
+    return f"⚠️ Не разобрано и не будет учтено: {shown}\n\n"
+
+
+def get_expense_confirmation(trip: dict, expenses: list[tuple], skipped: Optional[list[str]] = None):
+    """
+    Запрос подтверждения расходов: текст и клавиатура.
+    
+    expenses - список (amount_to, amount_from, description); несколько
+    расходов из одного сообщения подтверждаются одной кнопкой. skipped -
+    фрагменты сообщения, которые не удалось разобрать (о них предупреждаем).
+    """
+    warning = format_skipped(skipped) if skipped else ""
+    if len(expenses) == 1:
+        text = (
+            f"💸 Расход: {format_expense_line(trip, *expenses[0])}\n\n"
+            f"{warning}"
+            f"Учесть как расход?"
+        )
+    else:
+        total_to = sum(expense[0] for expense in expenses)
+        total_from = sum(expense[1] for expense in expenses)
+        lines = "\n".join(f"• {format_expense_line(trip, *expense)}" for expense in expenses)
+        text = (
+            f"💸 Расходы ({len(expenses)}):\n\n"
+            f"{lines}\n\n"
+            f"Итого: {total_to:.2f} {trip['to_currency']} = {total_from:.2f} {trip['from_currency']}\n\n"
+            f"{warning}"
+            f"Учесть как расходы?"
+        )
+    
+    keyboard = types.InlineKeyboardMarkup()
+    keyboard.add(types.InlineKeyboardButton("✅ Да", callback_data="expense_yes"))
+    keyboard.add(types.InlineKeyboardButton("❌ Нет", callback_data="expense_no"))
+    
+    return text, keyboard
+
+
+def get_expenses_added_text(trip: dict, expenses: list[tuple]) -> str:
+    """Всплывающее уведомление после учета расходов"""
+    total_to = sum(expense[0] for expense in expenses)
+    if len(expenses) == 1:
+        return f"✅ Расход учтен: {total_to:.2f} {trip['to_currency']}"
+    return f"✅ Учтено расходов: {len(expenses)} на {total_to:.2f} {trip['to_currency']}"
+
+
+def format_expense_state(trip_id: int, expenses: list[tuple], message_id: int) -> str:
+    """Данные состояния подтверждения расходов (JSON)"""
+    return json.dumps({"trip_id": trip_id, "expenses": expenses, "message_id": message_id},
+                      ensure_ascii=False)
+
+
+def parse_expense_state(data: str) -> tuple[int, list[tuple], Optional[int]]:
+    """Разбирает данные состояния подтверждения: (trip_id, расходы, message_id)"""
+    if not data.startswith("{"):
+        # Состояние, сохраненное до пакетного ввода: trip_id|amount_to|amount_from|message_id
+        state_parts = data.split("|")
+        user_message_id = int(state_parts[3]) if len(state_parts) > 3 else None
+        return int(state_parts[0]), [(float(state_parts[1]), float(state_parts[2]), None)], user_message_id
+    
+    state = json.loads(data)
+    expenses = [(float(to), float(frm), description) for to, frm, description in state["expenses"]]
+    return int(state["trip_id"]), expenses, state.get("message_id")
+
+
+def parse_positive_number(text: str) -> Optional[float]:
+    """Разбирает положительное число (курс или сумму), допускает запятую и пробелы"""
+    try:
+        value = float(text.strip().replace(",", ".").replace(" ", ""))
+    except ValueError:
+        return None
+    return value if value > 0 else None
+
+
+# Разделители расходов в одной строке: ";" или запятая с пробелом
+# (запятая без пробела - десятичная: "12,5")
+_EXPENSE_SEPARATOR = re.compile(r";|,\s+")
+_AMOUNT = re.compile(r"\d+(?:[.,]\d+)?")
+# Пробел между разрядами: "1 200", "2 500,50" (в том числе неразрывный)
+_THOUSANDS_SPACE = re.compile(r"(?<=\d)[ \u00a0\u202f](?=\d{3}(?!\d))")
+# Сколько неразобранных фрагментов перечислять в подтверждении
+MAX_SKIPPED_SHOWN = 5
+
+
+def parse_expense_item(item: str) -> tuple[Optional[tuple[float, Optional[str]]], Optional[str]]:
+    """
+    Разбирает один расход ("1 200", "кофе 3,5", "такси 1 200").
+    
+    Returns:
+        tuple: ((сумма, описание) или None, неразобранный остаток или None);
+        остаток - числа после суммы без описания ("12.5,30,7" -> 12.5 и "30,7")
+        или весь фрагмент, если суммы в нем нет
+    """
+    item = _THOUSANDS_SPACE.sub("", item.strip())
+    match = _AMOUNT.search(item)
+    if not match:
+        return None, item or None
+    amount = float(match.group().replace(",", "."))
+    if amount <= 0:
+        return None, item
+    
+    # Первое число - сумма, остальной текст - описание
+    rest = f"{item[:match.start()]} {item[match.end():]}".strip(" -–—:.,")
+    if rest and not re.search(r"[^\W\d_]", rest):
+        # Без букв это не описание, а еще числа, которые не удалось разделить
+        return (amount, None), rest
+    description = " ".join(rest.split())[:MAX_DESCRIPTION_LENGTH] or None
+    return (amount, description), None
+
+
+def parse_expense_batch(text: str) -> tuple[list[tuple[float, Optional[str]]], list[str]]:
+    """
+    Извлекает расходы из сообщения: "12.5, 30, 7" или несколько строк
+    с описаниями ("такси 15\nкофе 3,5").
+    
+    Returns:
+        tuple: (сумма, описание) для каждого расхода, не больше MAX_BATCH_EXPENSES,
+        и фрагменты, которые не учтены (без суммы, не разобраны или сверх лимита)
+    """
+    expenses = []
+    skipped = []
+    for line in text.splitlines():
+        for item in _EXPENSE_SEPARATOR.split(line):
+            parsed, rest = parse_expense_item(item)
+            if parsed and len(expenses) < MAX_BATCH_EXPENSES:
+                expenses.append(parsed)
+            elif parsed:
+                skipped.append(item.strip())
+            if rest:
+                skipped.append(rest)
+    return expenses, skipped
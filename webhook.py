@@ -0,0 +1,178 @@
+"""
+Режим вебхука: встроенный HTTP-сервер принимает апдейты от Telegram.
+
+Запрос проверяется по секретному токену, апдейт кладется в очередь своего
+пользователя (см. workers.py), а ответ 200 отправляется сразу, поэтому
+медленный обработчик не задерживает ответ Telegram. Без секрета сервер не
+запускается: иначе любой, кто достучится до порта, сможет отправлять апдейты
+от имени любого пользователя.
+"""
+import hmac
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+
+import telebot
+from telebot import types
+from dotenv import load_dotenv
+
+from workers import KeyedWorkerPool, create_update_pool, submit_update
+
+load_dotenv()
+
+# Публичный адрес, который регистрируется в Telegram (если не задан, вебхук
+# не регистрируется - удобно для локальной проверки POST-запросами)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+# Адрес и порт, на которых слушает встроенный сервер
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token (обязателен, им же
+# защищен /stats)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Максимальный размер тела запроса, байты
+WEBHOOK_MAX_BODY = 1024 * 1024
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """HTTP-приемник апдейтов, передающий их в пул обработчиков"""
+    
+    def __init__(self, bot: telebot.TeleBot, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT,
+                 path: str = WEBHOOK_PATH, secret: Optional[str] = WEBHOOK_SECRET,
+                 pool: Optional[KeyedWorkerPool] = None,
+                 stats_providers: Optional[Dict[str, Callable[[], dict]]] = None):
+        if not secret:
+            raise ValueError("WEBHOOK_SECRET не найден в переменных окружения!")
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.pool = pool or create_update_pool(bot)
+        # Дополнительные разделы /stats: имя -> функция, возвращающая dict
+        self.stats_providers = stats_providers or {}
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+    
+    @property
+    def port(self) -> int:
+        """Фактический порт (полезно, если сервер запущен на порту 0)"""
+        return self.httpd.server_address[1]
+    
+    def _make_handler(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    self._reply(404)
+                    return
+                if not self._authorized():
+                    self._reply(403)
+                    return
+                
+                try:
+                    length = int(self.headers.get("Content-Length", "0"))
+                except ValueError:
+                    length = -1
+                if length <= 0 or length > WEBHOOK_MAX_BODY:
+                    self._reply(400)
+                    return
+                
+                try:
+                    data = json.loads(self.rfile.read(length))
+                    # Апдейт Telegram - всегда объект с update_id; null, списки
+                    # и прочий JSON отклоняем здесь, а не в обработчике
+                    if not isinstance(data, dict) or "update_id" not in data:
+                        raise ValueError("не апдейт Telegram")
+                    update = types.Update.de_json(data)
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    self._reply(400)
+                    return
+                
+                # При переполненной очереди отвечаем 503, и Telegram повторит доставку позже
+                if not submit_update(server.pool, update):
+                    print("Очередь апдейтов переполнена, апдейт отклонен")
+                    self._reply(503)
+                    return
+                self._reply(200)
+            
+            def do_GET(self):
+                if self.path == "/health":
+                    # Проверка живости для балансировщика
+                    self._reply(200)
+                elif self.path == "/stats":
+                    # Статистика доступна только с тем же секретом, что и прием апдейтов
+                    if not self._authorized():
+                        self._reply(403)
+                        return
+                    # Глубина очередей и время ожидания апдейтов, затем дополнительные разделы
+                    stats = server.pool.stats()
+                    for name, provider in server.stats_providers.items():
+                        stats[name] = provider()
+                    self._reply(200, json.dumps(stats).encode())
+                else:
+                    self._reply(404)
+            
+            def _authorized(self) -> bool:
+                # Сравнение за постоянное время, чтобы секрет нельзя было подобрать по задержке
+                header = self.headers.get(SECRET_HEADER, "")
+                return hmac.compare_digest(header.encode(), server.secret.encode())
+            
+            def _reply(self, status: int, body: bytes = b""):
+                self.send_response(status)
+                if body:
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if body:
+                    self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                # Не пишем строку в лог на каждый апдейт
+                pass
+        
+        return Handler
+    
+    def start(self):
+        """Запускает рабочие потоки и HTTP-сервер в фоне"""
+        self.pool.start()
+        threading.Thread(target=self.httpd.serve_forever, name="webhook-http", daemon=True).start()
+    
+    def serve_forever(self):
+        """Запускает рабочие потоки и обслуживает HTTP в текущем потоке"""
+        self.pool.start()
+        self.httpd.serve_forever()
+    
+    def stop(self):
+        """Останавливает прием запросов и дожидается обработки очереди"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.pool.stop()
+
+
+def run_webhook(bot: telebot.TeleBot, stats_providers: Optional[Dict[str, Callable[[], dict]]] = None):
+    """Регистрирует вебхук (если задан WEBHOOK_URL) и обслуживает апдейты.
+    
+    Без WEBHOOK_SECRET не запускается (ValueError).
+    """
+    server = WebhookServer(bot, stats_providers=stats_providers)
+    
+    if WEBHOOK_URL:
+        bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            drop_pending_updates=False
+        )
+        print(f"Вебхук зарегистрирован: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+    else:
+        print("WEBHOOK_URL не задан, вебхук в Telegram не регистрируется")
+    
+    print(f"Прием апдейтов на {WEBHOOK_HOST}:{server.port}{WEBHOOK_PATH} "
+          f"({server.pool.workers} обработчиков)")
+    try:
+        server.serve_forever()
+    finally:
+        server.stop()
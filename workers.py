@@ -0,0 +1,262 @@
+"""
+Пул обработчиков апдейтов с сохранением порядка для каждого пользователя.
+
+Апдейт попадает в очередь, выбранную по from_user.id, поэтому сообщения и
+нажатия одного пользователя обрабатываются строго по очереди (например,
+подтверждение расхода не пересечется со следующим вводом суммы), а разные
+пользователи обслуживаются параллельно. Для AsyncTeleBot то же дает
+AsyncKeyedDispatcher: цепочка задач на пользователя в цикле событий.
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+import telebot
+from telebot import types
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Число очередей (и потоков) обработки апдейтов
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "4"))
+# Емкость каждой очереди
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "250"))
+
+# Поля апдейта, в которых может быть отправитель
+_UPDATE_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query",
+    "chosen_inline_result", "shipping_query", "pre_checkout_query",
+    "my_chat_member", "chat_member", "chat_join_request",
+)
+
+
+def get_update_user_id(update: types.Update) -> Optional[int]:
+    """Возвращает id отправителя апдейта или None"""
+    for field in _UPDATE_FIELDS:
+        obj = getattr(update, field, None)
+        user = getattr(obj, "from_user", None) if obj else None
+        if user:
+            return user.id
+    return None
+
+
+class KeyedWorkerPool:
+    """
+    N очередей с одним потоком на каждую.
+    
+    Ключ (id пользователя) всегда отображается в одну и ту же очередь, так что
+    элементы с одинаковым ключом обрабатываются последовательно и в порядке
+    поступления.
+    """
+    
+    def __init__(self, handler: Callable, workers: int = UPDATE_WORKERS,
+                 queue_size: int = UPDATE_QUEUE_SIZE, name: str = "update-worker"):
+        self.handler = handler
+        self.name = name
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+        # Время ожидания в очереди последних элементов (секунды)
+        self._waits = deque(maxlen=1000)
+        self.submitted = 0
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+    
+    @property
+    def workers(self) -> int:
+        return len(self._queues)
+    
+    def submit(self, key: Optional[int], item) -> bool:
+        """Ставит элемент в очередь ключа. Возвращает False, если очередь заполнена"""
+        # Без ключа порядок не важен - берем наименее загруженную очередь
+        if key is None:
+            target = min(self._queues, key=lambda q: q.qsize())
+        else:
+            target = self._queues[hash(key) % len(self._queues)]
+        
+        try:
+            target.put_nowait((time.perf_counter(), item))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        
+        with self._lock:
+            self.submitted += 1
+        return True
+    
+    def _run(self, q: queue.Queue):
+        while True:
+            entry = q.get()
+            if entry is None:
+                q.task_done()
+                return
+            enqueued, item = entry
+            wait = time.perf_counter() - enqueued
+            failed = False
+            try:
+                self.handler(item)
+            except Exception as e:
+                failed = True
+                print(f"Ошибка при обработке апдейта: {e}")
+            finally:
+                with self._lock:
+                    self.processed += 1
+                    if failed:
+                        self.failed += 1
+                    self._waits.append(wait)
+                q.task_done()
+    
+    def start(self):
+        """Запускает по потоку на каждую очередь"""
+        for i, q in enumerate(self._queues):
+            thread = threading.Thread(target=self._run, args=(q,), name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+    
+    def join(self):
+        """Дожидается обработки всех поставленных элементов"""
+        for q in self._queues:
+            q.join()
+    
+    def stop(self):
+        """Обрабатывает оставшиеся элементы и останавливает потоки"""
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+    
+    def stats(self) -> dict:
+        """Глубина очередей, счетчики и время ожидания в очереди (мс)"""
+        depths = [q.qsize() for q in self._queues]
+        with self._lock:
+            waits = sorted(self._waits)
+            stats = {
+                "queue_depths": depths,
+                "queued": sum(depths),
+                "submitted": self.submitted,
+                "processed": self.processed,
+                "rejected": self.rejected,
+                "failed": self.failed,
+            }
+        
+        if waits:
+            def percentile(p: float) -> float:
+                return round(waits[min(len(waits) - 1, int(len(waits) * p))] * 1000, 2)
+            
+            stats.update({
+                "wait_p50_ms": percentile(0.5),
+                "wait_p95_ms": percentile(0.95),
+                "wait_max_ms": round(waits[-1] * 1000, 2),
+            })
+        return stats
+
+
+class AsyncKeyedDispatcher:
+    """
+    Асинхронный вариант KeyedWorkerPool для AsyncTeleBot.
+    
+    Элементы с одним ключом выполняются цепочкой задач: каждая ждет
+    завершения предыдущей, поэтому порядок поступления сохраняется.
+    Элементы с разными ключами (и без ключа) выполняются параллельно.
+    """
+    
+    def __init__(self, handler: Callable[..., Awaitable]):
+        self.handler = handler
+        # Ключ -> последняя задача его цепочки
+        self._tails: dict = {}
+        # Ссылки на незавершенные задачи, чтобы их не собрал сборщик мусора
+        self._pending: set = set()
+    
+    def submit(self, key: Optional[int], item) -> asyncio.Task:
+        """Ставит элемент в цепочку ключа; вызывается из цикла событий"""
+        previous = self._tails.get(key) if key is not None else None
+        task = asyncio.create_task(self._run(previous, item))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        if key is not None:
+            self._tails[key] = task
+            task.add_done_callback(lambda done: self._release(key, done))
+        return task
+    
+    def _release(self, key: int, task: asyncio.Task):
+        # Цепочка закончилась, если после этой задачи ничего не поставлено
+        if self._tails.get(key) is task:
+            del self._tails[key]
+    
+    async def _run(self, previous: Optional[asyncio.Task], item):
+        if previous is not None:
+            # Результат и ошибка предыдущего элемента здесь не нужны
+            await asyncio.wait([previous])
+        try:
+            await self.handler(item)
+        except Exception as e:
+            print(f"Ошибка при обработке апдейта: {e}")
+    
+    async def join(self):
+        """Дожидается обработки всех поставленных элементов"""
+        while self._pending:
+            await asyncio.wait(list(self._pending))
+
+
+def install_async_ordering(bot) -> AsyncKeyedDispatcher:
+    """
+    Раздает апдейты AsyncTeleBot по цепочкам пользователей.
+    
+    AsyncTeleBot.polling обрабатывает каждую пачку апдейтов отдельной
+    задачей, а внутри пачки - все сообщения одновременно и раньше нажатий
+    кнопок, поэтому апдейты одного пользователя могут обгонять друг друга
+    (подтверждение расхода пересекается со следующим вводом суммы).
+    """
+    process = bot.process_new_updates
+    dispatcher = AsyncKeyedDispatcher(lambda update: process([update]))
+    
+    async def process_new_updates(updates: list):
+        for update in updates:
+            dispatcher.submit(get_update_user_id(update), update)
+    
+    bot.process_new_updates = process_new_updates
+    return dispatcher
+
+
+def create_update_pool(bot: telebot.TeleBot, workers: int = UPDATE_WORKERS,
+                       queue_size: int = UPDATE_QUEUE_SIZE) -> KeyedWorkerPool:
+    """Пул, передающий апдейты в обработчики бота"""
+    # Параллелизм обеспечивает пул, поэтому обработчики выполняются прямо
+    # в его потоке без второго пула TeleBot
+    bot.threaded = False
+    return KeyedWorkerPool(lambda update: bot.process_new_updates([update]), workers, queue_size)
+
+
+def submit_update(pool: KeyedWorkerPool, update: types.Update) -> bool:
+    """Ставит апдейт в очередь его отправителя"""
+    return pool.submit(get_update_user_id(update), update)
+
+
+def run_polling(bot: telebot.TeleBot, pool: KeyedWorkerPool, timeout: int = 20):
+    """
+    Long polling с раздачей апдейтов по очередям пользователей.
+    
+    Заменяет bot.polling(): собственный пул TeleBot не сохраняет порядок
+    апдейтов одного пользователя.
+    """
+    offset = None
+    while True:
+        try:
+            updates = bot.get_updates(offset=offset, timeout=timeout, long_polling_timeout=timeout)
+        except Exception as e:
+            print(f"Ошибка при получении апдейтов: {e}")
+            time.sleep(3)
+            continue
+        
+        for update in updates:
+            # При переполненной очереди ждем, а не теряем апдейт
+            while not submit_update(pool, update):
+                time.sleep(0.1)
+            offset = update.update_id + 1